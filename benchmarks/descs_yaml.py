@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+"""
+Measures loading and dumping of a YAML description file with many runs with
+the libyaml bindings and with pure Python, and loading it from the cache of
+parsed descriptions.
+
+Usage: PYTHONPATH=. benchmarks/descs_yaml.py [--runs 10000]
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import timeit
+
+import yaml
+
+from iotlab_controller.experiment.descs import file_handler
+
+
+def generate_descs(runs):
+    return {
+        'globals': {
+            'env': {'MODE': 'hwr'},
+            'nodes': [f'm3-{i}.grenoble.iot-lab.info' for i in range(1, 11)],
+            'run_wait': 60,
+        },
+        'unscheduled': [{
+            'name': 'benchmark',
+            'firmwares': [{'path': 'app', 'board': 'iotlab-m3'}],
+            'runs': [
+                {'name': f'run-{i}',
+                 'args': {'data_len': 16 * (i % 64), 'delay_ms': i % 1000},
+                 'env': {'MODE': 'sfr' if i % 2 else 'hwr'}}
+                for i in range(runs)
+            ],
+        }],
+    }
+
+
+def measure(filename, serializer, repeat):
+    handler = file_handler.DescriptionFileHandler(filename)
+
+    def load():
+        with open(filename, encoding='utf-8') as inp:
+            return handler.load_content(serializer.load(inp))
+
+    descs = load()
+    load_time = min(timeit.repeat(load, number=1, repeat=repeat))
+    dump_time = min(timeit.repeat(
+        lambda: serializer.dump(io.StringIO(), descs),
+        number=1, repeat=repeat,
+    ))
+    return load_time, dump_time
+
+
+def measure_cached(filename, repeat):
+    file_handler.DescriptionFileHandler(filename, cache=True).load()
+    return min(timeit.repeat(
+        lambda: file_handler.DescriptionFileHandler(filename,
+                                                    cache=True).load(),
+        number=1, repeat=repeat,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--runs', type=int, default=10000,
+                        help='Number of runs in the description file')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Number of measurements of which the best is '
+                             'reported')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'descs.yaml')
+        with open(filename, 'w', encoding='utf-8') as desc_file:
+            yaml.safe_dump(generate_descs(args.runs), desc_file)
+        print(f'{args.runs} runs, {os.path.getsize(filename)} bytes')
+        variants = [('pure Python', file_handler.YAMLSerializer(
+            pure_python=True
+        ))]
+        if yaml.__with_libyaml__:
+            variants.append(('libyaml', file_handler.YAMLSerializer()))
+        for name, serializer in variants:
+            load, dump = measure(filename, serializer, args.repeat)
+            print(f'{name:>12}: load {load:.3f}s, dump {dump:.3f}s')
+        load = measure_cached(filename, args.repeat)
+        print(f'{"cached":>12}: load {load:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
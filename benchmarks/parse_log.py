@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+"""
+Measures parsing of a serial_aggregator log with many lines, reading it in
+chunks and memory-mapping it. Exits with an error if fewer than 1M lines/s
+are parsed.
+
+Usage: PYTHONPATH=. benchmarks/parse_log.py [--lines 1000000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+from iotlab_controller.logs import parser
+
+
+MIN_LINES_PER_SEC = 1000000
+
+
+def generate_log(filename, lines):
+    with open(filename, 'w', encoding='utf-8') as log:
+        for i in range(lines):
+            log.write(f'{1634567 + i / 1000:.6f};m3-{i % 200};'
+                      f'Hello World {i}\n')
+
+
+def measure(filename, use_mmap, repeat):
+    return min(timeit.repeat(
+        lambda: parser.parse_log(filename, use_mmap=use_mmap),
+        number=1, repeat=repeat,
+    ))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description=__doc__)
+    args_parser.add_argument('-l', '--lines', type=int, default=1000000,
+                             help='Number of lines in the log')
+    args_parser.add_argument('-n', '--repeat', type=int, default=3,
+                             help='Number of measurements of which the best '
+                                  'is reported')
+    args = args_parser.parse_args()
+    too_slow = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'run.log')
+        generate_log(filename, args.lines)
+        print(f'{args.lines} lines, {os.path.getsize(filename)} bytes')
+        for name, use_mmap in [('chunked', False), ('mmap', True)]:
+            assert len(parser.parse_log(filename, use_mmap=use_mmap)) == \
+                args.lines
+            duration = measure(filename, use_mmap, args.repeat)
+            rate = args.lines / duration
+            print(f'{name:>8}: {duration:.3f}s, {rate:.0f} lines/s')
+            too_slow |= rate < MIN_LINES_PER_SEC
+    if too_slow:
+        sys.exit(f'Parsing is slower than {MIN_LINES_PER_SEC} lines/s')
+
+
+if __name__ == '__main__':
+    main()
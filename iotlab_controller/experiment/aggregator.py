@@ -0,0 +1,246 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import asyncio
+import logging
+import threading
+import time
+
+from ..experiment import base
+from ..experiment.stream import LineStream
+
+
+logger = logging.getLogger(__name__)
+
+
+def node_name(node):
+    """
+    Returns the name serial_aggregator uses for `node`.
+
+    >>> node_name("m3-1.grenoble.iot-lab.info")
+    'm3-1'
+    """
+    if not isinstance(node, str):
+        node = node.uri
+    return node.split(".")[0]
+
+
+def node_address(node, port):
+    """
+    Returns the address of the TCP serial port of the node named `node` as
+    seen from the IoT-LAB SSH frontend.
+
+    >>> node_address("m3-1", 20000)
+    ('m3-1', 20000)
+    >>> node_address("a8-1", 20000)
+    ('node-a8-1', 20000)
+    """
+    if node.startswith("a8-"):
+        # the serial port of the M3 of an A8 node is served by its Linux
+        return f"node-{node}", port
+    return node, port
+
+
+def parse_addresses(addresses):
+    """
+    Parses a mapping of node names to `<host>:<port>` strings into the
+    `addresses` of `SerialAggregator`. Raises a `ValueError` if `addresses`
+    is not in that format.
+
+    >>> parse_addresses({"m3-1": "localhost:2001"})
+    {'m3-1': ('localhost', 2001)}
+    >>> parse_addresses(None) is None
+    True
+    """
+    if addresses is None:
+        return None
+    if not isinstance(addresses, dict) or not addresses:
+        raise ValueError(f"{addresses!r} does not map node names to "
+                         "'<host>:<port>'")
+    res = {}
+    for node, address in addresses.items():
+        host, sep, port = str(address).rpartition(":")
+        if not sep or not host or not port.isdigit():
+            raise ValueError(f"{address!r} of {node} is not '<host>:<port>'")
+        res[node] = (host, int(port))
+    return res
+
+
+class SerialAggregator:
+    """
+    In-process replacement for IoT-LAB's serial_aggregator.
+
+    Connects to the TCP serial ports of `nodes` and writes all received lines
+    as `time;node;line` to the file `logname` (if provided) and `stream`.
+    `addresses` maps node names to `(host, port)` tuples, e.g. to connect
+    through an SSH tunnel. By default, the node's host name (`node-a8-<n>`
+    for A8 nodes) and `PORT` are used, which resolve on the IoT-LAB SSH
+    frontend.
+
+    Can be used both as asynchronous context manager within an event loop or
+    as synchronous context manager, which runs its own event loop in a
+    background thread.
+    """
+    # pylint: disable=too-many-instance-attributes
+    PORT = 20000
+    CONNECT_TIMEOUT = 10
+
+    def __init__(self, nodes, logname=None, addresses=None, stream=None):
+        self.nodes = [node_name(node) for node in nodes]
+        if addresses is None:
+            addresses = {}
+        self.addresses = {node: addresses.get(node,
+                                              node_address(node, self.PORT))
+                          for node in self.nodes}
+        self.logname = logname
+        if stream is None:
+            stream = LineStream()
+        self.stream = stream
+        self._log = None
+        self._loop = None
+        self._thread = None
+        self._writers = {}
+        self._tasks = []
+        self._queues = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    async def __aenter__(self):
+        await self._start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self._stop()
+
+    def _emit(self, line, node=None):
+        timestamp = time.time()
+        if node is None:
+            out = f"{timestamp:.6f};{line}"
+        else:
+            out = f"{timestamp:.6f};{node};{line}"
+            for queue in self._queues:
+                queue.put_nowait((timestamp, node, line))
+        if self._log is not None:
+            self._log.write(f"{out}\n")
+        self.stream.feed(out)
+
+    async def _connect(self, node):
+        host, port = self.addresses[node]
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port),
+                timeout=self.CONNECT_TIMEOUT,
+            )
+        except (OSError, asyncio.TimeoutError) as exc:
+            logger.warning("Unable to connect to %s (%s:%d): %s", node, host,
+                           port, exc or type(exc).__name__)
+            return
+        self._writers[node] = writer
+        self._tasks.append(asyncio.ensure_future(self._read(node, reader)))
+
+    async def _read(self, node, reader):
+        while True:
+            try:
+                line = await reader.readline()
+            except (OSError, ValueError) as exc:
+                logger.warning("Lost connection to %s: %s", node, exc)
+                break
+            if not line:
+                break
+            self._emit(line.rstrip(b"\r\n").decode("utf-8", errors="replace"),
+                       node=node)
+
+    async def _start(self):
+        if self.logname is not None:
+            # pylint: disable=consider-using-with
+            self._log = open(self.logname, "a", encoding="utf-8",
+                             buffering=1)
+        await asyncio.gather(*(self._connect(node) for node in self.nodes))
+        if not self._writers:
+            await self._stop()
+            raise base.ExperimentError(
+                "Unable to connect to any node for serial_aggregator"
+            )
+        self._emit("Aggregator started")
+
+    async def _stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        for queue in self._queues:
+            queue.put_nowait(None)
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    async def lines(self):
+        """
+        Asynchronously iterates over `(timestamp, node, line)` tuples of all
+        lines received from the start of the iteration until the aggregator
+        is stopped.
+        """
+        queue = asyncio.Queue()
+        self._queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            self._queues.remove(queue)
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        try:
+            self.run_coroutine(self._start())
+        except base.ExperimentError:
+            self._stop_loop()
+            raise
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self.run_coroutine(self._stop())
+        self._stop_loop()
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    def run_coroutine(self, coro, timeout=None):
+        """
+        Runs `coro` in the event loop of an aggregator started with
+        `start()` and returns its result, e.g. to consume `lines()` from
+        synchronous code.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop) \
+            .result(timeout)
+
+    def send(self, node, data):
+        """
+        Writes `data` to the serial port of `node`.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        writer = self._writers[node_name(node)]
+        if self._loop is None:
+            writer.write(data)
+        else:
+            self._loop.call_soon_threadsafe(writer.write, data)
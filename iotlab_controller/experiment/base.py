@@ -2,6 +2,7 @@
 #
 # Distributed under terms of the MIT license.
 
+import datetime
 import urllib
 
 import iotlabcli.auth
@@ -11,6 +12,9 @@ from iotlab_controller import common
 from iotlab_controller import nodes
 
 
+IOTLAB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
 class ExperimentError(Exception):
     pass
 
@@ -84,11 +88,14 @@ class BaseExperiment:
         for exp_id in exps.get("Waiting", []):
             yield _get_exp(exp_id)
 
-    def _check_experiment(self):
+    def _get_experiment(self):
         try:
-            exp = iotlabcli.experiment.get_experiment(self.api, self.exp_id)
+            return iotlabcli.experiment.get_experiment(self.api, self.exp_id)
         except urllib.error.HTTPError as exc:
             raise ExperimentError(exc.reason) from exc
+
+    def _check_experiment(self):
+        exp = self._get_experiment()
         if exp["state"] in ["Error", "Terminated", "Stopped"]:
             raise ExperimentError(
                 f"{self} terminated or had an error"
@@ -149,6 +156,26 @@ class BaseExperiment:
             self.api, self.name, duration, resources, start_time
         )["id"]
 
+    def end_time(self):
+        if not self.is_scheduled():
+            raise ExperimentError(f"{self} is not scheduled")
+        exp = self._get_experiment()
+        start_date = exp.get("start_date")
+        duration = exp.get("submitted_duration")
+        if not start_date or duration is None:
+            # experiment did not start yet
+            return None
+        start_time = datetime.datetime.strptime(start_date, IOTLAB_DATE_FORMAT)
+        start_time = start_time.replace(tzinfo=datetime.timezone.utc)
+        return start_time + datetime.timedelta(minutes=int(duration))
+
+    def remaining_time(self):
+        end_time = self.end_time()
+        if end_time is None:
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max((end_time - now).total_seconds(), 0)
+
     def stop(self):
         if self.is_scheduled():
             iotlabcli.experiment.stop_experiment(self.api, self.exp_id)
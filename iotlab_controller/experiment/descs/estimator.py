@@ -0,0 +1,130 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import contextlib
+import math
+import time
+
+
+class DurationEstimator:
+    # fallbacks in seconds for phases which were not measured yet
+    DEFAULT_TIMINGS = {
+        'reflash': 120,     # build and flash of all firmwares
+        'reset': 5,
+    }
+    # time in seconds for node deployment at experiment start
+    EXP_OVERHEAD = 120
+    SAFETY_FACTOR = 1.1
+    # limit for the weight of historical measurements, so the estimate is
+    # able to adapt to changed conditions
+    MAX_SAMPLES = 50
+
+    def __init__(self, timings=None, run_overhead=0):
+        if timings is None:
+            timings = {}
+        self.timings = timings
+        self.run_overhead = run_overhead
+
+    def timing(self, phase):
+        """
+        >>> estimator = DurationEstimator(run_overhead=3)
+        >>> estimator.timing('reset')
+        5
+        >>> estimator.timing('run')
+        3
+        >>> estimator.record('reset', 2)
+        >>> estimator.record('reset', 4)
+        >>> estimator.timing('reset')
+        3.0
+        """
+        if phase in self.timings:
+            return self.timings[phase]['mean']
+        if phase == 'run':
+            return self.run_overhead
+        return self.DEFAULT_TIMINGS[phase]
+
+    def record(self, phase, seconds):
+        timing = self.timings.setdefault(phase, {'mean': 0.0, 'count': 0})
+        timing['count'] = min(timing['count'] + 1, self.MAX_SAMPLES)
+        timing['mean'] += (seconds - timing['mean']) / timing['count']
+
+    @contextlib.contextmanager
+    def measure(self, phase, offset=0):
+        start = time.monotonic()
+        yield
+        self.record(phase, max(time.monotonic() - start - offset, 0))
+
+    def estimate_run(self, runner, run, last_run=None):
+        wait = run.get('wait')
+        if wait is None:
+            return None
+        res = wait + self.timing('run')
+        if runner.needs_reflash(run, last_run) or \
+           (runner.coalesced and last_run is None):
+            res += self.timing('reflash')
+        if run.get('reset', True):
+            res += self.timing('reset')
+        return res
+
+    def estimate_matrix(self, runner, matrix, last_run=None):
+        """
+        Estimates the pending runs of `matrix` without generating all of
+        them: the runs of its cartesian product only differ in 'args' and
+        'env', so they take the same time, apart from a rebuild for (at most)
+        each combination of the 'env' axes.
+        """
+        res = 0
+        run = matrix.first_pending_product_run()
+        if run is not None:
+            run_time = self.estimate_run(runner, run, run)
+            if run_time is None:
+                return None
+            if matrix.env_combinations:
+                reflashes = min(matrix.env_combinations,
+                                matrix.num_pending_product())
+            else:
+                reflashes = int(runner.needs_reflash(run, last_run) or
+                                (runner.coalesced and last_run is None))
+            res += matrix.num_pending_product() * run_time + \
+                reflashes * self.timing('reflash')
+            last_run = run
+        includes_time = self.estimate_runs(runner, matrix.pending_includes(),
+                                           last_run)
+        if includes_time is None:
+            return None
+        return res + includes_time
+
+    def estimate_runs(self, runner, runs=None, last_run=None):
+        if runs is None:
+            res = self.estimate_runs(runner, runner.runs, last_run)
+            if runner.matrix is None or res is None:
+                return res
+            if runner.runs:
+                last_run = runner.runs[-1]
+            matrix_time = self.estimate_matrix(runner, runner.matrix,
+                                               last_run)
+            return None if matrix_time is None else res + matrix_time
+        res = 0
+        for run in runs:
+            run_time = self.estimate_run(runner, run, last_run)
+            if run_time is None:
+                return None
+            res += run_time
+            last_run = run
+        return res
+
+    def estimate_duration(self, runner, overhead=True):
+        """
+        Estimates the duration of the experiment of `runner` in minutes.
+        Returns `None` if there are no runs or a run does not provide a
+        'wait' time. If `overhead` is `False`, the setup of the reservation
+        is not included (e.g. because it is shared with another experiment).
+        """
+        if not runner.num_pending_runs():
+            return None
+        runs_time = self.estimate_runs(runner)
+        if runs_time is None:
+            return None
+        overhead = self.EXP_OVERHEAD if overhead else 0
+        return math.ceil((overhead + runs_time * self.SAFETY_FACTOR) / 60)
@@ -3,31 +3,57 @@
 # Distributed under terms of the MIT license.
 
 import abc
+import bisect
+import hashlib
+import io
 import json
+import logging
+import os
+import pickle
+import time
 
 import yaml
-
-
-GLOBAL_EXP_KEYS = ['duration', 'env', 'firmwares', 'name', 'nodes', 'profiles',
-                   'run_name', 'results_dir', 'run_wait', 'sink_firmware',
-                   'serial_aggregator_color', 'site', 'target_args', 'tmux']
+try:
+    # the libyaml bindings are about ten times faster than pure Python
+    from yaml import CSafeDumper as _SafeDumper, CSafeLoader as _SafeLoader
+except ImportError:                                 # pragma: no cover
+    from yaml import SafeDumper as _SafeDumper, SafeLoader as _SafeLoader
+
+
+GLOBAL_EXP_KEYS = ['compress_logs', 'demux_logs', 'duration', 'env',
+                   'firmwares', 'groups', 'name', 'nodes', 'on_output',
+                   'profiles', 'run_name', 'results_dir', 'run_wait',
+                   'sink_firmware', 'serial_aggregator',
+                   'serial_aggregator_addresses', 'serial_aggregator_color',
+                   'site', 'stop_when_done',
+                   'target_args', 'tmux', 'until', 'until_quorum']
 REQUIRED_EXP_KEYS = ['name']
 EXP_RUN_KEYS = {
+    'compress_logs': 'compress_logs',
+    'demux_logs': 'demux_logs',
     'env': 'env',
     'firmwares': 'firmwares',
     'name': 'run_name',
+    'on_output': 'on_output',
     'profiles': 'profiles',
     'wait': 'run_wait',
+    'serial_aggregator': 'serial_aggregator',
+    'serial_aggregator_addresses': 'serial_aggregator_addresses',
     'serial_aggregator_color': 'serial_aggregator_color',
     'sink_firmwares': 'sink_firmware',
     'site': 'site',
-    'tmux': 'tmux'
+    'tmux': 'tmux',
+    'until': 'until',
+    'until_quorum': 'until_quorum',
 }
 FIRMWARE_ENCLOSURE_KEYS = {
     'env': 'env',
 }
 
 
+logger = logging.getLogger(__name__)
+
+
 class DescriptionError(Exception):
     pass
 
@@ -77,6 +103,268 @@ class NestedDescriptionBase(dict):
         return res
 
 
+def _add_index_range(ranges, first, last):
+    """
+    Adds the indices `first` to `last` to the sorted list of disjoint
+    `[first, last]` ranges `ranges`.
+
+    >>> ranges = [[0, 1], [5, 5]]
+    >>> _add_index_range(ranges, 2, 3)
+    >>> _add_index_range(ranges, 4, 4)
+    >>> _add_index_range(ranges, 8, 9)
+    >>> ranges
+    [[0, 5], [8, 9]]
+    """
+    pos = bisect.bisect_left(ranges, [first])
+    if pos > 0 and ranges[pos - 1][1] >= first - 1:
+        pos -= 1
+        first = ranges[pos][0]
+    end = pos
+    while end < len(ranges) and ranges[end][0] <= last + 1:
+        last = max(last, ranges[end][1])
+        end += 1
+    ranges[pos:end] = [[first, last]]
+
+
+def _parse_index_ranges(ranges):
+    """
+    Parses indices in the range syntax of `nodes.id_ranges()`.
+
+    >>> _parse_index_ranges('0-3+5+4+8-9')
+    [[0, 5], [8, 9]]
+    >>> _parse_index_ranges('')
+    []
+    """
+    if isinstance(ranges, int) and not isinstance(ranges, bool):
+        ranges = str(ranges)
+    if not isinstance(ranges, str):
+        raise DescriptionError(f"Invalid index ranges {ranges!r}")
+    res = []
+    for rng in filter(None, ranges.split('+')):
+        first, _, last = rng.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError as exc:
+            raise DescriptionError(
+                f"Invalid index range {rng!r} in {ranges!r}"
+            ) from exc
+        if first < 0 or last < first:
+            raise DescriptionError(
+                f"Invalid index range {rng!r} in {ranges!r}"
+            )
+        _add_index_range(res, first, last)
+    return res
+
+
+def _format_index_ranges(ranges):
+    return '+'.join(str(first) if first == last else f'{first}-{last}'
+                    for first, last in ranges)
+
+
+class RunMatrix(dict):
+    """
+    Generates the runs of an experiment from its 'matrix': the cartesian
+    product of the values of the 'args' and 'env' axes, without the
+    combinations matching an entry of 'exclude', followed by the runs in
+    'include'. Runs are only generated when needed, runs that were executed
+    are tracked by their index in 'done'.
+
+    The 'env' axes vary slowest, so firmwares are rebuilt as seldom as
+    possible. Changing the axes of a matrix changes the indices of its runs.
+
+    >>> matrix = RunMatrix({
+    ...     'args': {'len': [16, 32]},
+    ...     'env': {'MODE': ['a', 'b']},
+    ...     'exclude': [{'args': {'len': 32}, 'env': {'MODE': 'b'}}],
+    ...     'include': [{'args': {'len': 64}, 'wait': 20}],
+    ... })
+    >>> [(run.env, run['args']) for run in matrix.pending()]
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [({'MODE': 'a'}, {'len': 16}), ({'MODE': 'a'}, {'len': 32}),
+     ({'MODE': 'b'}, {'len': 16}), ({}, {'len': 64})]
+    >>> matrix.mark_done(4)
+    >>> matrix.mark_done(0)
+    >>> matrix['done']
+    '0+4'
+    >>> list(matrix.pending_indices())
+    [1, 2]
+    """
+    KEYS = {'args', 'env', 'exclude', 'include', 'done'}
+
+    def __init__(self, *args, enclosure=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._enclosure = enclosure
+        unknown = set(self) - self.KEYS
+        if unknown:
+            raise DescriptionError(
+                f"Unknown keys {', '.join(sorted(unknown))} in 'matrix'"
+            )
+        self._axes = []
+        for section in ('env', 'args'):
+            axes = self.get(section, {})
+            if not isinstance(axes, dict):
+                raise DescriptionError(
+                    f"'{section}' in 'matrix' must be a mapping to lists of "
+                    f"values, not {axes!r}"
+                )
+            for key, values in axes.items():
+                if not isinstance(values, list) or not values:
+                    raise DescriptionError(
+                        f"Values of '{key}' in 'matrix' must be a non-empty "
+                        f"list, not {values!r}"
+                    )
+                self._axes.append((section, key, values))
+        for key in ('exclude', 'include'):
+            entries = self.get(key, [])
+            if not isinstance(entries, list) or \
+               not all(isinstance(entry, dict) for entry in entries):
+                raise DescriptionError(
+                    f"'{key}' in 'matrix' must be a list of mappings, not "
+                    f"{entries!r}"
+                )
+        self._done = _parse_index_ranges(self.get('done', ''))
+        # number of pending runs of the cartesian product, counted on first
+        # use and then kept up to date by `mark_done()`
+        self._num_pending_product = None
+
+    @property
+    def product_size(self):
+        if not self._axes:
+            return 0
+        res = 1
+        for _, _, values in self._axes:
+            res *= len(values)
+        return res
+
+    @property
+    def env_combinations(self):
+        """
+        Number of combinations of the 'env' axes, 0 if there are none.
+        """
+        res = 0
+        for section, _, values in self._axes:
+            if section == 'env':
+                res = max(res, 1) * len(values)
+        return res
+
+    @property
+    def size(self):
+        """
+        Number of indices of the matrix, including excluded combinations.
+        """
+        return self.product_size + len(self.get('include', []))
+
+    def _combination(self, idx):
+        res = {}
+        for section, key, values in reversed(self._axes):
+            idx, pos = divmod(idx, len(values))
+            res.setdefault(section, {})[key] = values[pos]
+        # restore the order of the description
+        return {section: dict(reversed(list(values.items())))
+                for section, values in res.items()}
+
+    @staticmethod
+    def _matches(combination, entry):
+        for section, values in entry.items():
+            if not isinstance(values, dict):
+                return False
+            for key, value in values.items():
+                if key not in combination.get(section, {}) or \
+                   combination[section][key] != value:
+                    return False
+        return True
+
+    def _excluded(self, combination):
+        return any(self._matches(combination, entry)
+                   for entry in self.get('exclude', []))
+
+    def run(self, idx):
+        if not 0 <= idx < self.size:
+            raise IndexError(f'Run index {idx} out of range')
+        if idx < self.product_size:
+            run = self._combination(idx)
+        else:
+            run = dict(self['include'][idx - self.product_size])
+        run['__matrix_idx__'] = idx
+        return NestedDescriptionBase(run, enclosure=self._enclosure,
+                                     enclosure_keys=EXP_RUN_KEYS)
+
+    def is_done(self, idx):
+        pos = bisect.bisect_right(self._done, [idx, float('inf')])
+        return pos > 0 and self._done[pos - 1][1] >= idx
+
+    def _num_done(self, first, last):
+        return sum(max(min(end, last) - max(start, first) + 1, 0)
+                   for start, end in self._done)
+
+    def pending_indices(self, first=0):
+        """
+        Generates the indices of the runs that were not executed yet,
+        starting at `first`. Executed runs are skipped range by range.
+        """
+        product_size = self.product_size
+        idx = first
+        while idx < self.size:
+            pos = bisect.bisect_right(self._done, [idx, float('inf')])
+            if pos > 0 and self._done[pos - 1][1] >= idx:
+                idx = self._done[pos - 1][1] + 1
+                continue
+            if idx >= product_size or \
+               not self._excluded(self._combination(idx)):
+                yield idx
+            idx += 1
+
+    def pending(self):
+        """
+        Generates the runs that were not executed yet.
+        """
+        return (self.run(idx) for idx in self.pending_indices())
+
+    def pending_includes(self):
+        """
+        Generates the runs of 'include' that were not executed yet.
+        """
+        return (self.run(idx)
+                for idx in self.pending_indices(self.product_size))
+
+    def first_pending_product_run(self):
+        idx = next(self.pending_indices(), None)
+        if idx is None or idx >= self.product_size:
+            return None
+        return self.run(idx)
+
+    def num_pending_product(self):
+        """
+        Number of runs of the cartesian product that were not executed yet.
+        Only counting excluded combinations needs to go through the product,
+        and only once.
+        """
+        if self._num_pending_product is None:
+            if self.get('exclude'):
+                self._num_pending_product = sum(
+                    1 for idx in self.pending_indices()
+                    if idx < self.product_size
+                )
+            else:
+                self._num_pending_product = self.product_size - \
+                    self._num_done(0, self.product_size - 1)
+        return self._num_pending_product
+
+    def num_pending(self):
+        return self.num_pending_product() + \
+            len(self.get('include', [])) - \
+            self._num_done(self.product_size, self.size - 1)
+
+    def mark_done(self, idx):
+        if self._num_pending_product is not None and \
+           idx < self.product_size and not self.is_done(idx) and \
+           not self._excluded(self._combination(idx)):
+            self._num_pending_product -= 1
+        _add_index_range(self._done, idx, idx)
+        self['done'] = _format_index_ranges(self._done)
+
+
 class DescriptionSerializerBase(abc.ABC):
     @abc.abstractmethod
     def load(self, inp):
@@ -95,19 +383,40 @@ class JSONSerializer(DescriptionSerializerBase):
         return json.dump(descs, outp)
 
 
+class _DescriptionRepresenterMixin:
+    # pylint: disable=too-few-public-methods
+    def represent_data(self, data):
+        if isinstance(data, (NestedDescriptionBase, RunMatrix)):
+            data = dict(data)
+        return super().represent_data(data)
+
+
 class YAMLSerializer(DescriptionSerializerBase):
-    class _YAMLDumper(yaml.SafeDumper):
+    """
+    Uses the libyaml bindings of PyYAML if available, unless `pure_python`
+    is set.
+    """
+    class _YAMLDumper(_DescriptionRepresenterMixin, _SafeDumper):
+        # pylint: disable=too-many-ancestors
+        pass
+
+    class _PythonYAMLDumper(_DescriptionRepresenterMixin, yaml.SafeDumper):
         # pylint: disable=too-many-ancestors
-        def represent_data(self, data):
-            if isinstance(data, NestedDescriptionBase):
-                data = dict(data)
-            return super().represent_data(data)
+        pass
+
+    def __init__(self, pure_python=False):
+        if pure_python:
+            self._loader = yaml.SafeLoader
+            self._dumper = self._PythonYAMLDumper
+        else:
+            self._loader = _SafeLoader
+            self._dumper = self._YAMLDumper
 
     def load(self, inp):
-        return yaml.load(inp, Loader=yaml.FullLoader)
+        return yaml.load(inp, Loader=self._loader)
 
     def dump(self, outp, descs):
-        return yaml.dump(descs, outp, Dumper=self._YAMLDumper)
+        return yaml.dump(descs, outp, Dumper=self._dumper)
 
 
 class DescriptionSerializerFactory:
@@ -124,15 +433,99 @@ class DescriptionSerializerFactory:
 _factory = DescriptionSerializerFactory()
 
 
+def _digest(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _sync_directory(path):
+    # makes the rename of a file in the directory of `path` durable
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def apply_journal_entry(descs, entry):
+    """
+    Applies the progress recorded in the journal `entry` to the parsed
+    descriptions `descs`:
+
+    - `run_done`: run `run` of experiment `exp_id` (or of the experiment at
+      position `exp` in the reservation `exp_id` shared by experiments) was
+      executed
+    - `matrix_done`: the run with index `run` in the 'matrix' of the
+      experiment was executed
+    - `scheduled`: the unscheduled experiments at positions `unscheduled`
+      were scheduled as `exp_id`
+
+    >>> descs = {'unscheduled': [{'runs': [{'idx': 0}, {'idx': 1}]}]}
+    >>> apply_journal_entry(descs, {'op': 'scheduled', 'exp_id': 123,
+    ...                             'unscheduled': [0]})
+    >>> apply_journal_entry(descs, {'op': 'run_done', 'exp_id': 123,
+    ...                             'exp': None, 'run': 0})
+    >>> descs
+    {123: {'runs': [{'idx': 1}]}}
+    """
+    if entry['op'] in ('run_done', 'matrix_done'):
+        exp = descs[entry['exp_id']]
+        if entry.get('exp') is not None:
+            exp = exp[entry['exp']]
+        if entry['op'] == 'run_done':
+            del exp['runs'][entry['run']]
+        else:
+            exp['matrix'].mark_done(entry['run'])
+    elif entry['op'] == 'scheduled':
+        unscheduled = descs['unscheduled']
+        exps = [unscheduled[pos] for pos in entry['unscheduled']]
+        for pos in sorted(entry['unscheduled'], reverse=True):
+            del unscheduled[pos]
+        if not unscheduled:
+            del descs['unscheduled']
+        descs[entry['exp_id']] = exps if len(exps) > 1 else exps[0]
+    else:
+        raise ValueError(f"Unknown journal operation {entry['op']!r}")
+
+
 class DescriptionFileHandler:
-    def __init__(self, filename):
+    """
+    Loads and dumps description files. Progress between dumps can be recorded
+    with `record()` in an append-only journal next to the description file,
+    which is replayed on `load()` and compacted into the description file
+    every `COMPACT_INTERVAL` seconds and by `dump()`.
+
+    If `cache` is set, the parsed descriptions are pickled next to the
+    description file, so `load()` does not need to parse the file again as
+    long as it did not change. The cache is only as trustworthy as the
+    description file next to it.
+    """
+    # seconds between compactions of the journal into the description file
+    COMPACT_INTERVAL = 300
+    # bump when the parsed representation of descriptions changes
+    CACHE_VERSION = 4
+
+    def __init__(self, filename, cache=False):
         self._filename = filename
         self._serializer = _factory.get_serializer(filename)
+        self.cache = cache
+        # digest of the content of the description file the journal applies
+        # to
+        self._digest = None
+        self._journaled = 0
+        self._compacted = time.monotonic()
 
     @property
     def filename(self):
         return self._filename
 
+    @property
+    def journal_filename(self):
+        return f'{self._filename}.journal'
+
+    @property
+    def cache_filename(self):
+        return f'{self._filename}.cache'
+
     @staticmethod
     def _parse_firmware(firmware, enclosure):
         return NestedDescriptionBase(
@@ -169,6 +562,12 @@ class DescriptionFileHandler:
             res['runs'] = self._parse_runs(exp['runs'], res)
         else:
             res['runs'] = []
+        if 'matrix' in exp:
+            if not isinstance(exp['matrix'], dict):
+                raise DescriptionError(
+                    f"'matrix' must be a mapping, not {exp['matrix']!r}"
+                )
+            res['matrix'] = RunMatrix(exp['matrix'], enclosure=res)
         if 'firmwares' in exp:
             res['firmwares'] = self._parse_firmwares(res['firmwares'], exp)
         if 'sink_firmware' in exp:
@@ -209,19 +608,172 @@ class DescriptionFileHandler:
                         f"Top level keys must be 'global', 'unscheduled' "
                         f"or a numeric FIT IoT-LAB experiment ID not {key}."
                     ) from exc
-                content[int_key] = self._parse_experiment(
-                    content[key], content.get('globals'),
-                )
+                if isinstance(content[key], list):
+                    # experiments sharing a reservation
+                    content[int_key] = [
+                        self._parse_experiment(exp, content.get('globals'))
+                        for exp in content[key]
+                    ]
+                else:
+                    content[int_key] = self._parse_experiment(
+                        content[key], content.get('globals'),
+                    )
                 if int_key != key:
                     del content[key]
         return content
 
-    def load(self):
+    def _read_journal(self):
+        if not os.path.exists(self.journal_filename):
+            return []
+        res = []
+        with open(self.journal_filename, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    res.append(json.loads(line))
+                except ValueError:
+                    logger.warning('Ignoring incomplete entry at the end of '
+                                   '%s', self.journal_filename)
+                    break
+        return res
+
+    def _replay_journal(self, descs):
+        entries = self._read_journal()
+        if not entries:
+            return False
+        if entries[0].get('base') != self._digest:
+            # the journal was compacted into the description file already
+            logger.warning('Ignoring %s, it does not belong to %s',
+                           self.journal_filename, self.filename)
+            os.remove(self.journal_filename)
+            return False
+        for entry in entries[1:]:
+            try:
+                apply_journal_entry(descs, entry)
+            except (KeyError, IndexError, TypeError, ValueError) as exc:
+                logger.warning('Ignoring journal entry %r: %s', entry, exc)
+        logger.info('Replayed %d entries of %s', len(entries) - 1,
+                    self.journal_filename)
+        return True
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_filename, 'rb') as cache:
+                res = pickle.load(cache)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, AttributeError, ImportError, IndexError,
+                TypeError, ValueError, pickle.UnpicklingError) as exc:
+            logger.warning('Ignoring invalid cache %s: %s',
+                           self.cache_filename, exc)
+            return None
+        if not isinstance(res, dict) or \
+           res.get('version') != self.CACHE_VERSION:
+            return None
+        return res
+
+    def _write_cache(self, descs, digest):
+        stat = os.stat(self.filename)
+        tmp_filename = f'{self.cache_filename}.tmp'
+        try:
+            with open(tmp_filename, 'wb') as cache:
+                pickle.dump({'version': self.CACHE_VERSION,
+                             'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                             'digest': digest, 'descs': descs},
+                            cache, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, self.cache_filename)
+        except (OSError, pickle.PicklingError) as exc:
+            # the cache is only an optimization
+            logger.warning('Unable to write cache %s: %s',
+                           self.cache_filename, exc)
+
+    def _load_cached(self):
+        """
+        Returns the cached descriptions and the digest of the description
+        file if the file did not change since they were cached. The content
+        is only hashed if size or modification time of the file changed.
+        """
+        cached = self._read_cache()
+        if cached is None:
+            return None
+        stat = os.stat(self.filename)
+        if cached['size'] == stat.st_size and \
+           cached['mtime'] == stat.st_mtime_ns:
+            return cached['descs'], cached['digest']
         with open(self.filename, encoding='utf-8') as inp:
-            res = self._serializer.load(inp)
-            res = self.load_content(res)
+            digest = _digest(inp.read())
+        if cached['digest'] != digest:
+            return None
+        # e.g. touched, update the key
+        self._write_cache(cached['descs'], digest)
+        return cached['descs'], digest
+
+    def load(self):
+        cached = self._load_cached() if self.cache else None
+        if cached is None:
+            with open(self.filename, encoding='utf-8') as inp:
+                content = inp.read()
+            res = self.load_content(
+                self._serializer.load(io.StringIO(content))
+            )
+            self._digest = _digest(content)
+            if self.cache:
+                self._write_cache(res, self._digest)
+        else:
+            logger.debug('Using cached descriptions %s', self.cache_filename)
+            res, self._digest = cached
+        if self._replay_journal(res):
+            self.dump(res)
         return res
 
+    def record(self, descs, **entry):
+        """
+        Records the progress `entry` (see `apply_journal_entry()`) in the
+        journal. `descs` must already contain the progress, it is dumped
+        instead if the journal is due for compaction or there is no
+        description file to apply the journal to yet.
+        """
+        if self._digest is None or \
+           time.monotonic() - self._compacted >= self.COMPACT_INTERVAL:
+            self.dump(descs)
+            return
+        # a fresh journal starts with the description file it applies to
+        mode = 'a' if self._journaled else 'w'
+        with open(self.journal_filename, mode, encoding='utf-8') as journal:
+            if not self._journaled:
+                journal.write(json.dumps({'base': self._digest}) + '\n')
+            journal.write(json.dumps(entry) + '\n')
+        self._journaled += 1
+
+    def compact(self, descs):
+        """
+        Dumps `descs` if progress was recorded in the journal since the last
+        dump.
+        """
+        if self._journaled:
+            self.dump(descs)
+
     def dump(self, descs):
-        with open(self.filename, 'w', encoding='utf-8') as outp:
-            return self._serializer.dump(outp, descs)
+        """
+        Writes `descs` to the description file, unless the file already has
+        the same content. The file is replaced atomically, so it is never
+        truncated, even if the process is killed while dumping.
+        """
+        outp = io.StringIO()
+        self._serializer.dump(outp, descs)
+        content = outp.getvalue()
+        digest = _digest(content)
+        if digest != self._digest:
+            tmp_filename = f'{self.filename}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as tmp:
+                tmp.write(content)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.replace(tmp_filename, self.filename)
+            _sync_directory(self.filename)
+            self._digest = digest
+            if self.cache:
+                self._write_cache(descs, digest)
+        self._journaled = 0
+        self._compacted = time.monotonic()
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
@@ -0,0 +1,228 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import collections
+import datetime
+import logging
+import threading
+import time
+import urllib.error
+
+from iotlab_controller.experiment.base import ExperimentError
+
+from .file_handler import DescriptionError
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_deadline(exp):
+    """
+    Returns the end of the reservation of `exp` in `time.monotonic()` time
+    or `None` if it is unknown.
+    """
+    try:
+        remaining = exp.remaining_time()
+    except ExperimentError as exc:
+        logger.warning('Unable to determine remaining time of %s: %s',
+                       exp, exc)
+        return None
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining
+
+
+def fits_reservation(runner, estimator):
+    """
+    Checks if any pending run of `runner` is expected to fit into the
+    reservation it gets with its 'duration'.
+    """
+    duration = runner.desc.get('duration', 'auto')
+    if duration == 'auto':
+        # the reservation is estimated from the pending runs
+        return True
+    available = duration * 60 - estimator.EXP_OVERHEAD
+    runs = list(runner.runs)
+    if runner.matrix is not None:
+        # the runs of the cartesian product only differ in 'args' and 'env'
+        runs.append(runner.matrix.first_pending_product_run())
+        runs.extend(runner.matrix.pending_includes())
+    for run in filter(None, runs):
+        expected = estimator.estimate_run(runner, run)
+        if expected is None or expected <= available:
+            return True
+    return False
+
+
+def sharing_reservation(runner, runners):
+    """
+    Returns the runners of `runners` sharing the reservation of `runner` in
+    the order they are executed.
+    """
+    return [other for other in runners
+            if other.exp_id == runner.exp_id] or [runner]
+
+
+def stops_when_done(runner, runners):
+    """
+    Checks if the reservation of `runner` ends as soon as all its runs are
+    done. A reservation shared by several of `runners` is only stopped if
+    all experiments sharing it set 'stop_when_done'.
+    """
+    return all(other.desc.get('stop_when_done')
+               for other in sharing_reservation(runner, runners))
+
+
+def stop_reservation(runner):
+    """
+    Stops the reservation of `runner` before its end.
+    """
+    exp_id = runner.exp_id
+    try:
+        remaining = runner.experiment.remaining_time()
+    except ExperimentError as exc:
+        logger.warning('Unable to determine remaining time of %d: %s',
+                       exp_id, exc)
+        remaining = None
+    try:
+        runner.experiment.stop()
+    except urllib.error.HTTPError as exc:
+        logger.error('Unable to stop experiment %d: %s', exp_id, exc)
+        return
+    if remaining is None:
+        logger.info('Stopped experiment %d after all runs', exp_id)
+    else:
+        logger.info('Stopped experiment %d after all runs, reclaimed %s '
+                    'of its reservation', exp_id,
+                    datetime.timedelta(seconds=int(remaining)))
+
+
+def estimate_end_time(runner, runners, estimator):
+    """
+    Estimates when the reservation of `runner` ends, taking
+    `stops_when_done()` into account.
+    """
+    try:
+        remaining = runner.experiment.remaining_time()
+    except ExperimentError as exc:
+        logger.warning('Unable to determine remaining time of %d: %s',
+                       runner.exp_id, exc)
+        remaining = None
+    if stops_when_done(runner, runners):
+        estimate = 0
+        for other in sharing_reservation(runner, runners):
+            if estimate is not None:
+                other_estimate = estimator.estimate_runs(other)
+                estimate = None if other_estimate is None \
+                    else estimate + other_estimate
+        if remaining is None or \
+           (estimate is not None and estimate < remaining):
+            remaining = estimate
+    if remaining is None:
+        return None
+    return datetime.datetime.now() + datetime.timedelta(seconds=remaining)
+
+
+class PendingRuns:
+    """
+    Runs of an experiment that were not executed yet, as `(idx, run)` pairs.
+    The runs are only taken from the iterable `runs` when they are needed,
+    so runs generated by a 'matrix' are only created when they are about to
+    be executed. If there are `num_groups` node groups, runs may be pinned to
+    a group with 'group'.
+
+    `lock` guards the selection of runs by concurrently running node groups
+    (and the state `runs` are generated from).
+    """
+    def __init__(self, runs, num_groups=None, lock=None):
+        self._source = enumerate(runs)
+        self._num_groups = num_groups
+        # runs not pinned to a group are queued under None
+        self._queues = collections.defaultdict(collections.deque)
+        if lock is None:
+            lock = threading.Lock()
+        self._lock = lock
+
+    def _queue(self, run):
+        if self._num_groups is None:
+            return self._queues[None]
+        group = run.get('group')
+        if group is None:
+            return self._queues[None]
+        if not isinstance(group, int) or isinstance(group, bool) or \
+           not 0 <= group < self._num_groups:
+            raise DescriptionError(
+                f"'group' of run {run} must be between 0 and "
+                f"{self._num_groups - 1}, not {group!r}"
+            )
+        return self._queues[group]
+
+    def _pull(self):
+        idx_run = next(self._source, None)
+        if idx_run is None:
+            return False
+        self._queue(idx_run[1]).append(idx_run)
+        return True
+
+    def candidates(self, group=None):
+        """
+        Iterates over the runs that can be executed on node `group` in
+        order. Only the runs that are iterated over are taken from the
+        source.
+        """
+        queues = [self._queues[None]]
+        if group is not None:
+            queues.append(self._queues[group])
+        pos = [0] * len(queues)
+        while True:
+            heads = [(queue[p][0], i) for i, (queue, p)
+                     in enumerate(zip(queues, pos)) if p < len(queue)]
+            if not heads:
+                if not self._pull():
+                    return
+                continue
+            # everything still in the source comes after the queued runs
+            _, i = min(heads)
+            yield queues[i][pos[i]]
+            pos[i] += 1
+
+    def remove(self, idx_run):
+        queue = self._queue(idx_run[1])
+        if queue and queue[0] is idx_run:
+            queue.popleft()
+        else:
+            # only when runs were deferred
+            queue.remove(idx_run)
+
+    def _select(self, runner, last_run, deadline, estimator, group):
+        # pylint: disable=too-many-arguments
+        candidates = self.candidates(group)
+        if deadline is None:
+            return next(candidates, None)
+        remaining = deadline - time.monotonic()
+        for idx_run in candidates:
+            expected = estimator.estimate_run(runner, idx_run[1], last_run)
+            if expected is None or expected <= remaining:
+                return idx_run
+            logger.info('Deferring run %s: expected to take %.0fs, but only '
+                        '%.0fs of the reservation are left', idx_run[1],
+                        expected, remaining)
+        return None
+
+    def next_run(self, runner, last_run, deadline, estimator, group=None):
+        """
+        Removes and returns the first run for node `group` that is expected
+        to finish before `deadline`, so shorter runs can fill up the rest of
+        the reservation. Returns `None` if there is none.
+        """
+        # pylint: disable=too-many-arguments
+        with self._lock:
+            idx_run = self._select(runner, last_run, deadline, estimator,
+                                   group)
+            if idx_run is not None:
+                self.remove(idx_run)
+            elif next(self.candidates(group), None) is not None:
+                logger.warning('Remaining runs do not fit into the remaining '
+                               'reservation time of %s', runner.experiment)
+            return idx_run
@@ -2,20 +2,39 @@
 #
 # Distributed under terms of the MIT license.
 
+import functools
+import itertools
 import logging
+import os
+import re
 import subprocess
+import threading
 import time
 import urllib
 
 from iotlab_controller import common, nodes
+from iotlab_controller.experiment.aggregator import SerialAggregator, \
+    parse_addresses
 from iotlab_controller.experiment.base import BaseExperiment, ExperimentError
+from iotlab_controller.experiment.rules import Rule, RuleEngine
+from iotlab_controller.experiment.stream import FilteredListener, \
+    OutputBuffer, is_aggregator_output
+from iotlab_controller.logs.compress import CompressedLogWriter
+from iotlab_controller.logs.demux import DemuxLogWriter
 from iotlab_controller.riot import RIOTFirmware
+from iotlab_controller.ssh import SSHMultiplexer
 
-from .file_handler import DescriptionFileHandler, DescriptionError
+from .estimator import DurationEstimator
+from .file_handler import DescriptionFileHandler, DescriptionError, \
+    NestedDescriptionBase
+from .pending import PendingRuns, estimate_end_time, fits_reservation, \
+    get_deadline, sharing_reservation, stop_reservation, stops_when_done
 
 
 logger = logging.getLogger(__name__)
 
+RULE_KEYS = {'match', 'node', 'send', 'to', 'shell', 'fail', 'once'}
+
 
 class ExperimentRunner:
     def __init__(self, dispatcher, desc, exp_id=None, api=None):
@@ -25,6 +44,11 @@ class ExperimentRunner:
             self.api = api
         self.dispatcher = dispatcher
         self.desc = desc
+        # set if the experiment shares its reservation with other experiments
+        self.coalesced = False
+        # held while firmwares of concurrently running node groups are built
+        # and flashed
+        self._flash_lock = threading.Lock()
         self._build_simple_params(exp_id)
         self._init_nodes()
         self._init_firmwares()
@@ -58,6 +82,65 @@ class ExperimentRunner:
     def runs(self):
         return self.desc.get('runs', [])
 
+    @property
+    def matrix(self):
+        return self.desc.get('matrix')
+
+    def pending_runs(self):
+        """
+        Returns an iterator over the runs that were not executed yet: the
+        runs in 'runs' followed by the runs generated by 'matrix'.
+        """
+        # executed runs are removed from 'runs' while iterating
+        runs = list(self.runs)
+        if self.matrix is None:
+            return iter(runs)
+        return itertools.chain(runs, self.matrix.pending())
+
+    def num_pending_runs(self):
+        res = len(self.runs)
+        if self.matrix is not None:
+            res += self.matrix.num_pending()
+        return res
+
+    def get_groups(self):
+        """
+        Returns the disjoint node groups runs are executed on concurrently as
+        provided by 'groups' or `None` if runs use all nodes one after another.
+
+        'groups' is either a number of groups the nodes are partitioned into
+        or a list of groups of node names.
+        """
+        groups = self.desc.get('groups')
+        if groups is None:
+            return None
+        if isinstance(self.nodes, nodes.SinkNetworkedNodes):
+            raise DescriptionError(
+                "'groups' are not supported for networks with a sink"
+            )
+        if isinstance(groups, int) and not isinstance(groups, bool) and \
+           groups > 0:
+            return self.nodes.partition(groups)
+        if not isinstance(groups, list) or not groups or \
+           not all(isinstance(group, list) and group for group in groups):
+            raise DescriptionError(
+                f"'groups' must be a number of groups or a list of lists of "
+                f"nodes, not {groups!r}"
+            )
+        res = []
+        seen = set()
+        for group in groups:
+            selected = self.nodes.select(group)
+            if len(selected) != len(set(group)):
+                raise DescriptionError(
+                    f"Group {group} contains nodes not in the experiment"
+                )
+            if seen & set(selected.nodes):
+                raise DescriptionError(f"Group {group} overlaps other groups")
+            seen.update(selected.nodes)
+            res.append(selected)
+        return res
+
     def run_name(self, run):
         if '__timestamp__' not in run:
             run['__timestamp__'] = int(time.time())
@@ -206,32 +289,61 @@ class ExperimentRunner:
                 f'Missing firmware property {exc} in {firmware_desc}'
             ) from exc
 
-    def reflash_firmwares(self, run, last_run):
-        if run.get('rebuild') or (last_run and run.env != last_run.env):
-            self.build_firmwares(build_env=run.env)
-            if isinstance(self.nodes, nodes.SinkNetworkedNodes) and \
-               len(self.experiment.firmwares) > 1 and \
-               all(self.experiment.firmwares[1] == f
-                   for f in self.experiment.firmwares[2:]):
-                self.nodes.flash(
-                    self.exp_id,
-                    self.experiment.firmwares[1],
-                    self.experiment.firmwares[0]
-                )
-            # all firmwares are the same
-            elif all(self.experiment.firmwares[0] == f
-                     for f in self.experiment.firmwares[1:]):
-                self.nodes.flash(
+    @staticmethod
+    def needs_reflash(run, last_run):
+        return bool(run.get('rebuild') or
+                    (last_run is not None and run.env != last_run.env))
+
+    def reflash_firmwares(self, run, last_run, force=False, subset=None):
+        """
+        Rebuilds and flashes the firmwares for `run` if required. If `subset`
+        is provided, only the nodes in `subset` are flashed.
+        """
+        if not self.experiment.firmwares:
+            return
+        if force or self.needs_reflash(run, last_run):
+            with self._flash_lock:
+                self.build_firmwares(build_env=run.env)
+                self._flash_firmwares(subset)
+
+    def _flash_firmwares(self, subset=None):
+        if subset is not None:
+            firmwares = dict(zip((n.uri for n in self.nodes),
+                                 self.experiment.firmwares))
+            # flash nodes sharing a firmware at once
+            uris_by_firmware = []
+            for node in subset:
+                for firmware, uris in uris_by_firmware:
+                    if firmware == firmwares[node.uri]:
+                        uris.append(node.uri)
+                        break
+                else:
+                    uris_by_firmware.append((firmwares[node.uri], [node.uri]))
+            for firmware, uris in uris_by_firmware:
+                self.nodes.select(uris).flash(self.exp_id, firmware)
+        elif isinstance(self.nodes, nodes.SinkNetworkedNodes) and \
+                len(self.experiment.firmwares) > 1 and \
+                all(self.experiment.firmwares[1] == f
+                    for f in self.experiment.firmwares[2:]):
+            self.nodes.flash(
+                self.exp_id,
+                self.experiment.firmwares[1],
+                self.experiment.firmwares[0]
+            )
+        # all firmwares are the same
+        elif all(self.experiment.firmwares[0] == f
+                 for f in self.experiment.firmwares[1:]):
+            self.nodes.flash(
+                self.exp_id,
+                self.experiment.firmwares[0]
+            )
+        else:
+            # flash nodes one by one
+            for i, node in enumerate(self.nodes):
+                node.flash(
                     self.exp_id,
-                    self.experiment.firmwares[0]
+                    self.experiment.firmwares[i]
                 )
-            else:
-                # flash nodes one by one
-                for i, node in enumerate(self.nodes):
-                    node.flash(
-                        self.exp_id,
-                        self.experiment.firmwares[i]
-                    )
 
     def build_firmwares(self, build_env=None):
         last_firmware = None
@@ -243,18 +355,50 @@ class ExperimentRunner:
 
 
 class ExperimentDispatcher:
+    # pylint: disable=too-many-instance-attributes
     _EXPERIMENT_RUNNER_CLASS = ExperimentRunner
     DEFAULT_EXP_DURATION = 20
+    # overhead in seconds of a run on top of its 'wait' time before it was
+    # measured
+    RUN_OVERHEAD = 0
     DEFAULT_EXP_NAME = 'iotlab-controller-dispatcher-experiment'
+    # number of recent lines per node kept in `ctx['output']` during a run
+    OUTPUT_BUFFER_LINES = OutputBuffer.LINES
 
-    def __init__(self, filename, api=None):
+    def __init__(self, filename, api=None, rolling=False, coalesce=False,
+                 ssh_multiplex=False, cache=False):
+        # pylint: disable=too-many-arguments
         if api is None:
             self.api = common.get_default_api()
         else:
             self.api = api
+        # if rolling, only one unscheduled experiment is scheduled at a time,
+        # as soon as the experiment before it starts
+        self.rolling = rolling
+        # if coalesce, unscheduled experiments on the same nodes share one
+        # reservation
+        self.coalesce = coalesce
+        # if ssh_multiplex, commands on the SSH frontends share one
+        # connection per site for the lifetime of the dispatcher
+        self.ssh_mux = SSHMultiplexer() if ssh_multiplex else None
         self.runners = []
-        self._file_handler = DescriptionFileHandler(filename)
+        # if cache, the parsed descriptions are cached next to the
+        # description file, so restarting the dispatcher does not parse an
+        # unchanged file again
+        self._file_handler = DescriptionFileHandler(filename, cache=cache)
         self.descs = {}
+        # guards state shared by runs on concurrently running node groups
+        self._lock = threading.Lock()
+        # unscheduled descriptions whose runs never fit into their
+        # reservation; they are kept, but not scheduled again by this
+        # dispatcher
+        self._held_back = []
+
+    @property
+    def estimator(self):
+        globs = self.descs.setdefault('globals', NestedDescriptionBase())
+        return DurationEstimator(globs.setdefault('timings', {}),
+                                 run_overhead=self.RUN_OVERHEAD)
 
     def _pre_experiment(self, runner, ctx, *args, **kwargs):
         ctx.update(self.pre_experiment(runner, ctx, *args, **kwargs) or {})
@@ -272,35 +416,117 @@ class ExperimentDispatcher:
             except urllib.error.HTTPError:
                 pass
 
+    def _execute_run(self, runner, run_desc, last_run_desc, estimator, ctx,
+                     *args, **kwargs):
+        # pylint: disable=too-many-arguments
+        exp = runner.experiment
+        # the firmwares of an experiment sharing its reservation with others
+        # need to be rebuilt and flashed before its first run
+        force = runner.coalesced and last_run_desc is None
+        reflash = force or runner.needs_reflash(run_desc, last_run_desc)
+        flash_kwargs = {'force': force}
+        run_nodes = exp.nodes
+        if 'group' in ctx:
+            # only touch the nodes of the group, the other groups are busy
+            flash_kwargs['subset'] = run_nodes = ctx['nodes']
+        start = time.monotonic()
+        try:
+            self._retry_http_error(runner.reflash_firmwares, run_desc,
+                                   last_run_desc, **flash_kwargs)
+        except subprocess.CalledProcessError:
+            run_desc["rebuild"] = True
+            raise
+        if reflash:
+            estimator.record('reflash', time.monotonic() - start)
+        if run_desc.get('reset', True):
+            with estimator.measure('reset'):
+                self._retry_http_error(run_nodes.reset, exp.exp_id)
+        self._pre_run(runner, run_desc, ctx, *args, **kwargs)
+        try:
+            start = time.monotonic()
+            self.run(runner, run_desc, ctx, *args, **kwargs)
+            # a run ending before its 'wait' passed (e.g. on 'until') tells
+            # nothing about the overhead of a run
+            if not ctx.get('ended_early'):
+                estimator.record('run', max(
+                    time.monotonic() - start - (run_desc.get('wait') or 0), 0
+                ))
+        finally:
+            self._post_run(runner, run_desc, ctx, *args, **kwargs)
+
+    def _execute_pending(self, runner, pending, deadline, estimator, ctx,
+                         *args, **kwargs):
+        # pylint: disable=too-many-arguments
+        last_run_desc = None
+        while True:
+            idx_run = pending.next_run(runner, last_run_desc, deadline,
+                                       estimator, ctx.get('group'))
+            if idx_run is None:
+                break
+            idx, run_desc = idx_run
+            if 'idx' not in run_desc:
+                run_desc['idx'] = idx
+            else:
+                logger.warning(
+                    'Setting idx=%s in run description %s may lead to '
+                    'inconsistent lognames', run_desc['idx'], run_desc
+                )
+            self._execute_run(runner, run_desc, last_run_desc, estimator,
+                              ctx, *args, **kwargs)
+            last_run_desc = run_desc
+
+    def _execute_group(self, errors, *args, **kwargs):
+        try:
+            self._execute_pending(*args, **kwargs)
+        except Exception as exc:  # pylint: disable=broad-except
+            # re-raised in the thread of the experiment
+            errors.append(exc)
+
+    def _execute_groups(self, runner, groups, pending, deadline, estimator,
+                        ctx, *args, **kwargs):
+        # pylint: disable=too-many-arguments
+        logger.info('Executing runs of %s on %d node groups concurrently',
+                    runner.experiment, len(groups))
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self._execute_group,
+                args=(errors, runner, pending, deadline, estimator,
+                      # each group has its own aggregator, log, and listeners
+                      dict(ctx, nodes=group, group=idx)) + args,
+                kwargs=kwargs, name=f'{runner.experiment.name}-group{idx}',
+            )
+            for idx, group in enumerate(groups)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
     def target(self, exp, runner, ctx, *args, **kwargs):
         assert exp == runner.experiment
         self._pre_experiment(runner, ctx, *args, **kwargs)
-        last_run_desc = None
+        estimator = self.estimator
+        deadline = get_deadline(exp)
         try:
-            for idx, run_desc in enumerate(list(runner.runs)):
-                if 'idx' not in run_desc:
-                    run_desc['idx'] = idx
-                else:
-                    logger.warning(
-                        'Setting idx=%s in run description %s may lead to '
-                        'inconsistent lognames', run_desc['idx'], run_desc
-                    )
-                try:
-                    self._retry_http_error(runner.reflash_firmwares, run_desc,
-                                           last_run_desc)
-                except subprocess.CalledProcessError:
-                    run_desc["rebuild"] = True
-                    raise
-                last_run_desc = run_desc
-                if run_desc.get('reset', True):
-                    self._retry_http_error(exp.nodes.reset, exp.exp_id)
-                self._pre_run(runner, run_desc, ctx, *args, **kwargs)
-                try:
-                    self.run(runner, run_desc, ctx, *args, **kwargs)
-                finally:
-                    self._post_run(runner, run_desc, ctx, *args, **kwargs)
+            groups = runner.get_groups()
+            pending = PendingRuns(runner.pending_runs(),
+                                  None if groups is None else len(groups),
+                                  lock=self._lock)
+            if groups is None:
+                self._execute_pending(runner, pending, deadline, estimator,
+                                      ctx, *args, **kwargs)
+            else:
+                self._execute_groups(runner, groups, pending, deadline,
+                                     estimator, ctx, *args, **kwargs)
         finally:
             self._post_experiment(runner, ctx, *args, **kwargs)
+        # a shared reservation is stopped after its last experiment
+        if stops_when_done(runner, self.runners) and \
+           sharing_reservation(runner, self.runners)[-1] is runner:
+            stop_reservation(runner)
 
     def _post_experiment(self, runner, ctx, *args, **kwargs):
         self.post_experiment(runner, ctx, *args, **kwargs)
@@ -311,6 +537,150 @@ class ExperimentDispatcher:
 
     def _pre_run(self, runner, run, ctx, *args, **kwargs):
         ctx.update(self.pre_run(runner, run, ctx, *args, **kwargs) or {})
+        compression = self._log_compression(run)
+        if run.get('serial_aggregator') == 'native':
+            ctx['aggregator'] = self._native_aggregator(
+                runner, run, ctx,
+                # a compressed log is written from the output stream
+                None if compression else self._logname(runner, run, ctx)
+            )
+        if compression is not None:
+            # terminal output also contains prompts and typed commands
+            self._add_output_listener(
+                runner, run, ctx, 'log_writer', CompressedLogWriter(
+                    self._logname(runner, run, ctx), **compression
+                ), line_filter=is_aggregator_output
+            )
+        if run.get('demux_logs'):
+            self._add_output_listener(
+                runner, run, ctx, 'demux', DemuxLogWriter(
+                    os.path.splitext(self._logname(runner, run, ctx))[0]
+                )
+            )
+        if self.output_stream(runner, ctx) is not None:
+            self._add_output_listener(
+                runner, run, ctx, 'output',
+                OutputBuffer(lines=self.OUTPUT_BUFFER_LINES)
+            )
+        rules = self._output_rules(run)
+        if rules:
+            self._add_output_listener(
+                runner, run, ctx, 'rules', RuleEngine(
+                    rules, send=functools.partial(self.send_to_node, runner,
+                                                  ctx)
+                )
+            )
+        if 'aggregator' in ctx:
+            try:
+                ctx['aggregator'].start()
+            except ExperimentError:
+                del ctx['aggregator']
+                self._remove_output_listeners(ctx)
+                raise
+
+    @staticmethod
+    def _native_aggregator(runner, run, ctx, logname):
+        try:
+            addresses = parse_addresses(run.get('serial_aggregator_addresses'))
+        except ValueError as exc:
+            raise DescriptionError(
+                f"Invalid 'serial_aggregator_addresses': {exc}"
+            ) from exc
+        return SerialAggregator(ctx.get('nodes') or runner.nodes,
+                                logname=logname, addresses=addresses)
+
+    def output_stream(self, runner, ctx):
+        """
+        Returns the stream of serial output of the current run or `None` if
+        there is none.
+        """
+        # pylint: disable=unused-argument
+        if 'aggregator' in ctx:
+            return ctx['aggregator'].stream
+        return None
+
+    @staticmethod
+    def _logname(runner, run, ctx):
+        logname = ctx.get('logname')
+        if logname is None:
+            logname = os.path.join(runner.desc.get('results_dir', '.'),
+                                   f'{runner.run_name(run)}.log')
+        return logname
+
+    @staticmethod
+    def _log_compression(run):
+        compression = run.get('compress_logs')
+        if not compression:
+            return None
+        if compression is True:
+            return {}
+        if isinstance(compression, str):
+            return {'codec': compression}
+        if isinstance(compression, dict) and \
+           set(compression) <= {'codec', 'level', 'rotate_size'}:
+            return dict(compression)
+        raise DescriptionError(
+            f"'compress_logs' must be a boolean, a codec, or a mapping with "
+            f"'codec', 'level', and 'rotate_size', not {compression!r}"
+        )
+
+    @staticmethod
+    def _output_rules(run):
+        rules = run.get('on_output')
+        if not rules:
+            return []
+        if isinstance(rules, dict):
+            rules = [rules]
+        res = []
+        for rule in rules:
+            if not isinstance(rule, dict) or 'match' not in rule or \
+               not set(rule) <= RULE_KEYS:
+                raise DescriptionError(
+                    f"'on_output' rules must be mappings with 'match' and "
+                    f"any of {', '.join(sorted(RULE_KEYS - {'match'}))}, "
+                    f"not {rule!r}"
+                )
+            try:
+                res.append(Rule(**rule))
+            except re.error as exc:
+                raise DescriptionError(
+                    f"Invalid pattern {rule['match']!r} in 'on_output': {exc}"
+                ) from exc
+        return res
+
+    def send_to_node(self, runner, ctx, node, cmd):
+        """
+        Sends the command `cmd` to the serial port of `node` during a run.
+        """
+        # pylint: disable=unused-argument
+        if 'aggregator' not in ctx:
+            raise ExperimentError(f'No serial connection to {node}')
+        ctx['aggregator'].send(node, f'{cmd}\n')
+
+    def _add_output_listener(self, runner, run, ctx, name, listener,
+                             line_filter=None):
+        # pylint: disable=too-many-arguments
+        output = self.output_stream(runner, ctx)
+        if output is None:
+            logger.warning("No serial output to write %s of %s to",
+                           name, runner.run_name(run))
+            listener.close()
+            return
+        if line_filter is None:
+            callback = listener
+        else:
+            callback = FilteredListener(listener, line_filter)
+        output.add_listener(callback)
+        ctx[name] = listener
+        ctx.setdefault('output_listeners', []).append((output, name,
+                                                       callback))
+
+    @staticmethod
+    def _remove_output_listeners(ctx):
+        for output, name, callback in ctx.pop('output_listeners', []):
+            listener = ctx.pop(name)
+            output.remove_listener(callback)
+            listener.close()
 
     def pre_run(self, runner, run, ctx, *args, **kwargs):
         # pylint: disable=unused-argument
@@ -321,9 +691,30 @@ class ExperimentDispatcher:
         pass
 
     def _post_run(self, runner, run, ctx, *args, **kwargs):
-        self.post_run(runner, run, ctx, *args, **kwargs)
-        runner.runs.remove(run)
-        runner.dispatcher.dump_experiment_descriptions()
+        if 'rules' in ctx and ctx['rules'].failure is not None:
+            ctx['failed'] = ctx['rules'].failure
+            logger.error('Run %s failed: %s', runner.run_name(run),
+                         ctx['failed'])
+        try:
+            self.post_run(runner, run, ctx, *args, **kwargs)
+        finally:
+            if 'aggregator' in ctx:
+                ctx.pop('aggregator').stop()
+            self._remove_output_listeners(ctx)
+            ctx.pop('failed', None)
+            ctx.pop('ended_early', None)
+        with self._lock:
+            if '__matrix_idx__' in run:
+                # generated by 'matrix', only its index is recorded
+                runner.matrix.mark_done(run['__matrix_idx__'])
+                self.record_progress(op='matrix_done', exp_id=runner.exp_id,
+                                     exp=self._desc_index(runner),
+                                     run=run['__matrix_idx__'])
+            else:
+                pos = runner.runs.index(run)
+                del runner.runs[pos]
+                self.record_progress(op='run_done', exp_id=runner.exp_id,
+                                     exp=self._desc_index(runner), run=pos)
 
     def post_run(self, runner, run, ctx, *args, **kwargs):
         # pylint: disable=unused-argument
@@ -340,8 +731,11 @@ class ExperimentDispatcher:
             diff += 1
         if 'unscheduled' in self.descs:
             diff += 1
-            unscheduled += len(self.descs['unscheduled'])
-        return len(self.descs) + unscheduled - diff
+            unscheduled += len(self._schedulable(self.descs['unscheduled']))
+        # experiments sharing a reservation
+        coalesced = sum(len(desc) - 1 for key, desc in self.descs.items()
+                        if key != 'unscheduled' and isinstance(desc, list))
+        return len(self.descs) + unscheduled + coalesced - diff
 
     def has_experiments_to_run(self):
         return self.num_experiments_to_run() > 0
@@ -358,55 +752,193 @@ class ExperimentDispatcher:
     def dump_experiment_descriptions(self):
         self._file_handler.dump(self.descs)
 
-    def _schedule_unscheduled(self, unscheduled):
-        runners = []
-        # make unscheduled mutable during iteration
-        for desc in list(unscheduled):
-            duration = desc.get('duration', self.DEFAULT_EXP_DURATION)
-            runner = self._EXPERIMENT_RUNNER_CLASS(self, desc, api=self.api)
-            runner.build_firmwares()
+    def record_progress(self, **entry):
+        """
+        Records progress already applied to the experiment descriptions in
+        the journal of the description file.
+        """
+        self._file_handler.record(self.descs, **entry)
+
+    def _desc_index(self, runner):
+        """
+        Returns the position of the description of `runner` in its
+        reservation if the reservation is shared by several experiments.
+        """
+        descs = self.descs.get(runner.exp_id)
+        if not isinstance(descs, list):
+            return None
+        for i, desc in enumerate(descs):
+            if desc is runner.desc:
+                return i
+        return None
+
+    def _get_duration(self, runner, overhead=True):
+        duration = runner.desc.get('duration', 'auto')
+        if duration != 'auto':
+            return duration
+        duration = self.estimator.estimate_duration(runner, overhead=overhead)
+        if duration is None:
+            logger.info("Unable to estimate duration of experiment '%s', "
+                        "falling back to %s", runner.experiment.name,
+                        self.DEFAULT_EXP_DURATION)
+            return self.DEFAULT_EXP_DURATION
+        return duration
+
+    @staticmethod
+    def _compatible(runner, other):
+        # an experiment on only some of the nodes would leave the other nodes
+        # running the firmware of the experiment before it
+        return runner.desc.get('profiles') == other.desc.get('profiles') and \
+            {node.uri for node in runner.nodes} == \
+            {node.uri for node in other.nodes}
+
+    def _group_runners(self, runners):
+        groups = []
+        for runner in runners:
+            for group in groups:
+                # the first runner in a group provides the nodes for the
+                # reservation
+                if self.coalesce and self._compatible(group[0], runner):
+                    group.append(runner)
+                    break
+            else:
+                groups.append([runner])
+        return groups
+
+    def _schedule_group(self, group, start_time=None):
+        runner = group[0]
+        # the firmwares of the first experiment are flashed with the
+        # reservation
+        for other in group[1:]:
+            other.coalesced = True
+        # the reservation is only set up once for all experiments sharing it
+        duration = sum(self._get_duration(r, overhead=i == 0)
+                       for i, r in enumerate(group))
+        runner.build_firmwares()
+        if start_time is None:
             logger.info("Scheduling experiment '%s' with duration %s",
                         runner.experiment.name, duration)
-            runner.experiment.schedule(duration)
-            logger.info("Scheduled %d", runner.exp_id)
-            self.descs["unscheduled"].remove(desc)
-            self.descs[runner.exp_id] = desc
-            runners.append(runner)
-        del self.descs["unscheduled"]
-        self.dump_experiment_descriptions()
+        else:
+            logger.info("Scheduling experiment '%s' with duration %s "
+                        "to start at %s", runner.experiment.name,
+                        duration, start_time)
+        runner.experiment.schedule(duration, start_time=start_time)
+        logger.info("Scheduled %d", runner.exp_id)
+        unscheduled = self.descs["unscheduled"]
+        positions = [
+            next(i for i, desc in enumerate(unscheduled) if desc is r.desc)
+            for r in group
+        ]
+        for pos in sorted(positions, reverse=True):
+            del unscheduled[pos]
+        if not unscheduled:
+            del self.descs["unscheduled"]
+        if len(group) > 1:
+            logger.info("Experiments %s share reservation %d",
+                        ", ".join(f"'{r.experiment.name}'" for r in group),
+                        runner.exp_id)
+            for other in group:
+                other.experiment.exp_id = runner.exp_id
+            self.descs[runner.exp_id] = [r.desc for r in group]
+        else:
+            self.descs[runner.exp_id] = runner.desc
+        self.record_progress(op='scheduled', exp_id=runner.exp_id,
+                             unscheduled=positions)
+
+    def _schedule_unscheduled(self, unscheduled, start_time=None):
+        runners = []
+        groups = self._group_runners(
+            self._EXPERIMENT_RUNNER_CLASS(self, desc, api=self.api)
+            for desc in self._schedulable(unscheduled)
+        )
+        if self.rolling:
+            groups = groups[:1]
+        for group in groups:
+            self._schedule_group(group, start_time)
+            runners.extend(group)
         return runners
 
+    def _schedule_next(self, runner):
+        if 'unscheduled' not in self.descs:
+            return
+        self.runners.extend(self._schedule_unscheduled(
+            self.descs['unscheduled'],
+            start_time=estimate_end_time(runner, self.runners,
+                                         self.estimator),
+        ))
+
+    def _requeue(self, exp_id, desc):
+        if isinstance(desc, list):
+            runners = []
+            for exp_desc in desc:
+                runners.extend(self._requeue(exp_id, exp_desc))
+                runners[-1].coalesced = True
+            return runners
+        logger.info(
+            "Trying to requeue experiment %s (%d)", desc.get('name'), exp_id
+        )
+        return [self._EXPERIMENT_RUNNER_CLASS(self, desc, exp_id=exp_id,
+                                              api=self.api)]
+
     def schedule_experiments(self):
         self.runners = []
 
         for key, desc in list(self.descs.items()):
-            if key == 'globals':
+            if key in ['globals', 'unscheduled']:
                 continue
-            if key == 'unscheduled':
-                self.runners.extend(self._schedule_unscheduled(desc))
-            else:
-                try:
-                    logger.info(
-                        "Trying to requeue experiment %s (%d)",
-                        desc.get('name'), key
-                    )
-                    runner = self._EXPERIMENT_RUNNER_CLASS(self, desc,
-                                                           exp_id=key,
-                                                           api=self.api)
-                    self.runners.append(runner)
-                except ExperimentError as exc:
-                    logger.error('Unable to requeue %d: %s', key, exc)
-                    del self.descs[key]
-                    self.dump_experiment_descriptions()
+            try:
+                self.runners.extend(self._requeue(key, desc))
+            except ExperimentError as exc:
+                logger.error('Unable to requeue %d: %s', key, exc)
+                del self.descs[key]
+                self.dump_experiment_descriptions()
+        # in rolling mode, unscheduled experiments are only scheduled when
+        # no other experiment is queued
+        if 'unscheduled' in self.descs and \
+           not (self.rolling and self.runners):
+            self.runners.extend(
+                self._schedule_unscheduled(self.descs['unscheduled'])
+            )
         self.runners.sort(key=lambda runner: runner.exp_id)
 
+    def _remove_desc(self, exp_id, desc):
+        descs = self.descs[exp_id]
+        if isinstance(descs, list):
+            descs[:] = [d for d in descs if d is not desc]
+            if descs:
+                return
+        del self.descs[exp_id]
+
+    def _schedulable(self, unscheduled):
+        if isinstance(unscheduled, dict):
+            unscheduled = [unscheduled]
+        return [desc for desc in unscheduled
+                if not any(desc is held for held in self._held_back)]
+
+    def _requeue_deferred_runs(self, runner, exp_id):
+        logger.warning("Leaving %d remaining run(s) of experiment %d for the "
+                       "next reservation", runner.num_pending_runs(), exp_id)
+        unscheduled = self.descs.setdefault('unscheduled', [])
+        if isinstance(unscheduled, dict):
+            unscheduled = self.descs['unscheduled'] = [unscheduled]
+        unscheduled.append(runner.desc)
+
     def run_experiments(self):
+        try:
+            self._run_experiments()
+        finally:
+            self._file_handler.compact(self.descs)
+            if self.ssh_mux is not None:
+                self.ssh_mux.close()
+
+    def _run_experiments(self):
         while self.has_experiments_to_run():
             if not self.runners:
                 logger.warning('No runners available. Did you schedule?')
                 self.descs.clear()
                 self.dump_experiment_descriptions()
                 break
+            # in rolling mode, self.runners is extended during iteration
             for runner in self.runners:
                 exp_id = runner.exp_id
                 logger.info('Waiting for experiment %d to start', exp_id)
@@ -415,6 +947,30 @@ class ExperimentDispatcher:
                 except (ExperimentError, RuntimeError) as exc:
                     logger.error('Could not wait for experiment: %s', exc)
                 else:
+                    if self.rolling and \
+                       self.runners[-1].exp_id == runner.exp_id:
+                        self._schedule_next(runner)
+                    pending = runner.num_pending_runs()
                     runner.experiment.run()
-                del self.descs[exp_id]
+                    remaining = runner.num_pending_runs()
+                    if remaining:
+                        self._requeue_deferred_runs(runner, exp_id)
+                    if remaining and remaining == pending and \
+                       not fits_reservation(runner, self.estimator):
+                        # rescheduling would only reserve nodes again and
+                        # again
+                        logger.error(
+                            "Not rescheduling %d remaining run(s) of "
+                            "experiment %d: none finished in its reservation "
+                            "and none fits into a reservation of %s minutes. "
+                            "Adapt its 'duration'.",
+                            remaining, exp_id, runner.desc.get('duration')
+                        )
+                        self._held_back.append(runner.desc)
+                self._remove_desc(exp_id, runner.desc)
                 self.dump_experiment_descriptions()
+            self.runners = []
+            if 'unscheduled' in self.descs:
+                self.runners = self._schedule_unscheduled(
+                    self.descs['unscheduled']
+                )
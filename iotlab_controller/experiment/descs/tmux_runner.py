@@ -2,12 +2,17 @@
 #
 # Distributed under terms of the MIT license.
 
+import contextlib
 import logging
+import math
 import os
 import time
 
 
 from iotlab_controller.experiment.base import BaseExperiment
+from iotlab_controller.experiment.stream import QuorumExpectation
+from iotlab_controller.experiment.pty import PtyExperiment
+from iotlab_controller.experiment.terminal import TerminalExperiment
 from iotlab_controller.experiment.tmux import TmuxExperiment
 
 from .runner import ExperimentRunner, ExperimentDispatcher
@@ -35,8 +40,58 @@ class TmuxExperimentRunner(ExperimentRunner):
             logger.warning('No commands provided in %s', run)
         return res
 
+    @staticmethod
+    def _until_quorum(run, num_nodes):
+        quorum = run.get('until_quorum')
+        if quorum is None:
+            return num_nodes
+        if isinstance(quorum, float) and 0 < quorum <= 1:
+            return math.ceil(quorum * num_nodes)
+        if isinstance(quorum, int) and 0 < quorum <= num_nodes:
+            return quorum
+        raise DescriptionError(
+            f"'until_quorum' must be a number of nodes between 1 and "
+            f"{num_nodes} or a fraction of nodes, not {quorum!r}"
+        )
+
+    def get_until(self, run, nodes=None):
+        """
+        Returns the condition for ending `run` early as provided by 'until'
+        or `None` if there is none.
+        """
+        until = run.get('until')
+        if until is None:
+            return None
+        if isinstance(until, dict):
+            patterns = {
+                node: [p] if isinstance(p, str) else list(p)
+                for node, p in until.items()
+            }
+        elif isinstance(until, (str, list)):
+            if nodes is None:
+                nodes = self.nodes
+            node_patterns = [until] if isinstance(until, str) else until
+            # serial_aggregator names nodes by the host part of their URI
+            patterns = {node.uri.split('.')[0]: list(node_patterns)
+                        for node in nodes}
+        else:
+            raise DescriptionError(
+                f"'until' must be a pattern, list of patterns, or a mapping "
+                f"of nodes to patterns, not {until!r}"
+            )
+        return QuorumExpectation(patterns,
+                                 self._until_quorum(run, len(patterns)))
+
     def ensure_tmux_session(self):
         cwd = self.get_tmux('cwd')
+        if isinstance(self.experiment, PtyExperiment):
+            if self.experiment.process is None:
+                logger.info("Starting shell%s",
+                            '' if cwd is None else f' in {cwd}')
+                self.experiment.start_shell(cwd=cwd)
+            elif cwd is not None:
+                self.experiment.cmd(f'cd {cwd}')
+            return
         tmux_target = self.get_tmux('target')
         session = self._parse_tmux_target(tmux_target)
 
@@ -52,6 +107,14 @@ class TmuxExperimentRunner(ExperimentRunner):
 
     def _init_experiment(self):
         if 'tmux' in self.desc:
+            backend = self.get_tmux('backend', 'tmux')
+            if backend == 'pty':
+                return PtyExperiment(**self._exp_params)
+            if backend != 'tmux':
+                raise DescriptionError(
+                    f"Unknown terminal backend {backend!r}, use 'tmux' or "
+                    "'pty'"
+                )
             return TmuxExperiment(**self._exp_params)
         return BaseExperiment(**self._exp_params)
 
@@ -72,19 +135,159 @@ class TmuxExperimentRunner(ExperimentRunner):
 
 class TmuxExperimentDispatcher(ExperimentDispatcher):
     _EXPERIMENT_RUNNER_CLASS = TmuxExperimentRunner
+    # serial_aggregator start-up and tear-down
+    RUN_OVERHEAD = 5
+    # interval in seconds to check multiple conditions for ending a run
+    POLL_INTERVAL = .1
 
     def _pre_run(self, runner, run, ctx, *args, **kwargs):
-        if isinstance(runner.experiment, TmuxExperiment):
-            runner.ensure_tmux_session()
+        if isinstance(runner.experiment, TerminalExperiment):
+            if 'group' in ctx and run.get('serial_aggregator') != 'native':
+                # the terminal can only run one serial_aggregator at a time
+                raise DescriptionError(
+                    "Runs on node groups require 'serial_aggregator: native'"
+                )
+            runner.experiment.ssh_mux = self.ssh_mux
+            with self._lock:
+                runner.ensure_tmux_session()
             run_name = runner.run_name(run)
             ctx['logname'] = os.path.join(runner.desc.get('results_dir', '.'),
                                           f'{run_name}.log')
         super()._pre_run(runner, run, ctx, *args, **kwargs)
 
+    def _post_experiment(self, runner, ctx, *args, **kwargs):
+        try:
+            super()._post_experiment(runner, ctx, *args, **kwargs)
+        finally:
+            if isinstance(runner.experiment, TmuxExperiment):
+                runner.experiment.release_tmux_session()
+            elif isinstance(runner.experiment, PtyExperiment):
+                runner.experiment.stop_shell()
+
+    @classmethod
+    def _wait_any(cls, conditions, timeout):
+        """
+        Waits at most `timeout` seconds for any of `conditions` (objects with
+        a `wait(timeout)` method returning if the condition is met).
+        """
+        if len(conditions) == 1:
+            return conditions[0].wait(timeout)
+        deadline = time.monotonic() + timeout
+        while not any(cond.wait(0) for cond in conditions):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            conditions[0].wait(min(remaining, cls.POLL_INTERVAL))
+        return True
+
+    @classmethod
+    def _wait_for_run(cls, run_name, wait, until=None, rules=None):
+        """
+        Waits `wait` seconds for the run `run_name` to finish. Returns `True`
+        if it ended earlier, because `until` was met or `rules` failed it.
+        """
+        end = time.asctime(time.localtime(time.time() + wait))
+        logger.info('Waiting for %ss for run %s (until %s) to finish', wait,
+                    run_name, end)
+        conditions = [c for c in (until, rules) if c is not None]
+        if not conditions:
+            time.sleep(wait)
+            return False
+        start = time.monotonic()
+        ended_early = bool(cls._wait_any(conditions, wait))
+        if rules is not None and rules.failure is not None:
+            logger.info('Run %s ended after %.1fs: %s', run_name,
+                        time.monotonic() - start, rules.failure)
+        elif until is not None and until.wait(0):
+            logger.info('Run %s finished after %.1fs (%d/%d nodes done)',
+                        run_name, time.monotonic() - start, len(until.done),
+                        len(until.patterns))
+        elif until is not None:
+            logger.warning("Run %s did not meet its 'until' condition "
+                           "within %ss (%d/%d nodes done)", run_name, wait,
+                           len(until.done), until.quorum)
+        return ended_early
+
+    def output_stream(self, runner, ctx):
+        if 'aggregator' not in ctx and \
+           isinstance(runner.experiment, TerminalExperiment):
+            return runner.experiment.output
+        return super().output_stream(runner, ctx)
+
+    def send_to_node(self, runner, ctx, node, cmd):
+        if 'aggregator' not in ctx and \
+           isinstance(runner.experiment, TerminalExperiment):
+            # serial_aggregator sends input in the form `node;cmd` to node
+            runner.experiment.cmd(f'{node};{cmd}')
+            return
+        super().send_to_node(runner, ctx, node, cmd)
+
+    @staticmethod
+    def _serial_aggregator(runner, run, ctx):
+        """
+        Returns a context manager running the serial_aggregator in the TMUX
+        session and the stream of its output. If the run uses the native
+        serial_aggregator (which was started in `_pre_run()`), the context
+        manager does nothing.
+        """
+        if 'aggregator' in ctx:
+            return contextlib.nullcontext(), ctx['aggregator'].stream
+        if hasattr(runner.experiment.nodes, 'site'):
+            site = runner.experiment.nodes.site
+        else:
+            site = run.get('site')
+        if site is None:
+            logger.warning('No IoT-LAB site provided to run TMUX commands. '
+                           'Will assume we run on IoT-LAB frontend.')
+        with_a8 = any(f.board == 'iotlab-a8-m3'
+                      for f in runner.experiment.firmwares)
+        color = bool(run.get('serial_aggregator_color'))
+        serial_aggregator = runner.experiment.serial_aggregator(
+            site=site, with_a8=with_a8, color=color,
+            # a compressed log is written from the output stream
+            logname=None if 'log_writer' in ctx else ctx['logname'],
+            nodes=ctx.get('nodes')
+        )
+        return serial_aggregator, runner.experiment.output
+
+    @staticmethod
+    def _send_aggregator_cmds(aggregator, cmds, ack=None, timeout=None):
+        """
+        Sends `cmds` in the input format of serial_aggregator (`node;cmd`,
+        `node1,node2;cmd`, or `cmd` for all nodes) to the nodes of the native
+        `aggregator`. If the regular expression `ack` is provided, each command
+        is only sent after its predecessor was acknowledged or `timeout`
+        seconds passed (see `TerminalExperiment.send_cmds()`).
+        """
+        if timeout is None:
+            timeout = TerminalExperiment.ACK_TIMEOUT
+        for cmd in cmds:
+            targets, sep, node_cmd = cmd.partition(';')
+            if sep:
+                targets = targets.split(',')
+            else:
+                targets, node_cmd = aggregator.nodes, cmd
+            unknown = [node for node in targets
+                       if node not in aggregator.nodes]
+            if unknown:
+                raise DescriptionError(
+                    f"{', '.join(unknown)} in {cmd!r} not part of the run"
+                )
+            if ack is None:
+                acked = contextlib.nullcontext()
+            else:
+                acked = aggregator.stream.expect(ack)
+            with acked as expectation:
+                for node in targets:
+                    aggregator.send(node, f'{node_cmd}\n')
+                if ack is not None and expectation.wait(timeout) is None:
+                    logger.warning("%r was not acknowledged within %ss",
+                                   cmd, timeout)
+
     def run(self, runner, run, ctx, *args, **kwargs):
         # pylint: disable=unused-argument
         run_name = runner.run_name(run)
-        if not isinstance(runner.experiment, TmuxExperiment):
+        if not isinstance(runner.experiment, TerminalExperiment):
             logger.error('%s: %s is not a TMUX experiment', run_name,
                          runner.experiment)
             super().run(runner, run, ctx, *args, **kwargs)
@@ -95,31 +298,42 @@ class TmuxExperimentDispatcher(ExperimentDispatcher):
                 "'wait' for run or 'run_wait' in experiment description "
                 "required"
             )
-        if hasattr(runner.experiment.nodes, 'site'):
-            site = runner.experiment.nodes.site
+        if 'log_writer' in ctx:
+            ctx['log_writer'](f'Starting run {run_name}')
         else:
-            site = run.get('site')
-        if site is None:
-            logger.warning('No IoT-LAB site provided to run TMUX commands. '
-                           'Will assume we run on IoT-LAB frontend.')
-        with_a8 = any(f.board == 'iotlab-a8-m3'
-                      for f in runner.experiment.firmwares)
-        color = bool(run.get('serial_aggregator_color'))
-        logname = ctx['logname']
-        runner.experiment.cmd(f'echo "Starting run {run_name}" >> {logname}')
-        nodes = ctx.get('nodes')
-        with runner.experiment.serial_aggregator(site=site, with_a8=with_a8,
-                                                 color=color, logname=logname,
-                                                 nodes=nodes):
+            logname = ctx['logname']
+            with self._lock:
+                runner.experiment.cmd(
+                    f'echo "Starting run {run_name}" >> {logname}'
+                )
+        until = runner.get_until(run, ctx.get('nodes'))
+        serial_aggregator, output = self._serial_aggregator(runner, run, ctx)
+        with serial_aggregator:
             if runner.get_tmux_cmds(run):
-                for cmd in runner.get_tmux_cmds(run):
-                    runner.experiment.cmd(cmd.format(
-                        runner=runner, run=run, ctx=ctx,
-                        run_args=run.get('args'), **kwargs
-                    ), wait_after=.1)
-                until = time.asctime(time.localtime(time.time() + wait))
-                logger.info('Waiting for %ss for run %s (until %s) to '
-                            'finish', wait, run_name, until)
-                time.sleep(wait)
+                if until is None:
+                    listening = contextlib.nullcontext()
+                else:
+                    listening = output.listening(until)
+                cmds = [cmd.format(runner=runner, run=run, ctx=ctx,
+                                   run_args=run.get('args'), **kwargs)
+                        for cmd in runner.get_tmux_cmds(run)]
+                with listening:
+                    if 'aggregator' in ctx:
+                        # no serial_aggregator reads the terminal
+                        self._send_aggregator_cmds(
+                            ctx['aggregator'], cmds,
+                            ack=runner.get_tmux('ack'),
+                            timeout=runner.get_tmux('ack_timeout'),
+                        )
+                    else:
+                        # node groups share the terminal
+                        with self._lock:
+                            runner.experiment.send_cmds(
+                                cmds, ack=runner.get_tmux('ack'),
+                                timeout=runner.get_tmux('ack_timeout'),
+                            )
+                    if self._wait_for_run(run_name, wait, until,
+                                          ctx.get('rules')):
+                        ctx['ended_early'] = True
             else:
                 super().run(runner, run, ctx, *args, **kwargs)
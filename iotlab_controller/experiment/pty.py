@@ -0,0 +1,141 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import fcntl
+import os
+import pty
+import select
+import signal
+import subprocess
+import termios
+import time
+
+from ..experiment import base
+from ..experiment import stream
+from ..experiment import terminal
+
+
+def _set_controlling_terminal():   # pragma: no cover (runs in the child)
+    # make the PTY the controlling terminal of the new session, so C-c
+    # interrupts the foreground process
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class PtyExperiment(terminal.TerminalExperiment):
+    """
+    Drives the serial_aggregator through a shell in a pseudo-terminal owned
+    by this process instead of a TMUX pane. The output of the shell is read
+    directly into `output`.
+    """
+    KEYS = {"C-c": b"\x03", "C-d": b"\x04", "Enter": b"\r"}
+    # seconds to wait for the shell to accept commands in `start_shell()`
+    START_TIMEOUT = 5
+    # seconds to wait for the shell to exit in `stop_shell()`
+    STOP_TIMEOUT = 3
+    SHELL_READY = "iotlab-controller-shell-ready"
+
+    def __init__(self, name, nodes, *args, target=None, firmwares=None,
+                 exp_id=None, profiles=None, api=None, shell=None, **kwargs):
+        # pylint: disable=too-many-arguments
+        super().__init__(name=name, nodes=nodes, target=target,
+                         firmwares=firmwares, exp_id=exp_id, profiles=profiles,
+                         api=api, *args, **kwargs)
+        if shell is None:
+            shell = os.environ.get("SHELL", "/bin/sh")
+        self.shell = shell
+        self.process = None
+        self._fd = None
+        self._reader = None
+
+    def start_shell(self, cwd=None):
+        """
+        Starts the shell in a new pseudo-terminal, if it is not running yet.
+        """
+        if self.process is not None:
+            return self.process
+        master, slave = pty.openpty()
+        try:
+            # pylint: disable=consider-using-with,subprocess-popen-preexec-fn
+            self.process = subprocess.Popen(
+                [self.shell], stdin=slave, stdout=slave, stderr=slave,
+                cwd=cwd, start_new_session=True,
+                preexec_fn=_set_controlling_terminal,
+            )
+        except OSError:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        self._fd = master
+        self._reader = stream.FdReader(os.dup(master), self.output)
+        self._reader.start()
+        # a C-c before the shell set up its signal handlers would kill it.
+        # The output may follow a prompt, the quotes keep the echoed command
+        # from matching
+        with self.output.expect(f"{self.SHELL_READY}$") as ready:
+            self.cmd(f"echo '{self.SHELL_READY[0]}'{self.SHELL_READY[1:]}")
+            if ready.wait(self.START_TIMEOUT) is None:
+                self.stop_shell()
+                raise base.ExperimentError(
+                    f"Shell {self.shell} did not start"
+                )
+        return self.process
+
+    def stop_shell(self):
+        if self.process is None:
+            return
+        # interactive shells ignore SIGTERM, but exit when their terminal
+        # hangs up
+        self.process.send_signal(signal.SIGHUP)
+        try:
+            self.process.wait(self.STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._reader.stop()
+        os.close(self._fd)
+        self.process = None
+        self._reader = None
+        self._fd = None
+
+    def start_output_pipe(self):
+        """
+        The output of the shell is always read into `output`, so this only
+        checks that the shell is running.
+        """
+        assert self.process is not None
+
+    def stop_output_pipe(self):
+        pass
+
+    def reset_terminal(self):
+        # nothing to clean up on a terminal that is not displayed and
+        # `reset` would discard input typed ahead
+        pass
+
+    def _write(self, data):
+        assert self.process is not None
+        while data:
+            try:
+                written = os.write(self._fd, data)
+            except BlockingIOError:
+                # input buffer of the terminal is full
+                select.select([], [self._fd], [])
+                continue
+            data = data[written:]
+
+    def send_keys(self, keys, enter=False, wait_after=0):
+        data = self.KEYS.get(keys, keys.encode("utf-8")
+                             if isinstance(keys, str) else keys)
+        if enter:
+            data += self.KEYS["Enter"]
+        self._write(data)
+        if wait_after > 0:
+            time.sleep(wait_after)
+
+    def paste(self, text):
+        self._write(text.replace("\n", "\r").encode("utf-8"))
+
+    def hit_enter(self):
+        self.send_keys("Enter")
@@ -0,0 +1,170 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import logging
+import re
+import shlex
+import subprocess
+import threading
+
+from ..experiment.stream import parse_aggregator_line
+
+
+logger = logging.getLogger(__name__)
+
+
+class Rule:
+    r"""
+    Action taken when `node` (or any node if `None`) prints a message
+    matching `match`:
+
+    - `send`: command sent to the serial port of the nodes `to` (by default
+      the matching node)
+    - `shell`: shell command run on the host
+    - `fail`: marks the run as failed, `fail` may be the reason
+
+    Commands are formatted with `node`, `message`, and `match` (the regular
+    expression match), e.g. `"ping {match[1]}"`. If `once` is set, the rule
+    only triggers on its first match.
+
+    Node output is untrusted, so in `shell` commands the substituted values
+    are quoted as single shell words with `shlex.quote()`. Do not quote the
+    placeholders in the command yourself.
+
+    >>> rule = Rule("ping (\\S+)", send="ping {match[1]}", to="m3-2")
+    >>> rule.matches("m3-1", "ping fe80::1").group(1)
+    'fe80::1'
+    >>> rule.format(rule.send, "m3-1", "ping fe80::1")
+    'ping fe80::1'
+    >>> rule.format("echo {match[1]}", "m3-1", "ping $(reboot)", quote=True)
+    "echo '$(reboot)'"
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, match, node=None, send=None, to=None, shell=None,
+                 fail=None, once=False):
+        # pylint: disable=too-many-arguments
+        if isinstance(match, str):
+            match = re.compile(match)
+        if isinstance(to, str):
+            to = [to]
+        self.pattern = match
+        self.node = node
+        self.send = send
+        self.to = to
+        self.shell = shell
+        self.fail = fail
+        self.once = once
+        self.fired = False
+
+    def __repr__(self):
+        return f"<Rule {self.pattern.pattern!r}>"
+
+    def matches(self, node, message):
+        if (self.once and self.fired) or \
+           (self.node is not None and node != self.node):
+            return None
+        return self.pattern.search(message)
+
+    def format(self, cmd, node, message, match=None, quote=False):
+        # pylint: disable=too-many-arguments
+        if match is None:
+            match = self.pattern.search(message)
+        if quote:
+            node, message = shlex.quote(node), shlex.quote(message)
+            match = _QuotedMatch(match)
+        return cmd.format(node=node, message=message, match=match)
+
+
+class _QuotedMatch:
+    """
+    Returns the groups of `match` quoted for the shell.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, match):
+        self.match = match
+
+    def __getitem__(self, group):
+        value = self.match[group] if self.match is not None else None
+        return shlex.quote(value or "")
+
+
+class RuleEngine:
+    """
+    Evaluates `rules` against each line of serial_aggregator output it is
+    called with. `send(node, cmd)` is used to send commands to nodes.
+
+    Actions are executed in the thread feeding the lines, so they should be
+    short. Shell commands are started in the background; `close()` waits
+    for them to finish.
+    """
+    def __init__(self, rules, send=None):
+        self.rules = list(rules)
+        self.send = send
+        self.failure = None
+        self.failed = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = []
+
+    def __call__(self, line):
+        parsed = parse_aggregator_line(line)
+        if parsed is None:
+            return
+        _, node, message = parsed
+        for rule in self.rules:
+            with self._lock:
+                match = rule.matches(node, message)
+                if match is None:
+                    continue
+                rule.fired = True
+            self._trigger(rule, node, message, match)
+
+    def _send(self, rule, node, message, match):
+        cmd = rule.format(rule.send, node, message, match)
+        for target in rule.to or [node]:
+            logger.debug("%r: sending %r to %s", rule, cmd, target)
+            if self.send is None:
+                logger.warning("%r: unable to send %r to %s", rule, cmd,
+                               target)
+                continue
+            try:
+                self.send(target, cmd)
+            except Exception as exc:  # pylint: disable=broad-except
+                # do not tear down the thread feeding the output
+                logger.warning("%r: unable to send %r to %s: %s", rule, cmd,
+                               target, exc)
+
+    def _trigger(self, rule, node, message, match):
+        if rule.send is not None:
+            self._send(rule, node, message, match)
+        if rule.shell is not None:
+            cmd = rule.format(rule.shell, node, message, match, quote=True)
+            logger.debug("%r: running %r", rule, cmd)
+            try:
+                # pylint: disable=consider-using-with
+                self._procs.append(subprocess.Popen(cmd, shell=True))
+            except OSError as exc:
+                logger.warning("%r: unable to run %r: %s", rule, cmd, exc)
+        if rule.fail:
+            if isinstance(rule.fail, str):
+                reason = rule.format(rule.fail, node, message, match)
+            else:
+                reason = f"{node}: {message}"
+            with self._lock:
+                if self.failure is None:
+                    self.failure = reason
+            self.failed.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits at most `timeout` seconds for a rule to mark the run as failed.
+        Returns `True` if it did.
+        """
+        return self.failed.wait(timeout)
+
+    def close(self):
+        for proc in self._procs:
+            if proc.wait():
+                logger.warning("%s exited with %d", proc.args,
+                               proc.returncode)
+        self._procs = []
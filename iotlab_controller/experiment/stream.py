@@ -0,0 +1,362 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import collections
+import contextlib
+import logging
+import os
+import re
+import select
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ANSI_ESCAPE = re.compile(r"\x1b(\[[0-?]*[ -/]*[@-~]|[@-Z\\-_])")
+AGGREGATOR_STARTED = re.compile(r"^[0-9.]+;Aggregator started$")
+
+
+def clean_line(line):
+    r"""
+    Decodes a line of terminal output and strips carriage returns and ANSI
+    escape sequences from it.
+
+    >>> clean_line(b'\x1b[32m1634567.123;Aggregator started\x1b[0m\r')
+    '1634567.123;Aggregator started'
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    return ANSI_ESCAPE.sub("", line).replace("\r", "")
+
+
+def parse_aggregator_line(line):
+    """
+    Splits a line of serial_aggregator output into timestamp, node and
+    message. Returns `None` if the line is not in that format.
+
+    >>> parse_aggregator_line("1634567.123;m3-1;Hello World;!")
+    (1634567.123, 'm3-1', 'Hello World;!')
+    >>> parse_aggregator_line("$ serial_aggregator -i 12345") is None
+    True
+    """
+    parts = line.split(";", 2)
+    if len(parts) < 3:
+        return None
+    try:
+        return float(parts[0]), parts[1], parts[2]
+    except ValueError:
+        return None
+
+
+def is_aggregator_output(line):
+    """
+    Returns `True` if `line` was printed by serial_aggregator, i.e. it is
+    output of a node or the start marker of serial_aggregator, and not, e.g.,
+    a shell prompt or an echoed command.
+
+    >>> is_aggregator_output("1634567.123;m3-1;Hello World")
+    True
+    >>> is_aggregator_output("1634567.123;Aggregator started")
+    True
+    >>> is_aggregator_output("$ serial_aggregator -i 12345")
+    False
+    >>> is_aggregator_output("m3-1;reboot")
+    False
+    """
+    return parse_aggregator_line(line) is not None or \
+        AGGREGATOR_STARTED.match(line) is not None
+
+
+class FilteredListener:
+    """
+    Passes only lines for which `line_filter` returns `True` on to
+    `listener`.
+
+    >>> lines = []
+    >>> listener = FilteredListener(lines.append, is_aggregator_output)
+    >>> listener("$ serial_aggregator")
+    >>> listener("1634567.123;m3-1;Hello World")
+    >>> lines
+    ['1634567.123;m3-1;Hello World']
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, listener, line_filter):
+        self.listener = listener
+        self.line_filter = line_filter
+
+    def __call__(self, line):
+        if self.line_filter(line):
+            self.listener(line)
+
+
+class Expectation:
+    def __init__(self, pattern):
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+        self.match = None
+        self._event = threading.Event()
+
+    def __call__(self, line):
+        if self._event.is_set():
+            return
+        match = self.pattern.search(line)
+        if match:
+            self.match = match
+            self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits at most `timeout` seconds for a line matching the pattern.
+        Returns the match or `None` on timeout.
+        """
+        self._event.wait(timeout)
+        return self.match
+
+
+class QuorumExpectation:
+    """
+    Waits for `quorum` nodes to print a line matching one of their patterns.
+    `patterns` maps serial_aggregator node names to lists of patterns.
+    """
+    def __init__(self, patterns, quorum=None):
+        self.patterns = {
+            node: [re.compile(p) if isinstance(p, str) else p
+                   for p in node_patterns]
+            for node, node_patterns in patterns.items()
+        }
+        if quorum is None:
+            quorum = len(self.patterns)
+        self.quorum = quorum
+        self.done = set()
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def __call__(self, line):
+        parsed = parse_aggregator_line(line)
+        if parsed is None:
+            return
+        _, node, msg = parsed
+        if node in self.done or \
+           not any(p.search(msg) for p in self.patterns.get(node, [])):
+            return
+        with self._lock:
+            self.done.add(node)
+            if len(self.done) >= self.quorum:
+                self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits at most `timeout` seconds for the quorum to be reached.
+        Returns `True` if it was reached.
+        """
+        return self._event.wait(timeout)
+
+
+class LineStream:
+    """
+    Distributes lines of output to listeners as they arrive.
+
+    >>> stream = LineStream()
+    >>> with stream.expect("started$") as started:
+    ...     stream.feed("foobar")
+    ...     stream.feed("Aggregator started")
+    >>> started.wait(0).group(0)
+    'started'
+    """
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def feed(self, line):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(line)
+
+    @contextlib.contextmanager
+    def listening(self, listener):
+        self.add_listener(listener)
+        try:
+            yield listener
+        finally:
+            self.remove_listener(listener)
+
+    def expect(self, pattern):
+        return self.listening(Expectation(pattern))
+
+
+class OutputBuffer:
+    """
+    Keeps the last `lines` messages of each node of serial_aggregator output
+    in memory. Messages longer than `max_line_length` characters are
+    truncated, so memory usage is bounded.
+
+    >>> output = OutputBuffer(lines=2)
+    >>> for i in range(3):
+    ...     output(f"1634567.{i};m3-1;Hello {i}")
+    >>> output.tail("m3-1")
+    ['Hello 1', 'Hello 2']
+    >>> output.wait_for("Hello [0-9]", timeout=0)
+    (1634567.1, 'm3-1', 'Hello 1')
+    """
+    LINES = 1000
+    MAX_LINE_LENGTH = 1024
+
+    def __init__(self, lines=None, max_line_length=None):
+        if lines is None:
+            lines = self.LINES
+        if max_line_length is None:
+            max_line_length = self.MAX_LINE_LENGTH
+        self.lines = lines
+        self.max_line_length = max_line_length
+        self._buffers = {}
+        # sequence number of the last received message
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, line):
+        parsed = parse_aggregator_line(line)
+        if parsed is None:
+            return
+        timestamp, node, msg = parsed
+        with self._cond:
+            self._seq += 1
+            if node not in self._buffers:
+                self._buffers[node] = collections.deque(maxlen=self.lines)
+            self._buffers[node].append(
+                (self._seq, timestamp, msg[:self.max_line_length])
+            )
+            self._cond.notify_all()
+
+    def close(self):
+        pass
+
+    @property
+    def nodes(self):
+        with self._cond:
+            return sorted(self._buffers)
+
+    def tail(self, node, n=None):
+        """
+        Returns the last `n` (by default all buffered) messages of `node`.
+        """
+        with self._cond:
+            msgs = [msg for _, _, msg in self._buffers.get(node, ())]
+        if n is None:
+            return msgs
+        return msgs[-n:] if n > 0 else []
+
+    def _search(self, pattern, nodes, after):
+        res = None
+        res_seq = None
+        for node in nodes:
+            for seq, timestamp, msg in reversed(self._buffers.get(node, ())):
+                if seq <= after:
+                    break
+                if (res_seq is None or seq < res_seq) and \
+                   pattern.search(msg):
+                    res_seq = seq
+                    res = (seq, timestamp, node, msg)
+        return res
+
+    def wait_for(self, pattern, timeout=None, node=None, new_only=False):
+        """
+        Waits at most `timeout` seconds for a message of `node` (or any node)
+        matching `pattern`. Unless `new_only` is set, already buffered
+        messages are considered as well. Returns the earliest matching
+        `(timestamp, node, message)` or `None` on timeout.
+        """
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            after = self._seq if new_only else 0
+            while True:
+                nodes = list(self._buffers) if node is None else [node]
+                res = self._search(pattern, nodes, after)
+                if res is not None:
+                    return res[1:]
+                after = self._seq
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+class FdReader(threading.Thread):
+    """
+    Reads lines from the file descriptor `fd` in the background and feeds
+    them into `stream` until it is stopped or `fd` reaches its end. `fd` is
+    closed when reading stops.
+    """
+    def __init__(self, fd, stream, poll_interval=.1):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._fd = fd
+        self._buf = b""
+        self._eof = False
+        os.set_blocking(fd, False)
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return False
+        except OSError:
+            # e.g. a PTY whose other side is closed
+            data = b""
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        *lines, self._buf = self._buf.split(b"\n")
+        for line in lines:
+            self.stream.feed(clean_line(line))
+        return True
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set() and not self._eof:
+                readable, _, _ = select.select([self._fd], [], [],
+                                               self.poll_interval)
+                if readable:
+                    self._read()
+            # drain what is left
+            while self._read():
+                pass
+            if self._buf:
+                self.stream.feed(clean_line(self._buf))
+        finally:
+            os.close(self._fd)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class FifoReader(FdReader):
+    """
+    Reads lines from the FIFO at `path` in the background and feeds them
+    into `stream`.
+    """
+    def __init__(self, path, stream, poll_interval=.1):
+        # open read-write, so the FIFO does not signal EOF when a writer
+        # closes it
+        super().__init__(os.open(path, os.O_RDWR | os.O_NONBLOCK), stream,
+                         poll_interval=poll_interval)
+        self.path = path
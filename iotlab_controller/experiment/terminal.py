@@ -0,0 +1,157 @@
+# Copyright (C) 2019-21 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import abc
+import contextlib
+import logging
+import subprocess
+import time
+
+from ..ssh import frontend
+from ..experiment import base
+from ..experiment import stream
+
+
+class TerminalExperiment(base.BaseExperiment, abc.ABC):
+    """
+    Base class for experiments driving the serial_aggregator through a
+    terminal. Subclasses provide `send_keys()`, `paste()`, `hit_enter()`,
+    and feed the output of the terminal into `output` between
+    `start_output_pipe()` and `stop_output_pipe()`.
+    """
+    # seconds to wait for the serial_aggregator to start
+    SERIAL_AGGREGATOR_TIMEOUT = 12
+    AGGREGATOR_STARTED = "Aggregator started$"
+    # seconds to wait for the acknowledgement of a command in `send_cmds()`
+    ACK_TIMEOUT = 1
+    # `iotlab_controller.ssh.SSHMultiplexer` to reach the SSH frontends through
+    ssh_mux = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # output of the terminal while it is read
+        self.output = stream.LineStream()
+
+    @abc.abstractmethod
+    def start_output_pipe(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stop_output_pipe(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def send_keys(self, keys, enter=False, wait_after=0):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def paste(self, text):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def hit_enter(self):
+        raise NotImplementedError
+
+    def _ssh_prefix(self, site):
+        if self.ssh_mux is not None:
+            try:
+                return self.ssh_mux.prefix(self.username, site)
+            except (OSError, subprocess.SubprocessError) as exc:
+                logging.warning("Unable to multiplex SSH connection to %s: "
+                                "%s", site, exc)
+        return f"ssh {frontend(self.username, site)}"
+
+    def reset_terminal(self):
+        self.send_keys("reset", enter=True)
+
+    # pylint: disable=too-many-arguments
+    def start_serial_aggregator(self, site=None, with_a8=False, color=False,
+                                logname=None, nodes=None):
+        self.hit_ctrl_c()
+        time.sleep(.1)
+        self.reset_terminal()
+        if site is not None:
+            ssh = f"{self._ssh_prefix(site)} "
+        else:
+            logging.warning("Assuming to run on SSH frontend")
+            logging.warning("\tadd `site` parameter to "
+                            "`start_serial_aggregator()` to prevent")
+            ssh = ""
+        if with_a8:
+            with_a8 = " --with-a8"
+        else:
+            with_a8 = ""
+        if color:
+            color = " --color"
+        else:
+            color = ""
+        if nodes:
+            nodes = "".join(f" -l {arglist}" for arglist in nodes.arglists)
+        else:
+            nodes = ""
+        cmd = f"{ssh}serial_aggregator -i {self.exp_id}{nodes}{with_a8}{color}"
+        if logname is not None:
+            cmd += f"| tee -a {logname}"
+        self.send_keys(cmd, enter=True)
+
+    def stop_serial_aggregator(self):
+        self.hit_ctrl_c()
+
+    @contextlib.contextmanager
+    # pylint: disable=too-many-arguments
+    def serial_aggregator(self, site=None, with_a8=False, color=False,
+                          logname=None, nodes=None, timeout=None):
+        if timeout is None:
+            timeout = self.SERIAL_AGGREGATOR_TIMEOUT
+        try:
+            self.start_output_pipe()
+            with self.output.expect(self.AGGREGATOR_STARTED) as started:
+                self.start_serial_aggregator(site=site, with_a8=with_a8,
+                                             color=color, logname=logname,
+                                             nodes=nodes)
+                if not started.wait(timeout):
+                    raise base.ExperimentError(
+                        'Unable to start serial_aggregator'
+                    )
+            yield self
+        finally:
+            self.stop_serial_aggregator()
+            self.stop_serial_aggregator()
+            self.stop_serial_aggregator()
+            time.sleep(.1)
+            self.stop_output_pipe()
+
+    def cmd(self, cmd, wait_after=0):
+        self.send_keys(cmd, enter=True, wait_after=wait_after)
+
+    def send_cmds(self, cmds, ack=None, timeout=None):
+        """
+        Sends the commands `cmds` to the terminal. By default, all commands
+        are pasted in one go.
+
+        If the regular expression `ack` is provided, each command is only sent
+        after a line of `output` matched `ack` after the previous command
+        (e.g. a shell prompt) or `timeout` seconds passed. This requires the
+        output of the terminal to be read (see `start_output_pipe()`).
+        """
+        cmds = list(cmds)
+        if not cmds:
+            return
+        if ack is None:
+            self.paste("".join(f"{cmd}\n" for cmd in cmds))
+            return
+        if timeout is None:
+            timeout = self.ACK_TIMEOUT
+        for cmd in cmds:
+            with self.output.expect(ack) as acked:
+                self.paste(f"{cmd}\n")
+                if acked.wait(timeout) is None:
+                    logging.warning("%r was not acknowledged within %ss", cmd,
+                                    timeout)
+
+    def hit_ctrl_c(self):
+        self.send_keys("C-c")
+
+    def hit_ctrl_d(self):
+        self.send_keys("C-d")
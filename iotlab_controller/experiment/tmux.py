@@ -2,27 +2,118 @@
 #
 # Distributed under terms of the MIT license.
 
-import contextlib
 import logging
-import re
+import os
+import shlex
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
+import weakref
 
 import libtmux
 
-from ..constants import IOTLAB_DOMAIN
 from ..experiment import base
-
-
-class TmuxExperiment(base.BaseExperiment):
+from ..experiment import stream
+from ..experiment import terminal
+
+
+class TmuxPool:
+    """
+    Process-wide cache of the TMUX server and of panes by the target
+    `(session_name, window_name, pane_id)` they were looked up with.
+
+    Cached panes are validated with a single TMUX call before being handed
+    out again. A pane is claimed by the experiment using it until it
+    releases it, so concurrently running experiments do not share a pane.
+    """
+    PANE_FORMAT = "#{pid}\t#{session_name}\t#{window_name}\t#{pane_id}"
+
+    def __init__(self):
+        self._server = None
+        self._panes = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = libtmux.Server()
+        return self._server
+
+    def _describe(self, pane):
+        res = self.server.cmd("display-message", "-p", "-t",
+                              pane.get("pane_id"), self.PANE_FORMAT)
+        if res.returncode or not res.stdout:
+            return None
+        # server PID distinguishes panes of a restarted server with a reused
+        # pane ID
+        return tuple(res.stdout[0].split("\t"))
+
+    def get(self, target):
+        """
+        Returns the cached pane for `target` if it still exists and matches
+        `target` or `None` otherwise.
+        """
+        with self._lock:
+            if target not in self._panes:
+                return None
+            pane, desc = self._panes[target]
+            actual = self._describe(pane)
+            if actual == desc and \
+               all(t is None or t == a for t, a in zip(target, desc[1:])):
+                return pane
+            del self._panes[target]
+            return None
+
+    def put(self, target, pane):
+        desc = self._describe(pane)
+        if desc is None:
+            return
+        with self._lock:
+            self._panes[target] = (pane, desc)
+
+    def claim(self, pane, owner):
+        """
+        Claims `pane` for `owner`. Returns `False` if another owner still
+        uses it.
+        """
+        with self._lock:
+            pane_id = pane.get("pane_id")
+            current = self._owners.get(pane_id)
+            current = None if current is None else current()
+            if current is not None and current is not owner:
+                return False
+            self._owners[pane_id] = weakref.ref(owner)
+            return True
+
+    def release(self, owner):
+        with self._lock:
+            self._owners = {pane_id: ref
+                            for pane_id, ref in self._owners.items()
+                            if ref() not in (None, owner)}
+
+    def clear(self):
+        with self._lock:
+            self._panes = {}
+            self._owners = {}
+
+
+TMUX_POOL = TmuxPool()
+
+
+class TmuxExperiment(terminal.TerminalExperiment):
     def __init__(self, name, nodes, *args, target=None, firmwares=None,
                  exp_id=None, profiles=None, api=None, **kwargs):
         # pylint: disable=too-many-arguments
         super().__init__(name=name, nodes=nodes, target=target,
                          firmwares=firmwares, exp_id=exp_id, profiles=profiles,
                          api=api, *args, **kwargs)
-        self.tmux_server = libtmux.Server()
+        self.tmux_server = TMUX_POOL.server
         self.tmux_session = None
+        self._output_reader = None
+        self._output_dir = None
 
     def _create_tmux_session(self, session_name, window_name=None,
                              cwd=None):
@@ -32,7 +123,6 @@ class TmuxExperiment(base.BaseExperiment):
         if cwd is not None:
             cmd.extend(["-c", cwd])
         subprocess.run(cmd, check=True)
-        self.tmux_server = libtmux.Server()
         return self.tmux_server.find_where({"session_name": session_name})
 
     def _find_or_create_tmux_session(self, session_name, search_params,
@@ -51,98 +141,87 @@ class TmuxExperiment(base.BaseExperiment):
                     session_name, window_name, cwd
                 )   # pragma: no cover
 
+    def _find_or_create_pane(self, session_name, window_name=None,
+                             pane_id=None, cwd=None):
+        # find pane
+        search_params = {
+            "session_name": session_name,
+        }
+        if window_name is not None:
+            search_params["window_name"] = window_name
+        if pane_id is not None:
+            search_params["pane_id"] = pane_id
+
+        self._find_or_create_tmux_session(session_name, search_params,
+                                          window_name=window_name, cwd=cwd)
+        # find pane
+        if window_name is not None:
+            self.tmux_session = self.tmux_session.find_where(search_params)
+            if self.tmux_session.name != window_name:
+                self.tmux_session = self.tmux_session.session.new_window(
+                    window_name=window_name,
+                    start_directory=cwd,
+                    attach=False,
+                )
+        else:
+            self.tmux_session = self.tmux_session.select_window(0)
+        if pane_id is not None:
+            self.tmux_session = self.tmux_session.find_where(search_params)
+        else:
+            self.tmux_session = self.tmux_session.select_pane(0)
+        return self.tmux_session
+
     def initialize_tmux_session(self, session_name, window_name=None,
                                 pane_id=None, cwd=None):
         # pylint: disable=too-many-arguments
-        # Maybe fix later
         if self.tmux_session is None:
-            # find pane
-            search_params = {
-                "session_name": session_name,
-            }
-            if window_name is not None:
-                search_params["window_name"] = window_name
-            if pane_id is not None:
-                search_params["pane_id"] = pane_id
-
-            self._find_or_create_tmux_session(session_name, search_params,
-                                              window_name=window_name, cwd=cwd)
-            # find pane
-            if window_name is not None:
-                self.tmux_session = self.tmux_session.find_where(search_params)
-                if self.tmux_session.name != window_name:
-                    self.tmux_session = self.tmux_session.session.new_window(
-                        window_name=window_name,
-                        start_directory=cwd,
-                        attach=False,
-                    )
-            else:
-                self.tmux_session = self.tmux_session.select_window(0)
-            if pane_id is not None:
-                self.tmux_session = self.tmux_session.find_where(search_params)
-            else:
-                self.tmux_session = self.tmux_session.select_pane(0)
+            target = (session_name, window_name, pane_id)
+            pane = TMUX_POOL.get(target)
+            if pane is None:
+                pane = self._find_or_create_pane(session_name, window_name,
+                                                 pane_id, cwd)
+                TMUX_POOL.put(target, pane)
+            if not TMUX_POOL.claim(pane, self):
+                # another experiment uses the pane, use a window of our own
+                logging.info("TMUX pane %s:%s is in use, opening a new "
+                             "window", session_name, window_name or "")
+                pane = pane.window.session.new_window(
+                    window_name=window_name or self.name,
+                    start_directory=cwd, attach=False,
+                ).select_pane(0)
+                TMUX_POOL.claim(pane, self)
+            self.tmux_session = pane
         return self.tmux_session
 
-    # pylint: disable=too-many-arguments
-    def start_serial_aggregator(self, site=None, with_a8=False, color=False,
-                                logname=None, nodes=None):
-        self.hit_ctrl_c()
-        time.sleep(.1)
-        self.send_keys("reset", enter=True)
-        if site is not None:
-            ssh = f"ssh {self.username}@{site}.{IOTLAB_DOMAIN} "
-        else:
-            logging.warning("Assuming to run on SSH frontend")
-            logging.warning("\tadd `site` parameter to "
-                            "`start_serial_aggregator()` to prevent")
-            ssh = ""
-        if with_a8:
-            with_a8 = " --with-a8"
-        else:
-            with_a8 = ""
-        if color:
-            color = " --color"
-        else:
-            color = ""
-        if nodes:
-            nodes = f" -l {nodes.arglist}"
-        else:
-            nodes = ""
-        cmd = f"{ssh}serial_aggregator -i {self.exp_id}{nodes}{with_a8}{color}"
-        if logname is not None:
-            cmd += f"| tee -a {logname}"
-        self.send_keys(cmd, enter=True, wait_after=2)
-
-    def stop_serial_aggregator(self):
-        self.hit_ctrl_c()
-
-    @contextlib.contextmanager
-    # pylint: disable=too-many-arguments
-    def serial_aggregator(self, site=None, with_a8=False, color=False,
-                          logname=None, nodes=None):
-        try:
-            self.start_serial_aggregator(site=site, with_a8=with_a8,
-                                         color=color, logname=logname,
-                                         nodes=nodes)
-            comp = re.compile("Aggregator started$")
-            aggr_started = False
-            for _ in range(5):
-                for line in self.tmux_session.capture_pane():
-                    if comp.search(line):
-                        aggr_started = True
-                        break
-                if aggr_started:
-                    break
-                time.sleep(2)
-            if not aggr_started:
-                raise base.ExperimentError('Unable to start serial_aggregator')
-            yield self
-        finally:
-            self.stop_serial_aggregator()
-            self.stop_serial_aggregator()
-            self.stop_serial_aggregator()
-            time.sleep(.1)
+    def release_tmux_session(self):
+        """
+        Releases the TMUX pane for use by other experiments.
+        """
+        TMUX_POOL.release(self)
+
+    def start_output_pipe(self):
+        """
+        Pipes the output of the TMUX pane into `output`.
+        """
+        assert self.tmux_session is not None
+        if self._output_reader is not None:
+            return
+        self._output_dir = tempfile.mkdtemp(prefix="iotlab-controller-")
+        fifo = os.path.join(self._output_dir, "pane")
+        os.mkfifo(fifo)
+        self._output_reader = stream.FifoReader(fifo, self.output)
+        self._output_reader.start()
+        self.tmux_session.cmd("pipe-pane", f"cat >> {shlex.quote(fifo)}")
+
+    def stop_output_pipe(self):
+        if self._output_reader is None:
+            return
+        # without command, pipe-pane closes the current pipe
+        self.tmux_session.cmd("pipe-pane")
+        self._output_reader.stop()
+        self._output_reader = None
+        shutil.rmtree(self._output_dir, ignore_errors=True)
+        self._output_dir = None
 
     def send_keys(self, keys, enter=False, wait_after=0):
         assert self.tmux_session is not None
@@ -150,14 +229,24 @@ class TmuxExperiment(base.BaseExperiment):
         if wait_after > 0:
             time.sleep(wait_after)
 
-    def cmd(self, cmd, wait_after=0):
-        self.send_keys(cmd, enter=True, wait_after=wait_after)
-
-    def hit_ctrl_c(self):
-        self.send_keys("C-c")
-
-    def hit_ctrl_d(self):
-        self.send_keys("C-d")
+    def paste(self, text):
+        """
+        Pastes `text` into the TMUX pane with a single buffer paste. Line
+        feeds in `text` are entered as carriage returns.
+        """
+        assert self.tmux_session is not None
+        server = self.tmux_session.server
+        with tempfile.NamedTemporaryFile("w", prefix="iotlab-controller-",
+                                         suffix=".buf") as buf:
+            buf.write(text)
+            buf.flush()
+            name = os.path.basename(buf.name)
+            res = server.cmd("load-buffer", "-b", name, buf.name)
+            if res.stderr:
+                raise base.ExperimentError(
+                    f"Unable to load TMUX buffer: {' '.join(res.stderr)}"
+                )
+        self.tmux_session.cmd("paste-buffer", "-d", "-b", name)
 
     def hit_enter(self):
         assert self.tmux_session is not None
@@ -0,0 +1,185 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import gzip
+import io
+import os
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODECS = {
+    "gzip": {"ext": ".gz", "level": 6},
+    "zstd": {"ext": ".zst", "level": 3},
+}
+
+
+def default_codec():
+    """
+    Returns 'zstd' if the `zstandard` module is available and 'gzip'
+    otherwise.
+    """
+    if zstandard is None:
+        return "gzip"
+    return "zstd"
+
+
+def _check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("Codec 'zstd' requires the zstandard module")
+
+
+def part_filename(logname, part, codec):
+    """
+    >>> part_filename("run.log", 0, "gzip")
+    'run.log.gz'
+    >>> part_filename("run.log", 2, "zstd")
+    'run.log.2.zst'
+    """
+    ext = CODECS[codec]["ext"]
+    if part == 0:
+        return f"{logname}{ext}"
+    return f"{logname}.{part}{ext}"
+
+
+def _open_part(filename, codec, level):
+    if codec == "gzip":
+        return gzip.open(filename, "ab", compresslevel=level)
+    # pylint: disable=consider-using-with
+    return zstandard.ZstdCompressor(level=level).stream_writer(
+        open(filename, "ab")
+    )
+
+
+class CompressedLogWriter:
+    """
+    Writes lines to the compressed log `logname` (without the compression
+    extension). Compression runs in a background thread, so calling the
+    writer with a line only queues it.
+
+    If `rotate_size` is provided, a new part of the log is started, once the
+    uncompressed lines in the current part exceed `rotate_size` bytes.
+    Parts are numbered, e.g. `run.log.gz`, `run.log.1.gz`, `run.log.2.gz`.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, logname, codec=None, level=None, rotate_size=None):
+        if codec is None:
+            codec = default_codec()
+        _check_codec(codec)
+        if level is None:
+            level = CODECS[codec]["level"]
+        self.logname = logname
+        self.codec = codec
+        self.level = level
+        self.rotate_size = rotate_size
+        self.part = 0
+        # continue after existing parts
+        while os.path.exists(self.filename(self.part + 1)):
+            self.part += 1
+        self._part_size = 0
+        self._file = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __call__(self, line):
+        self._queue.put(line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def filename(self, part=None):
+        if part is None:
+            part = self.part
+        return part_filename(self.logname, part, self.codec)
+
+    def _write(self, data):
+        if self.rotate_size is not None and self._file is not None and \
+           self._part_size + len(data) > self.rotate_size:
+            self._file.close()
+            self._file = None
+            self.part += 1
+            self._part_size = 0
+        if self._file is None:
+            self._file = _open_part(self.filename(), self.codec, self.level)
+        self._file.write(data)
+        self._part_size += len(data)
+
+    def _run(self):
+        done = False
+        while not done:
+            lines = [self._queue.get()]
+            # write out everything queued up in the meantime in one go
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for line in lines:
+                if line is None:
+                    done = True
+                    break
+                self._write(f"{line}\n".encode("utf-8"))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+def log_parts(logname):
+    """
+    Returns the existing files of the log `logname` (without compression
+    extension) in order.
+    """
+    if os.path.exists(logname):
+        return [logname]
+    for codec in CODECS:
+        part = 0
+        res = []
+        while os.path.exists(part_filename(logname, part, codec)):
+            res.append(part_filename(logname, part, codec))
+            part += 1
+        if res:
+            return res
+    return []
+
+
+def _open_text(filename):
+    if filename.endswith(CODECS["gzip"]["ext"]):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    if filename.endswith(CODECS["zstd"]["ext"]):
+        _check_codec("zstd")
+        # pylint: disable=consider-using-with
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(open(filename, "rb")),
+            encoding="utf-8",
+        )
+    return open(filename, encoding="utf-8")
+
+
+def read_log(logname):
+    """
+    Iterates over the lines of the (possibly compressed and rotated) log
+    `logname`, decompressing on the fly.
+    """
+    for filename in log_parts(logname):
+        with _open_text(filename) as log:
+            for line in log:
+                yield line.rstrip("\n")
@@ -0,0 +1,82 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import threading
+import time
+
+from ..experiment.stream import parse_aggregator_line
+
+
+class DemuxLogWriter:
+    """
+    Splits serial_aggregator output by node as it arrives and appends it to
+    one file per node, named `{prefix}.{node}.log`. Lines not originating from
+    a node are ignored.
+
+    Lines are buffered and written out once `flush_size` bytes are buffered
+    or `flush_interval` seconds passed since the last flush.
+    """
+    # pylint: disable=too-many-instance-attributes
+    FLUSH_SIZE = 64 * 1024
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, prefix, flush_size=None, flush_interval=None):
+        self.prefix = prefix
+        if flush_size is None:
+            flush_size = self.FLUSH_SIZE
+        if flush_interval is None:
+            flush_interval = self.FLUSH_INTERVAL
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffers = {}
+        self._buffered = 0
+        self._files = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, line):
+        parsed = parse_aggregator_line(line)
+        if parsed is None:
+            return
+        node = parsed[1]
+        with self._lock:
+            self._buffers.setdefault(node, []).append(f"{line}\n")
+            self._buffered += len(line) + 1
+            if self._buffered >= self.flush_size or \
+               (time.monotonic() - self._last_flush) >= self.flush_interval:
+                self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def filename(self, node):
+        return f"{self.prefix}.{node}.log"
+
+    def _flush(self):
+        for node, buf in self._buffers.items():
+            if not buf:
+                continue
+            if node not in self._files:
+                # pylint: disable=consider-using-with
+                self._files[node] = open(self.filename(node), "a",
+                                         encoding="utf-8")
+            self._files[node].write("".join(buf))
+            self._files[node].flush()
+            buf.clear()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            for file in self._files.values():
+                file.close()
+            self._files = {}
@@ -0,0 +1,165 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import json
+import logging
+import mmap
+import os
+
+try:
+    import numpy
+except ImportError:                     # pragma: no cover
+    logging.warning("Can't import numpy, you won't be able to use "
+                    "iotlab_controller.logs.index")    # pragma: no cover
+
+from . import parser
+
+
+class LogIndex:
+    """
+    Sidecar index `{logname}.idx` of the serial_aggregator log `logname`.
+
+    The log is split into time buckets of `interval` seconds. The index
+    records the byte offset at which each bucket starts and in which buckets
+    each node printed. Timestamps are expected to be non-decreasing; a line
+    with an earlier timestamp than its predecessor is counted to the bucket
+    of its predecessor.
+
+    The index is built lazily on the first query and extended when the log
+    grew since.
+    """
+    VERSION = 1
+    INTERVAL = 10.0
+    CHUNK_SIZE = parser.CHUNK_SIZE
+
+    def __init__(self, logname, interval=None):
+        if interval is None:
+            interval = self.INTERVAL
+        self.logname = logname
+        self.interval = interval
+        self.size = 0
+        self.buckets = []
+        self.offsets = []
+        self.nodes = {}
+        self._load()
+
+    @property
+    def filename(self):
+        return f"{self.logname}.idx"
+
+    def _load(self):
+        try:
+            with open(self.filename, encoding="utf-8") as idx:
+                content = json.load(idx)
+        except (OSError, ValueError):
+            return
+        if content.get("version") != self.VERSION or \
+           content.get("interval") != self.interval or \
+           content.get("size", 0) > os.path.getsize(self.logname):
+            # outdated or the log was rewritten
+            return
+        self.size = content["size"]
+        self.buckets = [b for b, _ in content["buckets"]]
+        self.offsets = [o for _, o in content["buckets"]]
+        self.nodes = {node: set(buckets)
+                      for node, buckets in content["nodes"].items()}
+
+    def dump(self):
+        with open(self.filename, "w", encoding="utf-8") as idx:
+            json.dump({
+                "version": self.VERSION,
+                "interval": self.interval,
+                "size": self.size,
+                "buckets": list(zip(self.buckets, self.offsets)),
+                "nodes": {node: sorted(buckets)
+                          for node, buckets in self.nodes.items()},
+            }, idx)
+
+    def _index_chunk(self, offset, chunk):
+        log = parser.parse_regions(chunk, [(0, len(chunk))])
+        if len(log) == 0:
+            return
+        buckets = (log.timestamps // self.interval).astype(numpy.int64)
+        if self.buckets:
+            buckets[0] = max(buckets[0], self.buckets[-1])
+        buckets = numpy.maximum.accumulate(buckets)
+        new = numpy.flatnonzero(numpy.diff(buckets, prepend=buckets[0] - 1))
+        for idx in new.tolist():
+            bucket = int(buckets[idx])
+            if self.buckets and self.buckets[-1] == bucket:
+                continue
+            # start of the line of the first message in the bucket
+            start = chunk.rfind(b"\n", 0, int(log.starts[idx])) + 1
+            self.buckets.append(bucket)
+            self.offsets.append(offset + start)
+        # unique (bucket, node) pairs, combined into one integer each
+        first = int(buckets[0])
+        pairs = numpy.unique((buckets - first) * len(log.nodes) +
+                             log.node_ids)
+        for pair in pairs.tolist():
+            bucket, node_id = divmod(pair, len(log.nodes))
+            self.nodes.setdefault(log.nodes[node_id], set()) \
+                .add(first + bucket)
+
+    def update(self):
+        """
+        Indexes the lines added to the log since the last update and writes
+        the index file, if there are any.
+        """
+        size = os.path.getsize(self.logname)
+        if size <= self.size:
+            return
+        with open(self.logname, "rb") as log:
+            log.seek(self.size)
+            for offset, chunk in parser.read_chunks(log, self.CHUNK_SIZE,
+                                                    offset=self.size):
+                if not chunk.endswith(b"\n"):
+                    # incomplete line, index when it is complete
+                    break
+                self._index_chunk(offset, chunk)
+                self.size = offset + len(chunk)
+        self.dump()
+
+    def regions(self, nodes=None, start=None, end=None):
+        """
+        Returns the byte ranges of the log that may contain lines of `nodes`
+        in the time window `[start, end)`.
+        """
+        first = -numpy.inf if start is None else start // self.interval
+        last = numpy.inf if end is None else end // self.interval
+        if nodes is not None:
+            candidates = set()
+            for node in nodes:
+                candidates.update(self.nodes.get(node, set()))
+        res = []
+        for i, bucket in enumerate(self.buckets):
+            if bucket < first or bucket > last or \
+               (nodes is not None and bucket not in candidates):
+                continue
+            region_end = self.offsets[i + 1] if (i + 1) < len(self.offsets) \
+                else self.size
+            if res and res[-1][1] == self.offsets[i]:
+                # merge with adjacent region
+                res[-1] = (res[-1][0], region_end)
+            else:
+                res.append((self.offsets[i], region_end))
+        return res
+
+    def query(self, nodes=None, start=None, end=None, pattern=None):
+        """
+        Returns a `parser.ParsedLog` of the lines of `nodes` in the time
+        window `[start, end)` whose messages match `pattern`. Only the
+        regions of the log relevant to the query are read from the
+        memory-mapped log.
+        """
+        self.update()
+        regions = self.regions(nodes=nodes, start=start, end=end)
+        if not regions:
+            buffer = b""
+        else:
+            with open(self.logname, "rb") as log:
+                buffer = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        return parser.parse_regions(buffer, regions).filter(
+            nodes=nodes, start=start, end=end, pattern=pattern
+        )
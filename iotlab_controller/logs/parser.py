@@ -0,0 +1,259 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import logging
+import mmap
+import os
+import re
+
+try:
+    import numpy
+except ImportError:                     # pragma: no cover
+    logging.warning("Can't import numpy, you won't be able to use "
+                    "iotlab_controller.logs.parser")   # pragma: no cover
+
+
+CHUNK_SIZE = 16 * 1024 * 1024
+NEWLINE = ord("\n")
+SEPARATOR = ord(";")
+CARRIAGE_RETURN = ord("\r")
+# fields of valid lines are never longer than this; longer fields would blow
+# up the fixed-width arrays of `_gather()`
+MAX_TIMESTAMP_LENGTH = 32
+MAX_NODE_LENGTH = 64
+
+
+def _gather(data, starts, ends):
+    """
+    Returns the fields `data[starts[i]:ends[i]]` as fixed-width byte string
+    array.
+    """
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1) if len(lengths) else 1
+    cols = numpy.arange(width)
+    idx = numpy.minimum(starts[:, None] + cols, len(data) - 1)
+    fields = data[idx]
+    fields[cols >= lengths[:, None]] = 0
+    return fields.view(f"S{width}").ravel()
+
+
+def _float_or_nan(field):
+    try:
+        return float(field)
+    except ValueError:
+        return numpy.nan
+
+
+def _to_float(fields):
+    try:
+        return fields.astype(numpy.float64)
+    except ValueError:
+        return numpy.array([_float_or_nan(f) for f in fields],
+                           dtype=numpy.float64)
+
+
+def _parse_chunk(data, offset=0):
+    """
+    Parses all lines in the `numpy.uint8` array `data`. Lines not in the
+    format `<timestamp>;<node>;<message>` are skipped.
+    Returns timestamps, node names (as byte strings), and start and end
+    offsets of the messages (shifted by `offset`).
+    """
+    line_ends = numpy.flatnonzero(data == NEWLINE)
+    if len(data) and data[-1] != NEWLINE:
+        line_ends = numpy.append(line_ends, len(data))
+    line_starts = numpy.empty_like(line_ends)
+    line_starts[:1] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    separators = numpy.flatnonzero(data == SEPARATOR)
+    # index of the first separator after the start of each line
+    first = numpy.searchsorted(separators, line_starts)
+    valid = (first + 1) < len(separators)
+    first, line_starts, line_ends = \
+        first[valid], line_starts[valid], line_ends[valid]
+    first_pos = separators[first]
+    second_pos = separators[first + 1]
+    valid = (second_pos < line_ends) & \
+        ((first_pos - line_starts) <= MAX_TIMESTAMP_LENGTH) & \
+        ((second_pos - first_pos - 1) <= MAX_NODE_LENGTH)
+    first_pos, second_pos, line_starts, line_ends = \
+        first_pos[valid], second_pos[valid], line_starts[valid], \
+        line_ends[valid]
+    timestamps = _to_float(_gather(data, line_starts, first_pos))
+    valid = ~numpy.isnan(timestamps)
+    first_pos, second_pos, line_ends = \
+        first_pos[valid], second_pos[valid], line_ends[valid]
+    # strip carriage returns
+    line_ends = line_ends - (data[line_ends - 1] == CARRIAGE_RETURN)
+    return (
+        timestamps[valid],
+        _gather(data, first_pos + 1, second_pos),
+        second_pos + 1 + offset,
+        line_ends + offset,
+    )
+
+
+class ParsedLog:
+    """
+    Columnar representation of a serial_aggregator log.
+
+    - `timestamps`: `float64` array of the timestamps of each line
+    - `node_ids`: index of the node of each line into `nodes`
+    - `nodes`: names of all nodes
+    - `starts`, `ends`: offsets of the message of each line into `buffer`
+    """
+    def __init__(self, timestamps, node_ids, nodes, starts, ends, buffer):
+        # pylint: disable=too-many-arguments
+        self.timestamps = timestamps
+        self.node_ids = node_ids
+        self.nodes = nodes
+        self.starts = starts
+        self.ends = ends
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, idx):
+        return (self.timestamps[idx], self.nodes[self.node_ids[idx]],
+                self.message(idx))
+
+    def message(self, idx):
+        return bytes(self.buffer[self.starts[idx]:self.ends[idx]]) \
+            .decode("utf-8", errors="replace")
+
+    def messages(self):
+        for idx in range(len(self)):
+            yield self.message(idx)
+
+    def select(self, mask):
+        return ParsedLog(self.timestamps[mask], self.node_ids[mask],
+                         self.nodes, self.starts[mask], self.ends[mask],
+                         self.buffer)
+
+    def filter(self, nodes=None, start=None, end=None, pattern=None):
+        """
+        Returns the lines of `nodes` with timestamps in `[start, end)` whose
+        messages match `pattern`.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        if nodes is not None:
+            node_ids = [i for i, node in enumerate(self.nodes)
+                        if node in nodes]
+            mask &= numpy.isin(self.node_ids, node_ids)
+        if start is not None:
+            mask &= self.timestamps >= start
+        if end is not None:
+            mask &= self.timestamps < end
+        res = self.select(mask)
+        if pattern is None:
+            return res
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern.encode())
+        matches = numpy.fromiter(
+            (pattern.search(res.buffer[s:e]) is not None
+             for s, e in zip(res.starts.tolist(), res.ends.tolist())),
+            dtype=bool, count=len(res),
+        )
+        return res.select(matches)
+
+
+def _factorize(fields):
+    """
+    Returns the unique values of the byte string array `fields` and the
+    index of each field into them.
+    """
+    if fields.dtype.itemsize > 8:
+        return numpy.unique(fields, return_inverse=True)
+    # short strings (as node names usually are) are compared faster as
+    # integers
+    padded = numpy.zeros(len(fields), dtype="S8")
+    padded[:] = fields
+    keys, node_ids = numpy.unique(padded.view(numpy.uint64),
+                                  return_inverse=True)
+    names = keys.view("S8").astype(fields.dtype)
+    # restore lexicographic order of the names
+    order = numpy.argsort(names)
+    remap = numpy.empty_like(order)
+    remap[order] = numpy.arange(len(order))
+    return names[order], remap[node_ids]
+
+
+def read_chunks(log, chunk_size, offset=0):
+    """
+    Reads the file `log` in chunks of about `chunk_size` bytes, split at line
+    ends. Yields the chunks with their offset (starting at `offset`).
+    """
+    rest = b""
+    while True:
+        chunk = log.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        cut = chunk.rfind(b"\n") + 1
+        rest = chunk[cut:]
+        if cut:
+            yield offset, chunk[:cut]
+            offset += cut
+    if rest:
+        yield offset, rest
+
+
+def _parse_chunks(chunks):
+    parts = [_parse_chunk(numpy.frombuffer(chunk, dtype=numpy.uint8),
+                          offset)
+             for offset, chunk in chunks if len(chunk)]
+    if not parts:
+        empty = numpy.empty(0, dtype=numpy.int64)
+        return ParsedLog(numpy.empty(0), empty, [], empty, empty, b"")
+    timestamps, nodes, starts, ends = (numpy.concatenate(col)
+                                       for col in zip(*parts))
+    node_names, node_ids = _factorize(nodes)
+    return ParsedLog(
+        timestamps, node_ids.ravel(),
+        [n.decode("utf-8", errors="replace") for n in node_names],
+        starts, ends, None,
+    )
+
+
+def parse_regions(buffer, regions):
+    """
+    Parses only the regions `[start, end)` of `buffer` (e.g. a memory-mapped
+    log) in `regions`. Regions must start at the beginning of a line.
+    """
+    view = memoryview(buffer)
+    res = _parse_chunks((start, view[start:end]) for start, end in regions)
+    res.buffer = buffer
+    return res
+
+
+def parse_log(filename, nodes=None, start=None, end=None, pattern=None,
+              use_mmap=False, chunk_size=CHUNK_SIZE):
+    """
+    Parses the serial_aggregator log `filename` into a `ParsedLog`, filtered
+    by `nodes`, the time window `[start, end)`, and the regular expression
+    `pattern` on the messages.
+
+    If `use_mmap` is `True`, the file is memory-mapped and the messages of
+    the result are backed by the mapping instead of being read into memory.
+    Otherwise, the file is read and parsed in chunks of `chunk_size` bytes.
+    """
+    # pylint: disable=too-many-arguments
+    with open(filename, "rb") as log:
+        if use_mmap and os.fstat(log.fileno()).st_size:
+            buffer = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+            res = _parse_chunks([(0, buffer)])
+        else:
+            buffer = bytearray()
+
+            def chunks():
+                # collect the file while parsing, so each chunk can be
+                # released as soon as it is parsed
+                for offset, chunk in read_chunks(log, chunk_size):
+                    buffer.extend(chunk)
+                    yield offset, chunk
+
+            res = _parse_chunks(chunks())
+    res.buffer = buffer
+    return res.filter(nodes=nodes, start=start, end=end, pattern=pattern)
@@ -17,6 +17,27 @@ except ImportError:                     # pragma: no cover
 from iotlab_controller import common
 
 
+def id_ranges(ids):
+    """
+    Compresses node IDs into the range syntax of the IoT-LAB tools.
+
+    >>> id_ranges([5, 1, 2, 3, 7, 8, 10])
+    '1-3+5+7-8+10'
+    """
+    res = []
+    start = end = None
+    for node_id in sorted(set(ids)):
+        if end is not None and node_id == end + 1:
+            end = node_id
+            continue
+        if start is not None:
+            res.append(str(start) if start == end else f"{start}-{end}")
+        start = end = node_id
+    if start is not None:
+        res.append(str(start) if start == end else f"{start}-{end}")
+    return "+".join(res)
+
+
 class NodeError(Exception):
     pass
 
@@ -130,6 +151,8 @@ class BaseNodes:
         }
         self.node_class = node_class
         self.iter_idx = -1
+        # nodes the cached `arglists` were generated for and the arglists
+        self._arglists = None
 
     def __len__(self):
         return len(self.nodes)
@@ -215,6 +238,32 @@ class BaseNodes:
             kwargs["site"] = site
         return self.api.get_nodes(**kwargs)["items"]
 
+    @property
+    def arglists(self):
+        """
+        Returns the node lists for the `-l` option of the IoT-LAB tools, one
+        per site and architecture of the nodes.
+
+        >>> nodes = BaseNodes()
+        >>> nodes.add("m3-1.paris.iot-lab.info")
+        >>> nodes.add("m3-2.paris.iot-lab.info")
+        >>> nodes.add("a8-1.paris.iot-lab.info")
+        >>> nodes.add("m3-3.paris.iot-lab.info")
+        >>> nodes.arglists
+        ['paris,a8,1', 'paris,m3,1-3']
+        """
+        if self._arglists is None or self._arglists[0] != self.nodes.keys():
+            groups = {}
+            for node in self:
+                arch_name, node_id = node.uri.split('.')[0].rsplit('-', 1)
+                groups.setdefault((node.site, arch_name), []) \
+                    .append(int(node_id))
+            self._arglists = (set(self.nodes), [
+                f"{site},{arch_name},{id_ranges(ids)}"
+                for (site, arch_name), ids in sorted(groups.items())
+            ])
+        return list(self._arglists[1])
+
     @property
     def arglist(self):
         """
@@ -224,27 +273,12 @@ class BaseNodes:
         >>> nodes.arglist
         'paris,m3,1+3'
         """
-        site = None
-        arch = None
-        arch_name = None
-        node_nums = []
-        for node in self:
-            if site is None:
-                site = node.site
-            if arch is None:
-                arch = node.arch
-            if node.site != site:
-                raise AttributeError(
-                    "Can not produce arglist, nodes have different sites"
-                )   # pragma: no cover
-            if node.arch != arch:
-                raise AttributeError(
-                    "Can not produce arglist, nodes have different archs"
-                )   # pragma: no cover
-            if arch_name is None:
-                arch_name = node.uri.split('.')[0].split('-')[0]
-            node_nums.append(node.uri.split('.')[0].split('-')[1])
-        return f"{site},{arch_name},{'+'.join(node_nums)}"
+        arglists = self.arglists
+        if len(arglists) != 1:
+            raise AttributeError(
+                "Can not produce arglist, nodes have different sites or archs"
+            )
+        return arglists[0]
 
     def add(self, node):
         """
@@ -303,6 +337,31 @@ class BaseNodes:
                                          api=self.api,
                                          node_class=self.node_class)
 
+    def partition(self, num):
+        """
+        Splits the nodes into at most `num` disjoint groups of (almost) equal
+        size.
+
+        >>> nodes = BaseNodes(["m3-1.lille.iot-lab.info",
+        ...                    "m3-2.lille.iot-lab.info",
+        ...                    "m3-3.lille.iot-lab.info"])
+        >>> for group in nodes.partition(2):
+        ...     print(sorted(n.uri for n in group))
+        ['m3-1.lille.iot-lab.info', 'm3-2.lille.iot-lab.info']
+        ['m3-3.lille.iot-lab.info']
+        """
+        if num < 1:
+            raise ValueError(f"Can not partition nodes into {num} groups")
+        uris = list(self.nodes)
+        size, rest = divmod(len(uris), num)
+        res = []
+        start = 0
+        for i in range(min(num, len(uris))):
+            end = start + size + (1 if i < rest else 0)
+            res.append(self.select(uris[start:end]))
+            start = end
+        return res
+
     def to_json(self):
         return json.dumps({n: self.nodes[n].to_dict()
                            for n in self.nodes})
@@ -530,9 +589,38 @@ class NetworkedNodes(BaseNodes):
             n if self._is_uri(n) else common.get_uri(self.site, n)
             for n in nodes
         ])
+        res.site = self.site
         res.network = networkx.Graph(self.network.subgraph(nodes))
         return res
 
+    def partition(self, num):
+        """
+        Splits the nodes into at most `num` disjoint groups without splitting
+        connected parts of the network, so nodes of different groups do not
+        interact. The groups are balanced by their number of nodes.
+
+        >>> import io
+        >>> nodes = NetworkedNodes("grenoble",
+        ...     io.BytesIO(
+        ...         b"m3-1 m3-2 2\\nm3-2 m3-3 1\\nm3-4 m3-5 1\\nm3-6 m3-7 1"
+        ...     )
+        ... )
+        >>> for group in nodes.partition(2):
+        ...     print(sorted(group.network.nodes()))
+        ['m3-1', 'm3-2', 'm3-3']
+        ['m3-4', 'm3-5', 'm3-6', 'm3-7']
+        """
+        if num < 1:
+            raise ValueError(f"Can not partition nodes into {num} groups")
+        components = sorted(
+            (sorted(c) for c in networkx.connected_components(self.network)),
+            key=len, reverse=True
+        )
+        groups = [[] for _ in range(min(num, len(components)))]
+        for component in components:
+            min(groups, key=len).extend(component)
+        return [self.select(group) for group in groups]
+
     def save_edgelist(self, path):
         """
         >>> import io
@@ -0,0 +1,124 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import atexit
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from iotlab_controller import constants
+
+
+logger = logging.getLogger(__name__)
+
+
+def frontend(user, site):
+    """
+    >>> frontend("user", "grenoble")
+    'user@grenoble.iot-lab.info'
+    """
+    return f"{user}@{site}.{constants.IOTLAB_DOMAIN}"
+
+
+class SSHMultiplexer:
+    """
+    Keeps one persistent OpenSSH ControlMaster connection per IoT-LAB SSH
+    frontend, so commands on the frontend do not need an SSH handshake and
+    authentication of their own. Masters are started on first use and
+    stopped by `close()` or when the process exits.
+    """
+    SSH = "ssh"
+    # seconds to wait for a master to connect
+    CONNECT_TIMEOUT = 30
+
+    def __init__(self, ssh=None):
+        if ssh is None:
+            ssh = self.SSH
+        self.ssh = ssh
+        self.control_dir = None
+        self._masters = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def control_path(self, host):
+        if self.control_dir is None:
+            # keep the path short, UNIX socket paths are limited to about 100
+            # characters
+            self.control_dir = tempfile.mkdtemp(prefix="iotlab-ssh-")
+            atexit.register(self.close)
+        return os.path.join(self.control_dir, host)
+
+    def _ctl(self, host, command):
+        return subprocess.run(
+            [self.ssh, "-o", f"ControlPath={self.control_path(host)}",
+             "-O", command, host],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=False,
+        ).returncode == 0
+
+    def start(self, user, site):
+        """
+        Ensures that a master connection to the frontend of `site` is running
+        and returns its control path.
+        """
+        host = frontend(user, site)
+        with self._lock:
+            if host in self._masters and self._ctl(host, "check"):
+                return self.control_path(host)
+            logger.info("Starting SSH master connection to %s", host)
+            if os.path.exists(self.control_path(host)):
+                # socket of a master that is gone
+                os.remove(self.control_path(host))
+            # -f: go to background once connected
+            subprocess.run(
+                [self.ssh, "-f", "-N", "-M",
+                 "-o", f"ControlPath={self.control_path(host)}",
+                 "-o", "ControlPersist=yes", host],
+                check=True, timeout=self.CONNECT_TIMEOUT,
+                stdin=subprocess.DEVNULL,
+            )
+            self._masters.add(host)
+            return self.control_path(host)
+
+    def args(self, user, site):
+        """
+        Returns the arguments to run a command on the frontend of `site`
+        through its master connection.
+        """
+        path = self.start(user, site)
+        return [self.ssh, "-o", f"ControlPath={path}", frontend(user, site)]
+
+    def prefix(self, user, site):
+        """
+        Returns `args()` as prefix for a shell command line.
+        """
+        return " ".join(shlex.quote(arg) for arg in self.args(user, site))
+
+    def run(self, user, site, cmd, **kwargs):
+        """
+        Runs the shell command `cmd` on the frontend of `site` with
+        `subprocess.run()`.
+        """
+        return subprocess.run(self.args(user, site) + [cmd],
+                              check=kwargs.pop("check", False), **kwargs)
+
+    def close(self):
+        with self._lock:
+            for host in self._masters:
+                logger.info("Stopping SSH master connection to %s", host)
+                self._ctl(host, "exit")
+            self._masters = set()
+            if self.control_dir is not None:
+                shutil.rmtree(self.control_dir, ignore_errors=True)
+                atexit.unregister(self.close)
+                self.control_dir = None
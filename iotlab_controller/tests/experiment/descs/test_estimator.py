@@ -0,0 +1,168 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import pytest
+
+from iotlab_controller.experiment.descs import estimator
+from iotlab_controller.experiment.descs import file_handler
+from iotlab_controller.experiment.descs import runner as descs_runner
+
+
+def _runs(exp):
+    handler = file_handler.DescriptionFileHandler('test.yaml')
+    return handler.load_content({123: exp})[123]['runs']
+
+
+def _mock_runner(mocker, runs, matrix=None, **kwargs):
+    def num_pending_runs():
+        return len(runs) + (0 if matrix is None else matrix.num_pending())
+
+    return mocker.Mock(runs=runs, matrix=matrix,
+                       num_pending_runs=num_pending_runs, **kwargs)
+
+
+def test_duration_estimator_record():
+    timings = {}
+    est = estimator.DurationEstimator(timings)
+    est.record('reflash', 10)
+    est.record('reflash', 20)
+    assert timings == {'reflash': {'mean': 15.0, 'count': 2}}
+    assert est.timing('reflash') == 15.0
+    # unmeasured phases fall back to default values
+    assert est.timing('reset') == est.DEFAULT_TIMINGS['reset']
+    assert est.timing('run') == 0
+
+
+def test_duration_estimator_record_max_samples():
+    est = estimator.DurationEstimator()
+    for _ in range(est.MAX_SAMPLES):
+        est.record('reset', 2)
+    est.record('reset', 2 + est.MAX_SAMPLES)
+    assert est.timings['reset']['count'] == est.MAX_SAMPLES
+    assert est.timing('reset') == 3.0
+
+
+def test_duration_estimator_measure(mocker):
+    mocker.patch('time.monotonic', side_effect=[10, 25.5])
+    est = estimator.DurationEstimator()
+    with est.measure('run', offset=12):
+        pass
+    assert est.timing('run') == 3.5
+
+
+def test_duration_estimator_measure_exception(mocker):
+    est = estimator.DurationEstimator()
+    with pytest.raises(ValueError):
+        with est.measure('run'):
+            raise ValueError()
+    assert 'run' not in est.timings
+
+
+@pytest.mark.parametrize(
+    'runs, exp_seconds', [
+        pytest.param([{'wait': 10}, {'wait': 20}], (10 + 3 + 5) + (20 + 3 + 5),
+                     id='no reflash'),
+        pytest.param([{'wait': 10, 'reset': False}, {'wait': 20}],
+                     (10 + 3) + (20 + 3 + 5),
+                     id='no reset'),
+        pytest.param([{'wait': 10}, {'wait': 20, 'env': {'FOO': 'bar'}}],
+                     (10 + 3 + 5) + (20 + 3 + 5 + 120),
+                     id='reflash due to env'),
+        pytest.param([{'wait': 10, 'rebuild': True}],
+                     10 + 3 + 5 + 120,
+                     id='rebuild'),
+        pytest.param([{'wait': 10}, {}], None, id='no wait'),
+    ]
+)
+def test_duration_estimator_estimate_runs(mocker, runs, exp_seconds):
+    runner = _mock_runner(
+        mocker, _runs({'runs': runs}),
+        needs_reflash=descs_runner.ExperimentRunner.needs_reflash,
+        coalesced=False,
+    )
+    est = estimator.DurationEstimator(run_overhead=3)
+    assert est.estimate_runs(runner) == exp_seconds
+
+
+def test_duration_estimator_estimate_runs_coalesced(mocker):
+    runner = _mock_runner(
+        mocker, _runs({'runs': [{'wait': 10}, {'wait': 20}]}),
+        needs_reflash=descs_runner.ExperimentRunner.needs_reflash,
+        coalesced=True,
+    )
+    est = estimator.DurationEstimator()
+    # first run of an experiment sharing a reservation is always reflashed
+    assert est.estimate_runs(runner) == (10 + 5 + 120) + (20 + 5)
+    assert est.estimate_runs(runner, last_run=runner.runs[0]) == \
+        (10 + 5) + (20 + 5)
+
+
+def test_duration_estimator_estimate_run_from_enclosure(mocker):
+    runner = mocker.Mock(needs_reflash=mocker.Mock(return_value=False),
+                         coalesced=False)
+    run = _runs({'run_wait': 42, 'runs': [{}]})[0]
+    est = estimator.DurationEstimator({'reset': {'mean': 1, 'count': 1}})
+    assert est.estimate_run(runner, run) == 43
+
+
+@pytest.mark.parametrize(
+    'runs, exp_duration', [
+        pytest.param([], None, id='no runs'),
+        pytest.param([{}], None, id='no wait'),
+        pytest.param([{'wait': 60}], 4, id='one run'),
+        # 120 + 10 * 65 * 1.1 = 835s
+        pytest.param(10 * [{'wait': 60}], 14, id='ten runs'),
+    ]
+)
+def test_duration_estimator_estimate_duration(mocker, runs, exp_duration):
+    runner = _mock_runner(mocker, _runs({'runs': runs}),
+                          needs_reflash=mocker.Mock(return_value=False),
+                          coalesced=False)
+    est = estimator.DurationEstimator()
+    assert est.estimate_duration(runner) == exp_duration
+    if exp_duration is not None:
+        # without the 120s setup of the reservation
+        assert est.estimate_duration(runner, overhead=False) == \
+            exp_duration - 2
+
+
+@pytest.mark.parametrize(
+    'matrix, exp_duration', [
+        # reflashed for each of the 3 values of 'A':
+        # 120 + (35 + 7 * 65 + 3 * 120) * 1.1 = 1055s
+        pytest.param({'args': {'len': [16, 32, 64]}, 'env': {'A': [1, 2, 3]},
+                      'done': '0-1'}, 18, id='env axes'),
+        # 2 runs of the product, the first include rebuilds for its env:
+        # 120 + (35 + 2 * 65 + 120 + (125 + 120)) * 1.1 = 703s
+        pytest.param({'args': {'len': [16, 32, 64]},
+                      'env': {'A': [1]}, 'exclude': [{'args': {'len': 32}}],
+                      'include': [{'wait': 120}, {'wait': 10}],
+                      'done': '4'}, 12, id='exclude and include'),
+        # 120 + (35 + 3 * 65) * 1.1 = 373s
+        pytest.param({'args': {'len': [16, 32, 64]}}, 7, id='no env axes'),
+        # 120 + 35 * 1.1 = 159s
+        pytest.param({'args': {'len': [16, 32, 64]}, 'done': '0-2'}, 3,
+                     id='all done'),
+    ]
+)
+def test_duration_estimator_estimate_duration_matrix(mocker, matrix,
+                                                     exp_duration):
+    handler = file_handler.DescriptionFileHandler('test.yaml')
+    exp = handler.load_content({123: {
+        'run_wait': 60,
+        'runs': [{'wait': 30}],
+        'matrix': matrix,
+    }})[123]
+    runner = _mock_runner(
+        mocker, exp['runs'], exp['matrix'],
+        needs_reflash=descs_runner.ExperimentRunner.needs_reflash,
+        coalesced=False,
+    )
+    est = estimator.DurationEstimator()
+    assert est.estimate_duration(runner) == exp_duration
+    # the same as estimating each generated run
+    if exp['matrix'].env_combinations:
+        return
+    runs = exp['runs'] + list(exp['matrix'].pending())
+    assert est.estimate_runs(runner) == est.estimate_runs(runner, runs)
@@ -2,8 +2,12 @@
 #
 # Distributed under terms of the MIT license.
 
+import io
 import json
+import logging
+import os
 import sys
+import time
 
 import pytest
 import yaml
@@ -168,8 +172,21 @@ def test_description_file_handler_load_dump_json(mocker):
     open_mock.assert_called_once_with('foobar.json', encoding='utf-8')
     assert res == new_res
     open_mock.reset_mock()
+    replace = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.replace'
+    )
+    fsync = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.fsync'
+    )
+    fsync = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.fsync'
+    )
     loader.dump(res)
-    open_mock.assert_called_once_with('foobar.json', 'w', encoding='utf-8')
+    open_mock.assert_called_once_with('foobar.json.tmp', 'w',
+                                      encoding='utf-8')
+    replace.assert_called_once_with('foobar.json.tmp', 'foobar.json')
+    # the file and its directory
+    assert fsync.call_count == 2
     # Accessing mock call args was only introduced in python 3.8:
     # https://bugs.python.org/issue21269
     if sys.version_info < (3, 8):
@@ -178,14 +195,16 @@ def test_description_file_handler_load_dump_json(mocker):
     for write in open_mock().write.mock_calls:
         out += write.args[0]
     assert json.loads(out) == json.loads(mock_data)
-    # check if second call creates same result
+    # second call is skipped, as the content did not change
     open_mock.reset_mock()
     loader.dump(res)
-    open_mock.assert_called_once_with('foobar.json', 'w', encoding='utf-8')
-    out = ''
-    for write in open_mock().write.mock_calls:
-        out += write.args[0]
-    assert json.loads(out) == json.loads(mock_data)
+    open_mock.assert_not_called()
+    replace.assert_called_once()
+    res['globals']['name'] = 'changed'
+    loader.dump(res)
+    open_mock.assert_called_once_with('foobar.json.tmp', 'w',
+                                      encoding='utf-8')
+    assert replace.call_count == 2
 
 
 def test_description_file_handler_load_dump_unknown_file_type():
@@ -254,8 +273,21 @@ globals:
     assert res[253655]['runs'][0]['args']['delay_ms'] == 500
     assert res[253655]['runs'][0]['name'] == 'foobar'
     open_mock.reset_mock()
+    replace = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.replace'
+    )
+    fsync = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.fsync'
+    )
+    fsync = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.fsync'
+    )
     loader.dump(res)
-    open_mock.assert_called_once_with('foobar.yaml', 'w', encoding='utf-8')
+    open_mock.assert_called_once_with('foobar.yaml.tmp', 'w',
+                                      encoding='utf-8')
+    replace.assert_called_once_with('foobar.yaml.tmp', 'foobar.yaml')
+    # the file and its directory
+    assert fsync.call_count == 2
     # Accessing mock call args was only introduced in python 3.8:
     # https://bugs.python.org/issue21269
     if sys.version_info < (3, 8):
@@ -265,15 +297,16 @@ globals:
         out += write.args[0]
     assert yaml.load(out, Loader=yaml.FullLoader) == \
            yaml.load(mock_data, Loader=yaml.FullLoader)
-    # check if second call creates same result
+    # second call is skipped, as the content did not change
     open_mock.reset_mock()
     loader.dump(res)
-    open_mock.assert_called_once_with('foobar.yaml', 'w', encoding='utf-8')
-    out = ''
-    for write in open_mock().write.mock_calls:
-        out += write.args[0]
-    assert yaml.load(out, Loader=yaml.FullLoader) == \
-           yaml.load(mock_data, Loader=yaml.FullLoader)
+    open_mock.assert_not_called()
+    replace.assert_called_once()
+    res['globals']['name'] = 'changed'
+    loader.dump(res)
+    open_mock.assert_called_once_with('foobar.yaml.tmp', 'w',
+                                      encoding='utf-8')
+    assert replace.call_count == 2
 
 
 def test_description_file_handler_load_only_unscheduled_dict(mocker):
@@ -315,6 +348,29 @@ unscheduled:
     assert res['unscheduled'][0]['runs'][0]['args']['delay_ms'] == 500
 
 
+def test_description_file_handler_load_coalesced(mocker):
+    mock_data = """
+globals:
+  name: foobar
+  run_wait: 10
+123456:
+- runs:
+  - {}
+- name: snafu
+  runs:
+  - wait: 20"""
+    open_mock = mocker.mock_open(read_data=mock_data)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
+                 open_mock)
+    loader = file_handler.DescriptionFileHandler(filename='foobar.yaml')
+    res = loader.load()
+    assert len(res[123456]) == 2
+    assert res[123456][0]['name'] == 'foobar'
+    assert res[123456][0]['runs'][0]['wait'] == 10
+    assert res[123456][1]['name'] == 'snafu'
+    assert res[123456][1]['runs'][0]['wait'] == 20
+
+
 def test_description_file_handler_load_invalid_keys(mocker):
     mock_data = """
 globals:
@@ -357,3 +413,335 @@ unscheduled:
     loader = file_handler.DescriptionFileHandler(filename='foobar.yaml')
     with pytest.raises(file_handler.DescriptionError):
         loader.load()
+
+
+JOURNAL_DATA = """
+globals:
+  run_wait: 10
+unscheduled:
+- name: one
+  runs:
+  - name: a
+  - name: b
+- name: two
+  runs:
+  - name: c
+"""
+
+
+@pytest.fixture
+def desc_file(tmp_path):
+    path = tmp_path / 'descs.yaml'
+    path.write_text(JOURNAL_DATA)
+    yield str(path)
+
+
+def _schedule_and_run_first(handler, descs):
+    # mirrors what the dispatcher does before recording the progress
+    descs[1234] = descs['unscheduled'].pop(1)
+    handler.record(descs, op='scheduled', exp_id=1234, unscheduled=[1])
+    del descs[1234]['runs'][0]
+    handler.record(descs, op='run_done', exp_id=1234, exp=None, run=0)
+
+
+def test_description_file_handler_journal(desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    _schedule_and_run_first(handler, descs)
+    with open(desc_file, encoding='utf-8') as desc:
+        # only the journal was written
+        assert desc.read() == JOURNAL_DATA
+    with open(handler.journal_filename, encoding='utf-8') as journal:
+        entries = [json.loads(line) for line in journal]
+    assert entries[1:] == [
+        {'op': 'scheduled', 'exp_id': 1234, 'unscheduled': [1]},
+        {'op': 'run_done', 'exp_id': 1234, 'exp': None, 'run': 0},
+    ]
+    # replayed and compacted on load
+    replayed = file_handler.DescriptionFileHandler(desc_file).load()
+    assert replayed == descs
+    assert not os.path.exists(handler.journal_filename)
+    with open(desc_file, encoding='utf-8') as desc:
+        assert yaml.safe_load(desc) == {
+            'globals': {'run_wait': 10},
+            'unscheduled': [{'name': 'one',
+                             'runs': [{'name': 'a'}, {'name': 'b'}]}],
+            1234: {'name': 'two', 'runs': []},
+        }
+
+
+def test_description_file_handler_journal_stale(caplog, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    _schedule_and_run_first(handler, descs)
+    with open(handler.journal_filename, encoding='utf-8') as journal:
+        content = journal.read()
+    handler.dump(descs)
+    # e.g. the process was killed before the journal was removed in dump()
+    with open(handler.journal_filename, 'w', encoding='utf-8') as journal:
+        journal.write(content)
+    with caplog.at_level(logging.WARNING):
+        assert file_handler.DescriptionFileHandler(desc_file).load() == descs
+    assert 'does not belong to' in caplog.text
+    assert not os.path.exists(handler.journal_filename)
+
+
+def test_description_file_handler_journal_incomplete(caplog, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    _schedule_and_run_first(handler, descs)
+    with open(handler.journal_filename, 'a', encoding='utf-8') as journal:
+        journal.write('{"op": "run_do')
+    with caplog.at_level(logging.WARNING):
+        assert file_handler.DescriptionFileHandler(desc_file).load() == descs
+    assert 'Ignoring incomplete entry' in caplog.text
+
+
+def test_description_file_handler_journal_invalid_entry(caplog, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    handler.record(descs, op='run_done', exp_id=1234, exp=None, run=0)
+    handler.record(descs, op='foobar')
+    with caplog.at_level(logging.WARNING):
+        assert file_handler.DescriptionFileHandler(desc_file).load() == descs
+    assert "Ignoring journal entry {'op': 'run_done'" in caplog.text
+    assert "Unknown journal operation 'foobar'" in caplog.text
+
+
+def test_description_file_handler_journal_compaction(mocker, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    monotonic = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.time.monotonic',
+        return_value=time.monotonic() + handler.COMPACT_INTERVAL
+    )
+    dump = mocker.spy(handler, 'dump')
+    _schedule_and_run_first(handler, descs)
+    # compacted on the first entry, journaled after that
+    dump.assert_called_once_with(descs)
+    assert os.path.exists(handler.journal_filename)
+    handler.compact(descs)
+    assert dump.call_count == 2
+    assert not os.path.exists(handler.journal_filename)
+    handler.compact(descs)
+    assert dump.call_count == 2
+    monotonic.assert_called()
+
+
+def test_description_file_handler_dump_interrupted(mocker, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    del descs['unscheduled']
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.os.replace',
+        side_effect=KeyboardInterrupt
+    )
+    with pytest.raises(KeyboardInterrupt):
+        handler.dump(descs)
+    with open(desc_file, encoding='utf-8') as desc:
+        assert desc.read() == JOURNAL_DATA
+
+
+def test_description_file_handler_dump_unchanged(mocker, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file)
+    descs = handler.load()
+    handler.dump(descs)
+    replace = mocker.spy(os, 'replace')
+    handler.dump(descs)
+    replace.assert_not_called()
+    descs['globals']['run_wait'] = 20
+    handler.dump(descs)
+    replace.assert_called_once_with(f'{desc_file}.tmp', desc_file)
+    assert file_handler.DescriptionFileHandler(desc_file).load() == descs
+
+
+MATRIX_DATA = """
+globals:
+  env:
+    BOARD: iotlab-m3
+1234:
+  name: sweep
+  run_wait: 10
+  matrix:
+    args:
+      data_len: [16, 32, 64]
+      delay_ms: [100, 500]
+    env:
+      MODE: [hwr, sfr]
+    exclude:
+    - args:
+        data_len: 64
+      env:
+        MODE: sfr
+    include:
+    - args:
+        data_len: 1024
+      wait: 60
+"""
+
+
+def test_description_file_handler_matrix(tmp_path):
+    desc_file = tmp_path / 'descs.yaml'
+    desc_file.write_text(MATRIX_DATA)
+    handler = file_handler.DescriptionFileHandler(str(desc_file))
+    descs = handler.load()
+    matrix = descs[1234]['matrix']
+    assert isinstance(matrix, file_handler.RunMatrix)
+    assert matrix.size == 13
+    assert descs[1234]['runs'] == []
+    runs = list(matrix.pending())
+    assert len(runs) == 11
+    assert matrix.num_pending() == 11
+    assert matrix.env_combinations == 2
+    assert all(isinstance(run, file_handler.NestedDescriptionBase)
+               for run in runs)
+    assert runs[0]['args'] == {'data_len': 16, 'delay_ms': 100}
+    assert runs[0].env == {'BOARD': 'iotlab-m3', 'MODE': 'hwr'}
+    assert runs[0]['wait'] == 10
+    assert runs[-1]['args'] == {'data_len': 1024}
+    assert runs[-1]['wait'] == 60
+    assert runs[-1].env == {'BOARD': 'iotlab-m3'}
+    matrix.mark_done(0)
+    handler.record(descs, op='matrix_done', exp_id=1234, exp=None, run=0)
+    # replayed from the journal
+    reloaded = file_handler.DescriptionFileHandler(str(desc_file)).load()
+    assert reloaded[1234]['matrix']['done'] == '0'
+    with open(desc_file, encoding='utf-8') as desc:
+        dumped = yaml.safe_load(desc)
+    assert dumped[1234]['matrix'] == dict(yaml.safe_load(MATRIX_DATA)[1234]
+                                          ['matrix'], done='0')
+    assert len(list(reloaded[1234]['matrix'].pending())) == 10
+    # the count is kept up to date without going through the matrix again
+    matrix = reloaded[1234]['matrix']
+    assert matrix.num_pending() == 10
+    for idx in [0, 5, 11, 12]:
+        # 0 was done already, 11 is excluded
+        matrix.mark_done(idx)
+    assert matrix.num_pending() == 8 == len(list(matrix.pending()))
+    assert matrix.num_pending_product() == 8
+
+
+def test_description_file_handler_matrix_large(tmp_path):
+    desc_file = tmp_path / 'descs.json'
+    desc_file.write_text(json.dumps({'1234': {'matrix': {
+        'args': {f'arg{i}': list(range(10)) for i in range(6)},
+        'done': '0-499999',
+    }}}))
+    handler = file_handler.DescriptionFileHandler(str(desc_file))
+    descs = handler.load()
+    matrix = descs[1234]['matrix']
+    assert matrix.size == 10 ** 6
+    assert matrix.run(123456)['args'] == {
+        'arg0': 1, 'arg1': 2, 'arg2': 3, 'arg3': 4, 'arg4': 5, 'arg5': 6,
+    }
+    assert next(matrix.pending_indices()) == 500000
+    assert matrix.num_pending() == 500000
+    matrix.mark_done(500000)
+    matrix.mark_done(999999)
+    assert matrix.num_pending() == 499998
+    handler.dump(descs)
+    with open(desc_file, encoding='utf-8') as desc:
+        assert json.load(desc)['1234']['matrix']['done'] == \
+            '0-500000+999999'
+    with pytest.raises(IndexError):
+        matrix.run(10 ** 6)
+
+
+@pytest.mark.parametrize(
+    'matrix', [
+        pytest.param('foobar', id='no mapping'),
+        pytest.param({'foobar': {}}, id='unknown key'),
+        pytest.param({'args': ['a', 'b']}, id='args no mapping'),
+        pytest.param({'env': {'A': 'b'}}, id='values no list'),
+        pytest.param({'args': {'a': []}}, id='values empty'),
+        pytest.param({'exclude': {'a': 1}}, id='exclude no list'),
+        pytest.param({'include': ['a']}, id='include no mappings'),
+        pytest.param({'done': '1-a'}, id='done invalid'),
+        pytest.param({'done': '3-1'}, id='done reversed'),
+        pytest.param({'done': [1, 2]}, id='done list'),
+    ]
+)
+def test_description_file_handler_matrix_invalid(matrix):
+    handler = file_handler.DescriptionFileHandler('foobar.yaml')
+    with pytest.raises(file_handler.DescriptionError):
+        handler.load_content({1234: {'matrix': matrix}})
+
+
+def test_description_file_handler_cache(mocker, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file, cache=True)
+    descs = handler.load()
+    assert os.path.exists(handler.cache_filename)
+    load_content = mocker.spy(file_handler.DescriptionFileHandler,
+                              'load_content')
+    cached = file_handler.DescriptionFileHandler(desc_file, cache=True).load()
+    load_content.assert_not_called()
+    assert cached == descs
+    run = cached['unscheduled'][0]['runs'][0]
+    assert isinstance(run, file_handler.NestedDescriptionBase)
+    assert run['wait'] == 10
+    # touching the file does not invalidate the cache
+    os.utime(desc_file, ns=(0, 0))
+    assert file_handler.DescriptionFileHandler(desc_file,
+                                               cache=True).load() == descs
+    load_content.assert_not_called()
+    # changing it does
+    with open(desc_file, 'a', encoding='utf-8') as desc:
+        desc.write('  - name: d\n')
+    changed = file_handler.DescriptionFileHandler(desc_file, cache=True).load()
+    load_content.assert_called_once()
+    assert [r['name'] for r in changed['unscheduled'][1]['runs']] == \
+        ['c', 'd']
+
+
+def test_description_file_handler_cache_progress(mocker, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file, cache=True)
+    descs = handler.load()
+    _schedule_and_run_first(handler, descs)
+    load_content = mocker.spy(file_handler.DescriptionFileHandler,
+                              'load_content')
+    # the journal is replayed on top of the cached descriptions
+    assert file_handler.DescriptionFileHandler(desc_file,
+                                               cache=True).load() == descs
+    # and the compacted file is cached by the dump
+    assert file_handler.DescriptionFileHandler(desc_file,
+                                               cache=True).load() == descs
+    load_content.assert_not_called()
+    assert 1234 in descs
+
+
+def test_description_file_handler_cache_invalid(caplog, desc_file):
+    handler = file_handler.DescriptionFileHandler(desc_file, cache=True)
+    with open(handler.cache_filename, 'wb') as cache:
+        cache.write(b'foobar')
+    with caplog.at_level(logging.WARNING):
+        descs = handler.load()
+    assert 'Ignoring invalid cache' in caplog.text
+    assert descs == file_handler.DescriptionFileHandler(desc_file).load()
+    # replaced by a valid one
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert file_handler.DescriptionFileHandler(desc_file,
+                                                   cache=True).load() == descs
+    assert not caplog.text
+
+
+def test_description_file_handler_no_cache(desc_file):
+    file_handler.DescriptionFileHandler(desc_file).load()
+    assert not os.path.exists(f'{desc_file}.cache')
+
+
+@pytest.mark.parametrize('pure_python', [False, True])
+def test_yaml_serializer(pure_python):
+    serializer = file_handler.YAMLSerializer(pure_python=pure_python)
+    handler = file_handler.DescriptionFileHandler('foobar.yaml')
+    descs = handler.load_content(
+        serializer.load(io.StringIO(JOURNAL_DATA))
+    )
+    assert isinstance(descs['unscheduled'][0],
+                      file_handler.NestedDescriptionBase)
+    outp = io.StringIO()
+    serializer.dump(outp, descs)
+    assert yaml.safe_load(outp.getvalue()) == yaml.safe_load(JOURNAL_DATA)
+    # only safe YAML is loaded
+    with pytest.raises(yaml.YAMLError):
+        serializer.load(io.StringIO('!!python/object/apply:os.getcwd []'))
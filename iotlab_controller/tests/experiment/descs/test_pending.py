@@ -0,0 +1,68 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import itertools
+import logging
+import time
+
+import pytest
+
+from iotlab_controller.experiment.descs import estimator
+from iotlab_controller.experiment.descs import pending
+
+
+def test_pending_runs():
+    def source():
+        for i, group in enumerate([None, 1, 0, None, 1]):
+            pulled.append(i)
+            yield {'name': i} if group is None else {'name': i,
+                                                     'group': group}
+
+    pulled = []
+    runs = pending.PendingRuns(source(), num_groups=2)
+    first = next(runs.candidates(0))
+    assert first[0] == 0
+    # runs are only taken from the source when needed
+    assert pulled == [0]
+    runs.remove(first)
+    assert [idx for idx, _ in runs.candidates(1)] == [1, 3, 4]
+    # a deferred run stays in place
+    runs.remove(next(itertools.islice(runs.candidates(1), 1, None)))
+    assert [idx for idx, _ in runs.candidates(0)] == [2]
+    assert [idx for idx, _ in runs.candidates(1)] == [1, 4]
+    assert [idx for idx, _ in runs.candidates()] == []
+
+
+def test_pending_runs_invalid_group():
+    runs = pending.PendingRuns([{'group': 2}], num_groups=2)
+    with pytest.raises(pending.DescriptionError):
+        next(runs.candidates(0))
+    # without node groups 'group' is ignored
+    runs = pending.PendingRuns([{'group': 2}])
+    assert next(runs.candidates()) == (0, {'group': 2})
+
+
+@pytest.mark.parametrize('remaining, exp_idx', [
+    (None, 0),
+    # the first run is deferred in favor of the shorter second one
+    (100, 1),
+    (10, None),
+])
+def test_pending_runs_next_run(caplog, mocker, remaining, exp_idx):
+    runner = mocker.Mock(coalesced=False)
+    runner.needs_reflash.return_value = False
+    runs = pending.PendingRuns([{'wait': 200}, {'wait': 60}])
+    deadline = None if remaining is None else \
+        time.monotonic() + remaining
+    with caplog.at_level(logging.INFO):
+        idx_run = runs.next_run(runner, None, deadline,
+                                estimator.DurationEstimator())
+    if exp_idx is None:
+        assert idx_run is None
+        assert any(r.message.startswith('Remaining runs do not fit')
+                   for r in caplog.records)
+    else:
+        assert idx_run[0] == exp_idx
+    assert [idx for idx, _ in runs.candidates()] == \
+        [idx for idx in range(2) if idx != exp_idx]
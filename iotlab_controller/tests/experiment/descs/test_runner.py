@@ -9,10 +9,12 @@ import logging
 import pytest
 import subprocess
 import sys
+import threading
 import time
 import urllib
 
 import iotlab_controller.constants
+from iotlab_controller.experiment.descs import estimator
 from iotlab_controller.experiment.descs import file_handler
 from iotlab_controller.experiment.descs import runner as descs_runner
 
@@ -681,15 +683,32 @@ def test_experiment_dispatcher_init(mocker):
     dispatcher = descs_runner.ExperimentDispatcher("test.yaml")
     assert not dispatcher.runners
     assert not dispatcher.descs
+    assert not dispatcher.rolling
     assert dispatcher.filename == 'test.yaml'
     api = mocker.Mock()
-    dispatcher = descs_runner.ExperimentDispatcher("test.yaml", api=api)
+    dispatcher = descs_runner.ExperimentDispatcher("test.yaml", api=api,
+                                                   rolling=True)
     assert dispatcher.api == api
+    assert dispatcher.rolling
     assert not dispatcher.runners
     assert not dispatcher.descs
     assert dispatcher.filename == 'test.yaml'
 
 
+def test_experiment_dispatcher_ssh_multiplex(mocker):
+    api = mocker.Mock()
+    dispatcher = descs_runner.ExperimentDispatcher("test.yaml", api=api)
+    assert dispatcher.ssh_mux is None
+    dispatcher = descs_runner.ExperimentDispatcher("test.yaml", api=api,
+                                                   ssh_multiplex=True)
+    close = mocker.patch.object(dispatcher.ssh_mux, 'close')
+    mocker.patch.object(dispatcher, '_run_experiments',
+                        side_effect=RuntimeError)
+    with pytest.raises(RuntimeError):
+        dispatcher.run_experiments()
+    close.assert_called_once()
+
+
 @pytest.mark.parametrize(
     'exp_exp, descs', [
         pytest.param(0, {}, id="empty descs"),
@@ -889,6 +908,88 @@ def test_experiment_dispatcher_sched_exp(mocker, exp_dispatcher, exp_runners,
         assert descs[exp_id] == descs[exp_id]
 
 
+@pytest.mark.parametrize(
+    'exp_duration, descs', [
+        pytest.param(42, {
+            'unscheduled': {
+                'duration': 42,
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'wait': 60}],
+            },
+        }, id='explicit duration'),
+        pytest.param(20, {
+            'unscheduled': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar'}],
+            },
+        }, id='no wait'),
+        # 120s + (60s + 5s reset) * 1.1
+        pytest.param(4, {
+            'unscheduled': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'wait': 60}],
+            },
+        }, id='omitted duration'),
+        # 120s + (2 * (60s + 2s reset + 4s run overhead) + 100s reflash) * 1.1
+        pytest.param(7, {
+            'globals': {
+                'duration': 'auto',
+                'run_wait': 60,
+                'timings': {
+                    'reflash': {'mean': 100, 'count': 1},
+                    'reset': {'mean': 2, 'count': 1},
+                    'run': {'mean': 4, 'count': 1},
+                },
+            },
+            'unscheduled': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{}, {'env': {'FOO': 'bar'}}],
+            },
+        }, id='auto duration with timings'),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_sched_exp_duration(mocker, exp_dispatcher,
+                                                  exp_duration, descs):
+    mocker.patch(
+        'iotlab_controller.experiment.descs.runner.'
+        'ExperimentRunner.build_firmwares'
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.BaseExperiment._get_resources'
+    )
+    submit = mocker.patch(
+        'iotlabcli.experiment.submit_experiment',
+        return_value={'id': 123456}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    exp_dispatcher.descs = descs
+    exp_dispatcher.schedule_experiments()
+    submit.assert_called_once()
+    assert submit.call_args[0][2] == exp_duration
+
+
+@pytest.mark.parametrize('ended_early', [False, True])
+def test_experiment_dispatcher_execute_run_overhead(mocker, exp_dispatcher,
+                                                    ended_early):
+    def run(runner, run_desc, ctx):
+        # pylint: disable=unused-argument
+        if ended_early:
+            ctx['ended_early'] = True
+
+    mocker.patch.object(exp_dispatcher, '_pre_run')
+    mocker.patch.object(exp_dispatcher, '_post_run')
+    mocker.patch.object(exp_dispatcher, 'run', side_effect=run)
+    runner = mocker.Mock(coalesced=False)
+    est = estimator.DurationEstimator()
+    exp_dispatcher._execute_run(runner, {'wait': 0, 'reset': False}, None,
+                                est, {})
+    # runs ending before their 'wait' passed do not tell the run overhead
+    assert ('run' in est.timings) != ended_early
+
+
 @pytest.mark.parametrize(
     'exp_id, descs', [
         pytest.param(123455, {
@@ -970,15 +1071,836 @@ def test_experiment_dispatcher_run_exps(mocker, exp_dispatcher, descs):
     open_mock = mocker.mock_open()
     mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
                  open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
     exp_dispatcher.load_experiment_descriptions(False, False)
     exp_dispatcher.schedule_experiments()
     open_mock.reset_mock()
     exp_dispatcher.run_experiments()
-    # 1 call for each removal of runs of exp 123455
-    # 1 call for each removal of an experiment
-    assert open_mock.call_args_list == 4 * [
-        mocker.call(exp_dispatcher.filename, 'w', encoding='utf-8')
+    dump = mocker.call(f'{exp_dispatcher.filename}.tmp', 'w',
+                       encoding='utf-8')
+    journal = mocker.call(f'{exp_dispatcher.filename}.journal', 'w',
+                          encoding='utf-8')
+    # descriptions were not loaded from a file, so there is no journal for the
+    # removal of the first run of exp 123455 yet, the second is journaled,
+    # the removals of experiments are dumped
+    assert open_mock.call_args_list == [dump, journal, dump, dump]
+
+
+class GroupDispatcher(descs_runner.ExperimentDispatcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executed = []
+        # runs 'one' and 'two' only finish when running at the same time
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def run(self, runner, run, ctx, *args, **kwargs):
+        self.executed.append((run['name'], ctx['group'],
+                              sorted(n.uri for n in ctx['nodes'])))
+        if run['name'] in ['one', 'two']:
+            self.barrier.wait()
+        if run.get('args', {}).get('fail'):
+            raise RuntimeError('run failed')
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info',
+                          'm3-3.grenoble.iot-lab.info'],
+            },
+            123455: {
+                'groups': [['m3-1.grenoble.iot-lab.info'],
+                           ['m3-2.grenoble.iot-lab.info',
+                            'm3-3.grenoble.iot-lab.info']],
+                'runs': [{'name': 'one', 'group': 0},
+                         {'name': 'two', 'group': 1},
+                         {'name': 'three'},
+                         {'name': 'four', 'group': 1}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_groups(mocker, api_mock, descs):
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    reset = mocker.patch('iotlab_controller.nodes.BaseNodes.reset',
+                         autospec=True)
+    exp_dispatcher = GroupDispatcher("test.yaml", api=api_mock)
+    exp_dispatcher.load_experiment_descriptions(schedule=True, run=False)
+    runner = exp_dispatcher.runners[0]
+    exp_dispatcher.run_experiments()
+    group0 = ['m3-1.grenoble.iot-lab.info']
+    group1 = ['m3-2.grenoble.iot-lab.info', 'm3-3.grenoble.iot-lab.info']
+    executed = {name: (group, nodes)
+                for name, group, nodes in exp_dispatcher.executed}
+    assert executed['one'] == (0, group0)
+    assert executed['two'] == (1, group1)
+    assert executed['four'] == (1, group1)
+    assert executed['three'] in [(0, group0), (1, group1)]
+    assert not runner.runs
+    # only the nodes of a group are reset for its runs
+    assert sorted(sorted(c[0][0].nodes) for c in reset.call_args_list) == \
+        sorted(nodes for _, nodes in executed.values())
+    assert not exp_dispatcher.has_experiments_to_run()
+
+
+@pytest.mark.parametrize(
+    'descs, exp_error', [
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {
+                'groups': 2,
+                'runs': [{'name': 'one', 'group': 2}],
+            },
+        }, descs_runner.DescriptionError, id='unknown group'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {
+                'groups': 2,
+                'runs': [{'name': 'one', 'group': 0},
+                         {'name': 'two', 'group': 1,
+                          'args': {'fail': True}}],
+            },
+        }, RuntimeError, id='failing run'),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_groups_error(mocker, api_mock, descs,
+                                                exp_error):
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    mocker.patch('iotlab_controller.nodes.BaseNodes.reset')
+    exp_dispatcher = GroupDispatcher("test.yaml", api=api_mock)
+    exp_dispatcher.load_experiment_descriptions(schedule=True, run=False)
+    with pytest.raises(exp_error):
+        exp_dispatcher.run_experiments()
+
+
+@pytest.mark.parametrize(
+    'descs, exp_groups', [
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info',
+                          'm3-3.grenoble.iot-lab.info'],
+            },
+            123455: {},
+        }, None, id='no groups'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info',
+                          'm3-3.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': 2},
+        }, [['m3-1', 'm3-2'], ['m3-3']], id='partition'),
+        pytest.param({
+            'globals': {
+                'nodes': {
+                    'network': {
+                        'site': 'grenoble',
+                        'edgelist': [('m3-1', 'm3-3')],
+                    },
+                },
+            },
+            123455: {'groups': 3},
+        }, [['m3-1', 'm3-3']], id='partition network'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info',
+                          'm3-3.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': [['m3-2.grenoble.iot-lab.info'],
+                                ['m3-1.grenoble.iot-lab.info',
+                                 'm3-3.grenoble.iot-lab.info']]},
+        }, [['m3-2'], ['m3-1', 'm3-3']], id='listed'),
+    ], indirect=['descs']
+)
+def test_experiment_runner_get_groups(mocker, api_mock, descs, exp_groups):
+    runner = descs_runner.ExperimentRunner(mocker.Mock(), descs[123455],
+                                           exp_id=123455, api=api_mock)
+    groups = runner.get_groups()
+    if exp_groups is None:
+        assert groups is None
+    else:
+        assert [sorted(n.uri.split('.')[0] for n in group)
+                for group in groups] == exp_groups
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': 0},
+        }, id='no groups'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': ['m3-1.grenoble.iot-lab.info']},
+        }, id='not a list of lists'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': [['m3-1.grenoble.iot-lab.info'],
+                                ['m3-3.grenoble.iot-lab.info']]},
+        }, id='unknown node'),
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+            },
+            123455: {'groups': [['m3-1.grenoble.iot-lab.info'],
+                                ['m3-1.grenoble.iot-lab.info',
+                                 'm3-2.grenoble.iot-lab.info']]},
+        }, id='overlap'),
+        pytest.param({
+            'globals': {
+                'nodes': {
+                    'network': {
+                        'site': 'grenoble',
+                        'sink': 'm3-1',
+                        'edgelist': [('m3-1', 'm3-2')],
+                    },
+                },
+            },
+            123455: {'groups': 2},
+        }, id='sink'),
+    ], indirect=['descs']
+)
+def test_experiment_runner_get_groups_error(mocker, api_mock, descs):
+    runner = descs_runner.ExperimentRunner(mocker.Mock(), descs[123455],
+                                           exp_id=123455, api=api_mock)
+    with pytest.raises(descs_runner.DescriptionError):
+        runner.get_groups()
+
+
+@pytest.mark.parametrize(
+    'exp_log, descs', [
+        pytest.param(
+            'Stopped experiment 123455 after all runs, reclaimed 0:15:00 of '
+            'its reservation',
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                    'stop_when_done': True,
+                },
+                123455: {
+                    'runs': [{'name': 'one'}, {'name': 'two'}],
+                },
+            },
+            id='in globals'
+        ),
+        pytest.param(
+            'Stopped experiment 123455 after all runs, reclaimed 0:15:00 of '
+            'its reservation',
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                },
+                123455: {
+                    'stop_when_done': True,
+                    'runs': [{'name': 'one'}, {'name': 'two'}],
+                },
+            },
+            id='in experiment'
+        ),
+        pytest.param(
+            None,
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                    'stop_when_done': True,
+                },
+                123455: {
+                    'stop_when_done': False,
+                    'runs': [{'name': 'one'}, {'name': 'two'}],
+                },
+            },
+            id='overwritten in experiment'
+        ),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_exps_stop_when_done(caplog, mocker,
+                                                       exp_dispatcher,
+                                                       exp_log, descs):
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        return_value=15 * 60
+    )
+    stop = mocker.patch('iotlabcli.experiment.stop_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    open_mock = mocker.mock_open()
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
+                 open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    runner = exp_dispatcher.runners[0]
+    with caplog.at_level(logging.INFO):
+        exp_dispatcher.run_experiments()
+    assert not exp_dispatcher.descs.get(123455)
+    if exp_log is None:
+        stop.assert_not_called()
+        assert runner.exp_id == 123455
+    else:
+        stop.assert_called_once_with(exp_dispatcher.api, 123455)
+        assert not runner.experiment.is_scheduled()
+        assert exp_log in [r.message for r in caplog.records]
+
+
+@pytest.mark.parametrize(
+    'stop_when_done, stopped', [
+        ([True, True], True),
+        ([True, False], False),
+        ([False, True], False),
+    ]
+)
+def test_experiment_dispatcher_run_exps_stop_when_done_shared(
+    mocker, exp_dispatcher, stop_when_done, stopped
+):
+    descs = file_handler.DescriptionFileHandler('test.yaml').load_content({
+        'globals': {'nodes': ['m3-1.grenoble.iot-lab.info']},
+        123455: [
+            {'name': 'one', 'stop_when_done': stop_when_done[0],
+             'runs': [{'name': 'one'}]},
+            {'name': 'two', 'stop_when_done': stop_when_done[1],
+             'runs': [{'name': 'two'}]},
+        ],
+    })
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        return_value=15 * 60
+    )
+    stop = mocker.patch('iotlabcli.experiment.stop_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.record'
+    )
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    assert len(exp_dispatcher.runners) == 2
+    exp_dispatcher.run_experiments()
+    # the reservation is only stopped after its last experiment, if all
+    # experiments sharing it set 'stop_when_done'
+    assert stop.call_count == int(stopped)
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param(
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                    'stop_when_done': True,
+                },
+                123455: {
+                    'runs': [{'name': 'one'}],
+                },
+            },
+        ),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_exps_stop_when_done_failed_run(
+    mocker, exp_dispatcher, descs
+):
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    stop = mocker.patch('iotlabcli.experiment.stop_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    open_mock = mocker.mock_open()
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
+                 open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
+    exp_dispatcher.run = mocker.Mock(side_effect=RuntimeError('foobar'))
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    with pytest.raises(RuntimeError):
+        exp_dispatcher.run_experiments()
+    # experiment stays reserved for the failed run
+    stop.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param(
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                },
+                123455: {
+                    'runs': [
+                        {'name': 'one', 'wait': 100},
+                        {'name': 'two', 'wait': 500},
+                        {'name': 'three', 'wait': 50},
+                    ],
+                },
+            },
+        ),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_exps_deadline(caplog, mocker,
+                                                 exp_dispatcher, descs):
+    clock = [1000.0]
+
+    def run(runner, run, *args, **kwargs):
+        # pylint: disable=unused-argument
+        clock[0] += run['wait']
+        executed.append((runner.exp_id, run['name'], run['idx']))
+
+    executed = []
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    mocker.patch('iotlabcli.experiment.wait_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        side_effect=[300, 1000]
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.runner.'
+        'ExperimentRunner.build_firmwares'
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.BaseExperiment._get_resources'
+    )
+    mocker.patch(
+        'iotlabcli.experiment.submit_experiment',
+        return_value={'id': 123456}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    dump = mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    exp_dispatcher.run = mocker.Mock(side_effect=run)
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    with caplog.at_level(logging.INFO):
+        exp_dispatcher.run_experiments()
+    assert executed == [
+        (123455, 'one', 0),
+        (123455, 'three', 2),
+        # second run did not fit into remaining 195s of first reservation
+        (123456, 'two', 0),
+    ]
+    assert "Leaving 1 remaining run(s) of experiment 123455 for the next " \
+        "reservation" in [r.message for r in caplog.records]
+    assert not exp_dispatcher.has_experiments_to_run()
+    dump.assert_called()
+
+
+@pytest.mark.parametrize(
+    'descs, requeued', [
+        # 5min - 2min deployment can never fit 600s
+        pytest.param(
+            {
+                'globals': {'nodes': ['m3-1.grenoble.iot-lab.info']},
+                123455: {'duration': 5,
+                         'runs': [{'name': 'one', 'wait': 600}]},
+            }, False, id='never fits',
+        ),
+        pytest.param(
+            {
+                'globals': {'nodes': ['m3-1.grenoble.iot-lab.info']},
+                123455: {'duration': 20,
+                         'runs': [{'name': 'one', 'wait': 600}]},
+            }, True, id='fits next reservation',
+        ),
+        pytest.param(
+            {
+                'globals': {'nodes': ['m3-1.grenoble.iot-lab.info']},
+                123455: {'runs': [{'name': 'one', 'wait': 600}]},
+            }, True, id='auto duration',
+        ),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_exps_deadline_no_progress(
+    caplog, mocker, exp_dispatcher, descs, requeued
+):
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    mocker.patch('iotlabcli.experiment.wait_experiment')
+    # the run does not fit into the current reservation
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        return_value=300
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.BaseExperiment._get_resources'
+    )
+    submit = mocker.patch(
+        'iotlabcli.experiment.submit_experiment',
+        return_value={'id': 123456}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    exp_dispatcher.run = mocker.Mock()
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    # only run the first reservation
+    mocker.patch.object(exp_dispatcher, '_schedule_unscheduled',
+                        return_value=[])
+    requeue = mocker.spy(exp_dispatcher, '_requeue_deferred_runs')
+    with caplog.at_level(logging.INFO):
+        exp_dispatcher.run_experiments()
+    exp_dispatcher.run.assert_not_called()
+    submit.assert_not_called()
+    requeue.assert_called_once()
+    held_back = any(r.message.startswith('Not rescheduling 1 remaining '
+                                         'run(s) of experiment 123455')
+                    for r in caplog.records)
+    assert held_back != requeued
+    if not requeued:
+        # the remaining runs are kept in the description file ...
+        unscheduled = exp_dispatcher.descs['unscheduled']
+        assert [r['name'] for r in unscheduled[0]['runs']] == ['one']
+        assert not exp_dispatcher.has_experiments_to_run()
+        # ... but not scheduled again by this dispatcher
+        assert descs_runner.ExperimentDispatcher._schedule_unscheduled(
+            exp_dispatcher, exp_dispatcher.descs['unscheduled']
+        ) == []
+        submit.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param(
+            {
+                'globals': {
+                    'nodes': ['m3-1.grenoble.iot-lab.info'],
+                },
+                123455: {
+                    'runs': [{'name': 'first'}],
+                    'matrix': {
+                        'args': {'len': [16, 32]},
+                        'env': {'MODE': ['a', 'b']},
+                        'exclude': [{'args': {'len': 32},
+                                     'env': {'MODE': 'b'}}],
+                        'include': [{'name': 'extra'}],
+                        'done': '1',
+                    },
+                },
+            },
+        ),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_run_exps_matrix(mocker, exp_dispatcher,
+                                               descs):
+    def run(runner, run, *args, **kwargs):
+        # pylint: disable=unused-argument
+        executed.append((run.get('name'), run.get('args'), run.env,
+                         run['idx']))
+        # matrix runs are generated one at a time
+        generated.append(matrix_run.call_count)
+
+    executed = []
+    generated = []
+    matrix_run = mocker.spy(file_handler.RunMatrix, 'run')
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    exp_dispatcher.run = mocker.Mock(side_effect=run)
+    exp_dispatcher.load_experiment_descriptions(False, False)
+    exp_dispatcher.schedule_experiments()
+    runner = exp_dispatcher.runners[0]
+    matrix = runner.matrix
+    assert runner.num_pending_runs() == 4
+    record_progress = mocker.spy(exp_dispatcher, 'record_progress')
+    exp_dispatcher.run_experiments()
+    assert executed == [
+        ('first', None, {}, 0),
+        (None, {'len': 16}, {'MODE': 'a'}, 1),
+        (None, {'len': 16}, {'MODE': 'b'}, 2),
+        ('extra', None, {}, 3),
     ]
+    assert record_progress.call_args_list == [
+        mocker.call(op='run_done', exp_id=123455, exp=None, run=0),
+        mocker.call(op='matrix_done', exp_id=123455, exp=None, run=0),
+        mocker.call(op='matrix_done', exp_id=123455, exp=None, run=2),
+        mocker.call(op='matrix_done', exp_id=123455, exp=None, run=4),
+    ]
+    assert generated == [0, 1, 2, 3]
+    assert matrix['done'] == '0-2+4'
+    assert runner.num_pending_runs() == 0
+    assert not exp_dispatcher.has_experiments_to_run()
+
+
+@pytest.mark.parametrize(
+    'exp_offsets, descs', [
+        pytest.param((600, 600), {
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+            },
+            'unscheduled': [
+                {'name': 'one', 'runs': []},
+                {'name': 'two', 'runs': []},
+                {'name': 'three', 'runs': []},
+            ],
+        }, id='reservation end'),
+        # 1 run with 100s wait + 5s reset (default, measured for 'three' as
+        # 'one' ran already)
+        pytest.param((100, 105), {
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'stop_when_done': True,
+            },
+            'unscheduled': [
+                {'name': 'one', 'runs': [{'wait': 100}]},
+                {'name': 'two', 'runs': [{'wait': 100}]},
+                {'name': 'three', 'runs': [{'wait': 100}]},
+            ],
+        }, id='stop_when_done'),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_rolling(mocker, api_mock, exp_offsets,
+                                       descs):
+    mocker.patch(
+        'iotlab_controller.experiment.descs.runner.'
+        'ExperimentRunner.build_firmwares'
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.BaseExperiment._get_resources'
+    )
+    submitted = []
+
+    def submit(api, name, duration, resources, start_time):
+        # pylint: disable=unused-argument
+        # check that only one experiment is queued at a time
+        assert len([k for k in exp_dispatcher.descs
+                    if isinstance(k, int)]) <= 1
+        submitted.append((name, start_time))
+        return {'id': 123455 + len(submitted)}
+
+    mocker.patch('iotlabcli.experiment.submit_experiment', side_effect=submit)
+    mocker.patch('iotlabcli.experiment.wait_experiment')
+    mocker.patch('iotlabcli.experiment.stop_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        return_value=600,
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    exp_dispatcher = descs_runner.ExperimentDispatcher(
+        "test.yaml", api=api_mock, rolling=True
+    )
+    exp_dispatcher.load_experiment_descriptions(schedule=True, run=False)
+    assert submitted == [('one', None)]
+    assert len(exp_dispatcher.runners) == 1
+    assert [d['name'] for d in exp_dispatcher.descs['unscheduled']] == \
+        ['two', 'three']
+    exp_dispatcher.run_experiments()
+    assert [s[0] for s in submitted] == ['one', 'two', 'three']
+    for _, start_time in submitted[1:]:
+        # allow for some slack in case the clock ticked in between
+        assert time.time() + exp_offsets[0] - 5 <= start_time <= \
+            time.time() + exp_offsets[1]
+    assert not exp_dispatcher.has_experiments_to_run()
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 60,
+                'duration': 'auto',
+            },
+            'unscheduled': [
+                {'name': 'one', 'nodes': ['m3-1.grenoble.iot-lab.info',
+                                          'm3-2.grenoble.iot-lab.info'],
+                 'runs': [{'name': 'one'}]},
+                {'name': 'two', 'nodes': ['m3-3.grenoble.iot-lab.info'],
+                 'runs': [{'name': 'two'}]},
+                {'name': 'three', 'nodes': ['m3-2.grenoble.iot-lab.info',
+                                            'm3-1.grenoble.iot-lab.info'],
+                 'runs': [{'name': 'three'}, {'name': 'four'}]},
+                {'name': 'four', 'nodes': ['m3-2.grenoble.iot-lab.info'],
+                 'runs': [{'name': 'five'}]},
+            ],
+        }),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_coalesce(mocker, api_mock, descs):
+    mocker.patch(
+        'iotlab_controller.experiment.descs.runner.'
+        'ExperimentRunner.build_firmwares'
+    )
+    reflash = mocker.patch(
+        'iotlab_controller.experiment.descs.runner.'
+        'ExperimentRunner.reflash_firmwares'
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.BaseExperiment._get_resources'
+    )
+    submit = mocker.patch(
+        'iotlabcli.experiment.submit_experiment',
+        side_effect=[{'id': 123455}, {'id': 123456}, {'id': 123457}]
+    )
+    mocker.patch('iotlabcli.experiment.wait_experiment')
+    mocker.patch(
+        'iotlab_controller.experiment.base.BaseExperiment.remaining_time',
+        return_value=None,
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.load',
+        return_value=descs
+    )
+    mocker.patch(
+        'iotlab_controller.experiment.descs.file_handler.'
+        'DescriptionFileHandler.dump'
+    )
+    mocker.patch('time.sleep')
+    exp_dispatcher = descs_runner.ExperimentDispatcher(
+        "test.yaml", api=api_mock, coalesce=True
+    )
+    exp_dispatcher.load_experiment_descriptions(schedule=True, run=False)
+    assert submit.call_count == 3
+    # 'three' runs on the nodes of 'one', 'four' only on a subset of them
+    assert [d['name'] for d in exp_dispatcher.descs[123455]] == \
+        ['one', 'three']
+    assert exp_dispatcher.descs[123456]['name'] == 'two'
+    assert exp_dispatcher.descs[123457]['name'] == 'four'
+    # the reservation is only set up once and flashed with 'one':
+    # one: 120s + (60s + 5s reset) * 1.1 = 4 min
+    # three: (2 * (60s + 5s reset) + 120s reflash) * 1.1 = 5 min
+    assert submit.call_args_list[0][0][1:3] == ('one', 9)
+    assert submit.call_args_list[1][0][1:3] == ('two', 4)
+    assert submit.call_args_list[2][0][1:3] == ('four', 4)
+    assert [r.exp_id for r in exp_dispatcher.runners] == \
+        [123455, 123455, 123456, 123457]
+    assert [r.coalesced for r in exp_dispatcher.runners] == \
+        [False, True, False, False]
+    assert exp_dispatcher.num_experiments_to_run() == 4
+    exp_dispatcher.run_experiments()
+    # first run of each experiment coalesced into the reservation of another
+    # is flashed unconditionally
+    assert [c[1] for c in reflash.call_args_list] == [
+        {'force': False}, {'force': True}, {'force': False}, {'force': False},
+        {'force': False},
+    ]
+    assert not exp_dispatcher.has_experiments_to_run()
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+            },
+            123455: [{'name': 'one', 'runs': [{'name': 'one'}]},
+                     {'name': 'two', 'runs': []}],
+        }),
+    ], indirect=['descs']
+)
+def test_experiment_dispatcher_requeue_coalesced(mocker, exp_dispatcher,
+                                                 descs):
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running',
+                      'nodes': ['m3-1.grenoble.iot-lab.info']}
+    )
+    exp_dispatcher.descs = descs
+    exp_dispatcher.schedule_experiments()
+    assert [r.desc['name'] for r in exp_dispatcher.runners] == ['one', 'two']
+    assert all(r.exp_id == 123455 and r.coalesced
+               for r in exp_dispatcher.runners)
 
 
 @pytest.mark.parametrize(
@@ -1030,6 +1952,8 @@ def test_experiment_dispatcher_run_exps_retry_http(mocker, exp_dispatcher,
     open_mock = mocker.mock_open()
     mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
                  open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
     exp_dispatcher.load_experiment_descriptions(False, False)
     exp_dispatcher.schedule_experiments()
     open_mock.reset_mock()
@@ -1079,6 +2003,8 @@ def test_experiment_dispatcher_run_failed_reflash(mocker, exp_dispatcher,
     open_mock = mocker.mock_open()
     mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
                  open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
     exp_dispatcher.load_experiment_descriptions(False, False)
     assert "rebuild" not in descs[123455]["runs"][0]
     exp_dispatcher.schedule_experiments()
@@ -5,10 +5,14 @@
 # pylint gets confused by fixture base_node
 
 import logging
+import time
 
 import pytest
 
 from iotlab_controller.experiment.base import BaseExperiment
+from iotlab_controller.experiment.stream import LineStream
+from iotlab_controller.logs.compress import read_log
+from iotlab_controller.experiment.pty import PtyExperiment
 from iotlab_controller.experiment.tmux import TmuxExperiment
 
 from iotlab_controller.experiment.descs import tmux_runner
@@ -20,6 +24,29 @@ from iotlab_controller.tests.test_nodes import \
 from test_runner import api_mock, descs             # noqa: F401
 
 
+def _start_aggregator(experiment, output=None):
+    def send_keys(keys, *args, **kwargs):
+        # pylint: disable=unused-argument
+        if 'serial_aggregator' in keys:
+            experiment.output.feed('1634567.123;Aggregator started')
+        elif output is not None and keys in output:
+            for line in output[keys]:
+                experiment.output.feed(line)
+    return send_keys
+
+
+@pytest.fixture(autouse=True)
+def send_cmds(mocker):
+    # deliver commands one by one through the (usually mocked) send_keys()
+    def _send_cmds(self, cmds, ack=None, timeout=None):
+        # pylint: disable=unused-argument
+        for cmd in cmds:
+            self.send_keys(cmd, enter=True)
+
+    yield mocker.patch.object(TmuxExperiment, 'send_cmds', autospec=True,
+                              side_effect=_send_cmds)
+
+
 @pytest.fixture
 def tmux_exp_runner(mocker, descs, api_mock):       # noqa: F811
     dispatcher = mocker.Mock()
@@ -30,13 +57,15 @@ def tmux_exp_runner(mocker, descs, api_mock):       # noqa: F811
 
 
 @pytest.fixture
-def tmux_exp_dispatcher(descs, mocker, api_mock):   # noqa: F811
+def tmux_exp_dispatcher(descs, mocker, api_mock, tmp_path):   # noqa: F811
     mocker.patch(
         'iotlab_controller.experiment.descs.file_handler.'
         'DescriptionFileHandler.load',
         return_value=descs
     )
-    disp = tmux_runner.TmuxExperimentDispatcher('test.yaml', api=api_mock)
+    # progress of runs is written to the description file
+    disp = tmux_runner.TmuxExperimentDispatcher(str(tmp_path / 'test.yaml'),
+                                                api=api_mock)
     disp.load_experiment_descriptions(True, False)
     yield disp
 
@@ -64,6 +93,7 @@ def tmux_exp_dispatcher(descs, mocker, api_mock):   # noqa: F811
 )
 def test_tmux_exp_runner_init(mocker, api_mock, descs):   # noqa: F811
     dispatcher = mocker.Mock()
+    dispatcher.descs = descs
     runner = tmux_runner.TmuxExperimentRunner(dispatcher, descs[1337],
                                               api=api_mock)
     assert runner.exp_id is None
@@ -78,6 +108,46 @@ def test_tmux_exp_runner_init(mocker, api_mock, descs):   # noqa: F811
     assert not runner.experiment.firmwares
 
 
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {'tmux': {'backend': 'pty', 'cwd': '/tmp'}},
+            1337: {'nodes': ['m3-1.grenoble.iot-lab.info']},
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_runner_pty(mocker, api_mock, descs):   # noqa: F811
+    dispatcher = mocker.Mock()
+    dispatcher.descs = descs
+    runner = tmux_runner.TmuxExperimentRunner(dispatcher, descs[1337],
+                                              api=api_mock)
+    assert isinstance(runner.experiment, PtyExperiment)
+    start_shell = mocker.patch.object(runner.experiment, 'start_shell')
+    runner.ensure_tmux_session()
+    start_shell.assert_called_once_with(cwd='/tmp')
+    runner.experiment.process = mocker.Mock()
+    cmd = mocker.patch.object(runner.experiment, 'cmd')
+    runner.ensure_tmux_session()
+    cmd.assert_called_once_with('cd /tmp')
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {'tmux': {'backend': 'screen'}},
+            1337: {'nodes': ['m3-1.grenoble.iot-lab.info']},
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_runner_unknown_backend(mocker, api_mock,  # noqa: F811
+                                         descs):  # noqa: F811
+    dispatcher = mocker.Mock()
+    dispatcher.descs = descs
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_runner.TmuxExperimentRunner(dispatcher, descs[1337],
+                                         api=api_mock)
+
+
 @pytest.mark.parametrize(
     'descs', [
         pytest.param({
@@ -148,6 +218,64 @@ def test_tmux_exp_runner_get_tmux_cmds_no_cmds(caplog, tmux_exp_runner):
         [r.message for r in caplog.records]
 
 
+_UNTIL_NODES = ['m3-1.grenoble.iot-lab.info', 'm3-2.grenoble.iot-lab.info',
+                'm3-3.grenoble.iot-lab.info']
+
+
+@pytest.mark.parametrize(
+    'exp_patterns, exp_quorum, descs', [
+        pytest.param(None, None, {
+            1337: {'nodes': _UNTIL_NODES, 'runs': [{}]},
+        }, id='no until'),
+        pytest.param(
+            {'m3-1': ['done'], 'm3-2': ['done'], 'm3-3': ['done']}, 3, {
+                1337: {'nodes': _UNTIL_NODES, 'runs': [{'until': 'done'}]},
+            }, id='global pattern'
+        ),
+        pytest.param(
+            {'m3-1': ['a', 'b'], 'm3-2': ['a', 'b'], 'm3-3': ['a', 'b']}, 2, {
+                'globals': {'until': ['a', 'b'], 'until_quorum': 2},
+                1337: {'nodes': _UNTIL_NODES, 'runs': [{}]},
+            }, id='global patterns from enclosure'
+        ),
+        pytest.param({'m3-1': ['a'], 'm3-3': ['b', 'c']}, 1, {
+            1337: {'nodes': _UNTIL_NODES,
+                   'runs': [{'until': {'m3-1': 'a', 'm3-3': ['b', 'c']},
+                             'until_quorum': .5}]},
+        }, id='per node'),
+    ], indirect=['descs']
+)
+def test_tmux_exp_runner_get_until(tmux_exp_runner, exp_patterns,
+                                   exp_quorum):
+    until = tmux_exp_runner.get_until(tmux_exp_runner.runs[0])
+    if exp_patterns is None:
+        assert until is None
+    else:
+        assert {node: [p.pattern for p in patterns]
+                for node, patterns in until.patterns.items()} == exp_patterns
+        assert until.quorum == exp_quorum
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            1337: {'nodes': _UNTIL_NODES, 'runs': [{'until': 42}]},
+        }, id='invalid until'),
+        pytest.param({
+            1337: {'nodes': _UNTIL_NODES,
+                   'runs': [{'until': 'done', 'until_quorum': 4}]},
+        }, id='quorum too large'),
+        pytest.param({
+            1337: {'nodes': _UNTIL_NODES,
+                   'runs': [{'until': 'done', 'until_quorum': 1.5}]},
+        }, id='invalid fraction'),
+    ], indirect=['descs']
+)
+def test_tmux_exp_runner_get_until_invalid(tmux_exp_runner):
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_exp_runner.get_until(tmux_exp_runner.runs[0])
+
+
 @pytest.mark.parametrize(
     'tmux_target, descs', [
         pytest.param('foobar', {
@@ -307,10 +435,10 @@ def test_tmux_exp_dispatcher_run_without_wait(tmux_exp_dispatcher):
 def test_tmux_exp_dispatcher_run_without_site(caplog, mocker,
                                               tmux_exp_dispatcher):
     mocker.patch('time.sleep')
-    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys')
-    tmux_exp_dispatcher.runners[-1].experiment.tmux_session = mocker.Mock(
-        capture_pane=mocker.Mock(return_value=['Aggregator started'])
-    )
+    experiment = tmux_exp_dispatcher.runners[-1].experiment
+    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+                 side_effect=_start_aggregator(experiment))
+    experiment.tmux_session = mocker.Mock()
     with caplog.at_level(logging.WARNING):
         tmux_exp_dispatcher.run(tmux_exp_dispatcher.runners[-1],
                                 tmux_exp_dispatcher.runners[-1].runs[-1],
@@ -379,10 +507,10 @@ def test_tmux_exp_dispatcher_run_without_site(caplog, mocker,
 def test_tmux_exp_dispatcher_run_success(caplog, mocker, tmux_exp_dispatcher):
     mocker.patch('time.sleep')
     mocker.patch('time.asctime', return_value='soon')
-    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys')
-    tmux_exp_dispatcher.runners[-1].experiment.tmux_session = mocker.Mock(
-        capture_pane=mocker.Mock(return_value=['Aggregator started'])
-    )
+    experiment = tmux_exp_dispatcher.runners[-1].experiment
+    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+                 side_effect=_start_aggregator(experiment))
+    experiment.tmux_session = mocker.Mock()
     with caplog.at_level(logging.INFO):
         tmux_exp_dispatcher.run(tmux_exp_dispatcher.runners[-1],
                                 tmux_exp_dispatcher.runners[-1].runs[-1],
@@ -392,6 +520,446 @@ def test_tmux_exp_dispatcher_run_success(caplog, mocker, tmux_exp_dispatcher):
         [r.message for r in caplog.records]
 
 
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'tmux': {'cmds': ['start {run[name]}', 'stop'],
+                         'ack': '^> $', 'ack_timeout': 2},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_ack(mocker, send_cmds, tmux_exp_dispatcher):
+    mocker.patch('time.sleep')
+    experiment = tmux_exp_dispatcher.runners[-1].experiment
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(experiment)
+    )
+    experiment.tmux_session = mocker.Mock()
+    tmux_exp_dispatcher.run(tmux_exp_dispatcher.runners[-1],
+                            tmux_exp_dispatcher.runners[-1].runs[-1],
+                            ctx={'logname': 'assumed.log'})
+    send_cmds.assert_called_once()
+    assert send_cmds.call_args[1] == {'ack': '^> $', 'timeout': 2}
+    send_keys.assert_any_call('start foobar', enter=True)
+    send_keys.assert_any_call('stop', enter=True)
+
+
+@pytest.mark.parametrize(
+    'output, exp_msg, ended_early, descs', [
+        pytest.param(
+            ['1634567.2;m3-1;done', '1634567.3;m3-1;done',
+             '1634567.4;m3-2;foobar', '1634567.5;m3-2;done'],
+            'Run foobar finished after', True, {
+                'globals': {
+                    'run_wait': 12,
+                    'site': 'grenoble',
+                    'tmux': {'cmds': ['start']},
+                },
+                1337: {
+                    'nodes': _UNTIL_NODES,
+                    'runs': [{'name': 'foobar', 'until': '^done$',
+                              'until_quorum': 2}],
+                },
+            }, id='quorum reached'
+        ),
+        pytest.param(
+            ['1634567.2;m3-1;done', 'done'],
+            "Run foobar did not meet its 'until' condition within 0.1s "
+            "(1/2 nodes done)", False, {
+                'globals': {
+                    'run_wait': .1,
+                    'site': 'grenoble',
+                    'tmux': {'cmds': ['start']},
+                },
+                1337: {
+                    'nodes': _UNTIL_NODES,
+                    'runs': [{'name': 'foobar',
+                              'until': {'m3-1': 'done', 'm3-2': 'done'}}],
+                },
+            }, id='timeout'
+        ),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_until(caplog, mocker, tmux_exp_dispatcher,
+                                       output, exp_msg, ended_early):
+    sleep = mocker.patch('time.sleep')
+    experiment = tmux_exp_dispatcher.runners[-1].experiment
+    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+                 side_effect=_start_aggregator(experiment, {'start': output}))
+    experiment.tmux_session = mocker.Mock()
+    ctx = {'logname': 'assumed.log'}
+    with caplog.at_level(logging.INFO):
+        tmux_exp_dispatcher.run(tmux_exp_dispatcher.runners[-1],
+                                tmux_exp_dispatcher.runners[-1].runs[-1],
+                                ctx=ctx)
+    assert any(r.message.startswith(exp_msg) for r in caplog.records)
+    assert ctx.get('ended_early', False) == ended_early
+    # the run is not waited for with a fixed sleep
+    assert mocker.call(12) not in sleep.call_args_list
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'serial_aggregator': 'native',
+                'serial_aggregator_addresses': {'m3-1': 'localhost:2001'},
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar', 'until': 'done'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_native_aggregator(caplog, mocker,
+                                                   tmux_exp_dispatcher):
+    aggregator_cls = mocker.patch(
+        'iotlab_controller.experiment.descs.runner.SerialAggregator'
+    )
+    aggregator = aggregator_cls.return_value
+    aggregator.stream = LineStream()
+    aggregator.nodes = ['m3-1']
+
+    def send(node, data):
+        if data == 'start\n':
+            aggregator.stream.feed(f'1634567.2;{node};done')
+
+    aggregator.send.side_effect = send
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+    )
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.experiment.tmux_session = mocker.Mock()
+    ctx = {}
+    with caplog.at_level(logging.INFO):
+        tmux_exp_dispatcher._pre_run(runner, runner.runs[-1], ctx)
+        aggregator_cls.assert_called_once_with(
+            runner.nodes, logname='./foobar.log',
+            addresses={'m3-1': ('localhost', 2001)}
+        )
+        aggregator.start.assert_called_once()
+        assert ctx['aggregator'] == aggregator
+        tmux_exp_dispatcher.run(runner, runner.runs[-1], ctx)
+        tmux_exp_dispatcher._post_run(runner, runner.runs[-1], ctx)
+    aggregator.stop.assert_called_once()
+    assert 'aggregator' not in ctx
+    # the commands go to the nodes, not to the terminal
+    aggregator.send.assert_called_once_with('m3-1', 'start\n')
+    assert not any('start' in c[0][0] or 'serial_aggregator' in c[0][0]
+                   for c in send_keys.call_args_list)
+    assert any(r.message.startswith('Run foobar finished after')
+               for r in caplog.records)
+
+
+def test_tmux_exp_dispatcher_native_aggregator_invalid_addresses(mocker):
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_runner.TmuxExperimentDispatcher._native_aggregator(
+            mocker.Mock(),
+            {'serial_aggregator_addresses': {'m3-1': 'localhost'}}, {}, None
+        )
+
+
+def test_tmux_exp_dispatcher_send_aggregator_cmds(caplog, mocker):
+    aggregator = mocker.Mock(nodes=['m3-1', 'm3-2'], stream=LineStream())
+    aggregator.send.side_effect = lambda node, data: \
+        aggregator.stream.feed(f'1634567.2;{node};> ')
+    dispatcher = tmux_runner.TmuxExperimentDispatcher
+    dispatcher._send_aggregator_cmds(
+        aggregator, ['m3-1;ifconfig', 'm3-1,m3-2;ping', 'reboot'], ack='> $'
+    )
+    assert aggregator.send.call_args_list == [
+        mocker.call('m3-1', 'ifconfig\n'),
+        mocker.call('m3-1', 'ping\n'), mocker.call('m3-2', 'ping\n'),
+        mocker.call('m3-1', 'reboot\n'), mocker.call('m3-2', 'reboot\n'),
+    ]
+    aggregator.send.reset_mock(side_effect=True)
+    with caplog.at_level(logging.WARNING):
+        dispatcher._send_aggregator_cmds(aggregator, ['m3-2;ps'], ack='> $',
+                                         timeout=0.01)
+    assert "'m3-2;ps' was not acknowledged" in caplog.text
+    with pytest.raises(tmux_runner.DescriptionError):
+        dispatcher._send_aggregator_cmds(aggregator, ['m3-3;ps'])
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+                'groups': 2,
+                'runs': [{'name': 'foobar', 'serial_aggregator': 'native'},
+                         {'name': 'snafu'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_group(mocker, tmux_exp_dispatcher):
+    aggregator_cls = mocker.patch(
+        'iotlab_controller.experiment.descs.runner.SerialAggregator'
+    )
+    aggregator_cls.return_value.stream = LineStream()
+    mocker.patch('iotlab_controller.experiment.tmux.TmuxExperiment.send_keys')
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.experiment.tmux_session = mocker.Mock()
+    group = runner.get_groups()[1]
+    ctx = {'nodes': group, 'group': 1}
+    # the TMUX session only runs one serial_aggregator at a time
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_exp_dispatcher._pre_run(runner, runner.runs[1], ctx)
+    aggregator_cls.assert_not_called()
+    tmux_exp_dispatcher._pre_run(runner, runner.runs[0], ctx)
+    aggregator_cls.assert_called_once_with(group, logname='./foobar.log',
+                                           addresses=None)
+    tmux_exp_dispatcher._post_run(runner, runner.runs[0], ctx)
+    aggregator_cls.return_value.stop.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'site': 'grenoble',
+                'demux_logs': True,
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar', 'until': 'done'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_demux_logs(mocker, tmp_path,
+                                            tmux_exp_dispatcher):
+    mocker.patch('time.sleep')
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.desc['results_dir'] = str(tmp_path)
+    mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(runner.experiment, {'start': [
+            '1634567.2;m3-1;done', '1634567.3;m3-2;foobar',
+            '1634567.4;m3-2;done',
+        ]})
+    )
+    runner.experiment.tmux_session = mocker.Mock()
+    ctx = {}
+    tmux_exp_dispatcher._pre_run(runner, runner.runs[-1], ctx)
+    tmux_exp_dispatcher.run(runner, runner.runs[-1], ctx)
+    tmux_exp_dispatcher._post_run(runner, runner.runs[-1], ctx)
+    assert 'demux' not in ctx
+    assert (tmp_path / 'foobar.m3-1.log').read_text() == \
+        '1634567.2;m3-1;done\n'
+    assert (tmp_path / 'foobar.m3-2.log').read_text() == \
+        '1634567.3;m3-2;foobar\n1634567.4;m3-2;done\n'
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'site': 'grenoble',
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar', 'until': 'done'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_output_buffer(mocker, tmp_path,
+                                               tmux_exp_dispatcher):
+    mocker.patch('time.sleep')
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.desc['results_dir'] = str(tmp_path)
+    mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(runner.experiment, {'start': [
+            '1634567.2;m3-1;done', '1634567.3;m3-2;foobar',
+            '1634567.4;m3-2;done',
+        ]})
+    )
+    runner.experiment.tmux_session = mocker.Mock()
+    tails = {}
+
+    def post_run(runner, run, ctx, *args, **kwargs):
+        # pylint: disable=unused-argument
+        tails.update({node: ctx['output'].tail(node)
+                      for node in ctx['output'].nodes})
+        tails['wait_for'] = ctx['output'].wait_for('foo', timeout=0)
+
+    tmux_exp_dispatcher.post_run = post_run
+    ctx = {}
+    tmux_exp_dispatcher._pre_run(runner, runner.runs[-1], ctx)
+    tmux_exp_dispatcher.run(runner, runner.runs[-1], ctx)
+    tmux_exp_dispatcher._post_run(runner, runner.runs[-1], ctx)
+    assert 'output' not in ctx
+    assert tails == {
+        'm3-1': ['done'],
+        'm3-2': ['foobar', 'done'],
+        'wait_for': (1634567.3, 'm3-2', 'foobar'),
+    }
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'site': 'grenoble',
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info',
+                          'm3-2.grenoble.iot-lab.info'],
+                'runs': [{
+                    'name': 'foobar',
+                    'on_output': [
+                        {'match': r'addr (\S+)', 'node': 'm3-1',
+                         'send': 'ping {match[1]}', 'to': 'm3-2'},
+                        {'match': 'panic', 'fail': '{node} crashed'},
+                    ],
+                }],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_on_output(caplog, mocker, tmp_path,
+                                           tmux_exp_dispatcher):
+    mocker.patch('time.sleep')
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.desc['results_dir'] = str(tmp_path)
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(runner.experiment, {'start': [
+            '1634567.2;m3-1;addr fe80::1', '1634567.3;m3-2;panic',
+        ]})
+    )
+    runner.experiment.tmux_session = mocker.Mock()
+    failed = []
+
+    def post_run(runner, run, ctx, *args, **kwargs):
+        # pylint: disable=unused-argument
+        failed.append(ctx.get('failed'))
+
+    tmux_exp_dispatcher.post_run = post_run
+    ctx = {}
+    start = time.monotonic()
+    with caplog.at_level(logging.INFO):
+        tmux_exp_dispatcher._pre_run(runner, runner.runs[-1], ctx)
+        tmux_exp_dispatcher.run(runner, runner.runs[-1], ctx)
+        tmux_exp_dispatcher._post_run(runner, runner.runs[-1], ctx)
+    # run ended early
+    assert time.monotonic() - start < 12
+    send_keys.assert_any_call('m3-2;ping fe80::1', enter=True,
+                              wait_after=0)
+    assert failed == ['m3-2 crashed']
+    assert 'rules' not in ctx
+    assert 'failed' not in ctx
+    assert any(r.message == 'Run foobar failed: m3-2 crashed'
+               for r in caplog.records)
+
+
+@pytest.mark.parametrize(
+    'on_output', [
+        'panic', ['panic'], [{'fail': True}],
+        [{'match': 'panic', 'unknown': True}], [{'match': '(', 'fail': True}],
+    ]
+)
+def test_tmux_exp_dispatcher_output_rules_invalid(on_output):
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_runner.TmuxExperimentDispatcher._output_rules(
+            {'on_output': on_output}
+        )
+
+
+@pytest.mark.parametrize(
+    'descs', [
+        pytest.param({
+            'globals': {
+                'run_wait': 12,
+                'site': 'grenoble',
+                'compress_logs': {'codec': 'gzip', 'level': 1},
+                'tmux': {'cmds': ['start']},
+            },
+            1337: {
+                'nodes': ['m3-1.grenoble.iot-lab.info'],
+                'runs': [{'name': 'foobar', 'until': 'done'}],
+            },
+        }),
+    ], indirect=['descs']
+)
+def test_tmux_exp_dispatcher_run_compress_logs(mocker, tmp_path,
+                                               tmux_exp_dispatcher):
+    mocker.patch('time.sleep')
+    runner = tmux_exp_dispatcher.runners[-1]
+    runner.desc['results_dir'] = str(tmp_path)
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(runner.experiment, {'start': [
+            '$ start',
+            'm3-1;start',
+            '1634567.2;m3-1;done',
+        ]})
+    )
+    runner.experiment.tmux_session = mocker.Mock()
+    ctx = {}
+    tmux_exp_dispatcher._pre_run(runner, runner.runs[-1], ctx)
+    assert ctx['log_writer'].level == 1
+    runner.experiment.output.feed('user@grenoble:~$ serial_aggregator')
+    tmux_exp_dispatcher.run(runner, runner.runs[-1], ctx)
+    tmux_exp_dispatcher._post_run(runner, runner.runs[-1], ctx)
+    assert 'log_writer' not in ctx
+    # log is not written by the shell
+    assert not any('tee' in c[0][0] or '>>' in c[0][0]
+                   for c in send_keys.call_args_list)
+    assert list(read_log(str(tmp_path / 'foobar.log'))) == [
+        'Starting run foobar',
+        '1634567.123;Aggregator started',
+        '1634567.2;m3-1;done',
+    ]
+
+
+@pytest.mark.parametrize(
+    'compress_logs, exp', [
+        (None, None), (False, None), (True, {}), ('zstd', {'codec': 'zstd'}),
+        ({'rotate_size': 42}, {'rotate_size': 42}),
+    ]
+)
+def test_tmux_exp_dispatcher_log_compression(compress_logs, exp):
+    assert tmux_runner.TmuxExperimentDispatcher._log_compression(
+        {'compress_logs': compress_logs}
+    ) == exp
+
+
+@pytest.mark.parametrize('compress_logs', [42, {'foobar': 1}])
+def test_tmux_exp_dispatcher_log_compression_invalid(compress_logs):
+    with pytest.raises(tmux_runner.DescriptionError):
+        tmux_runner.TmuxExperimentDispatcher._log_compression(
+            {'compress_logs': compress_logs}
+        )
+
+
 @pytest.mark.parametrize(
     'tmux_exp, descs', [
         pytest.param(False, {
@@ -433,16 +1001,18 @@ def test_tmux_exp_dispatcher_run_exps(caplog, mocker, tmux_exp,
     )
     mocker.patch('time.sleep')
     mocker.patch('time.asctime', return_value='soon')
+    experiment = tmux_exp_dispatcher.runners[-1].experiment
     send_keys = mocker.patch(
-        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys'
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=_start_aggregator(experiment)
     )
     tmux_exp_dispatcher.tmux_session = mocker.Mock()
-    tmux_exp_dispatcher.runners[-1].experiment.tmux_session = mocker.Mock(
-        capture_pane=mocker.Mock(return_value=['Aggregator started'])
-    )
+    experiment.tmux_session = mocker.Mock()
     open_mock = mocker.mock_open()
     mocker.patch('iotlab_controller.experiment.descs.file_handler.open',
                  open_mock)
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.replace')
+    mocker.patch('iotlab_controller.experiment.descs.file_handler.os.fsync')
     with caplog.at_level(logging.INFO):
         tmux_exp_dispatcher.run_experiments()
     if tmux_exp:
@@ -0,0 +1,129 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import logging
+import re
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from iotlab_controller.experiment import aggregator
+from iotlab_controller.experiment import base
+
+
+class _EchoHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            self.wfile.write(line.replace(b"\n", b"\r\n"))
+
+
+@pytest.fixture
+def echo_server():
+    """
+    Creates TCP echo servers that stand in for the serial ports of nodes.
+    """
+    servers = []
+
+    def create():
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0),
+                                                 _EchoHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address
+
+    yield create
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()
+
+
+@pytest.mark.parametrize(
+    "addresses", [{}, ["localhost:2001"], {"m3-1": "localhost"},
+                  {"m3-1": "localhost:foo"}, {"m3-1": ":2001"}]
+)
+def test_parse_addresses_invalid(addresses):
+    with pytest.raises(ValueError):
+        aggregator.parse_addresses(addresses)
+
+
+def test_serial_aggregator_init():
+    aggr = aggregator.SerialAggregator(
+        ["m3-1.grenoble.iot-lab.info", "m3-2.grenoble.iot-lab.info",
+         "a8-1.grenoble.iot-lab.info"],
+        addresses={"m3-2": ("localhost", 2002)},
+    )
+    assert aggr.nodes == ["m3-1", "m3-2", "a8-1"]
+    assert aggr.addresses == {"m3-1": ("m3-1", 20000),
+                              "m3-2": ("localhost", 2002),
+                              "a8-1": ("node-a8-1", 20000)}
+
+
+def test_serial_aggregator_sync(tmp_path, echo_server):
+    logname = tmp_path / "run.log"
+    addresses = {"m3-1": echo_server(), "m3-2": echo_server()}
+    with aggregator.SerialAggregator(["m3-1", "m3-2"], logname=logname,
+                                     addresses=addresses) as aggr:
+        with aggr.stream.expect(r"m3-1;hello$") as hello, \
+                aggr.stream.expect(r"m3-2;world$") as world:
+            aggr.send("m3-1", "hello\n")
+            aggr.send("m3-2.grenoble.iot-lab.info", b"world\n")
+            assert hello.wait(5)
+            assert world.wait(5)
+    lines = logname.read_text().splitlines()
+    assert re.match(r"^\d+\.\d{6};Aggregator started$", lines[0])
+    assert sorted(line.split(";", 1)[1] for line in lines[1:]) == \
+        ["m3-1;hello", "m3-2;world"]
+
+
+def test_serial_aggregator_async(echo_server):
+    async def run():
+        async with aggregator.SerialAggregator(
+            ["m3-1"], addresses={"m3-1": echo_server()}
+        ) as aggr:
+            lines = aggr.lines()
+            first = asyncio.ensure_future(lines.__anext__())
+            # let the iteration start
+            await asyncio.sleep(0)
+            aggr.send("m3-1", "hello\n")
+            res = await asyncio.wait_for(first, 5)
+            rest = asyncio.ensure_future(lines.__anext__())
+        # iteration stops with the aggregator
+        with pytest.raises(StopAsyncIteration):
+            await asyncio.wait_for(rest, 5)
+        return res
+
+    _, node, line = asyncio.run(run())
+    assert (node, line) == ("m3-1", "hello")
+
+
+def test_serial_aggregator_unreachable_node(caplog, echo_server):
+    addresses = {"m3-1": echo_server(), "m3-2": _closed_port()}
+    with caplog.at_level(logging.WARNING):
+        with aggregator.SerialAggregator(["m3-1", "m3-2"],
+                                         addresses=addresses) as aggr:
+            with aggr.stream.expect(r"m3-1;hello$") as hello:
+                aggr.send("m3-1", "hello\n")
+                assert hello.wait(5)
+    assert any(r.message.startswith("Unable to connect to m3-2")
+               for r in caplog.records)
+
+
+def test_serial_aggregator_no_reachable_node():
+    aggr = aggregator.SerialAggregator(["m3-1"],
+                                       addresses={"m3-1": _closed_port()})
+    with pytest.raises(base.ExperimentError):
+        aggr.start()
+    # stopping a not started aggregator does nothing
+    aggr.stop()
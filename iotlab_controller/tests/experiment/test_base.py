@@ -348,6 +348,47 @@ def test_base_experiment_stop(mocker, base_experiment_scheduled):
     stop.assert_called_once()
 
 
+def test_base_experiment_end_time_unscheduled(base_experiment_unscheduled):
+    with pytest.raises(iotlab_controller.experiment.base.ExperimentError):
+        base_experiment_unscheduled.end_time()
+
+
+def test_base_experiment_end_time_not_started(mocker,
+                                              base_experiment_scheduled):
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Waiting', 'start_date': None,
+                      'submitted_duration': 20}
+    )
+    assert base_experiment_scheduled.end_time() is None
+    assert base_experiment_scheduled.remaining_time() is None
+
+
+@pytest.mark.parametrize(
+    'started_before, duration, exp_remaining', [
+        (datetime.timedelta(minutes=5), 20, 15 * 60),
+        (datetime.timedelta(minutes=25), 20, 0),
+    ]
+)
+def test_base_experiment_remaining_time(mocker, base_experiment_scheduled,
+                                        started_before, duration,
+                                        exp_remaining):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    start_date = (now - started_before).strftime(
+        iotlab_controller.experiment.base.IOTLAB_DATE_FORMAT
+    )
+    mocker.patch(
+        'iotlabcli.experiment.get_experiment',
+        return_value={'state': 'Running', 'start_date': start_date,
+                      'submitted_duration': duration}
+    )
+    assert base_experiment_scheduled.end_time() == \
+        now - started_before + datetime.timedelta(minutes=duration)
+    # allow for some slack in case the clock ticked in between
+    assert exp_remaining - 5 <= \
+        base_experiment_scheduled.remaining_time() <= exp_remaining
+
+
 def test_base_experiment_wait_unscheduled(base_experiment_unscheduled):
     assert not base_experiment_unscheduled.is_scheduled()
     with pytest.raises(iotlab_controller.experiment.base.ExperimentError):
@@ -0,0 +1,100 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+# pylint: disable=redefined-outer-name
+# pylint gets confused by fixture base_node
+
+import os
+import stat
+
+import pytest
+
+from iotlab_controller.experiment import base
+from iotlab_controller.experiment import pty
+
+# importing fixture to be used with tests, for flake8 this is confusing
+from iotlab_controller.tests.test_nodes import \
+        base_nodes_base, base_nodes     # noqa: F401
+
+
+FAKE_SERIAL_AGGREGATOR = """#!/bin/sh
+echo "1634567.1;Aggregator started"
+while read line; do echo "1634567.2;m3-1;$line"; done
+"""
+
+
+@pytest.fixture
+# using imported fixtures, for flake8 that is confusing
+def pty_exp(mocker, base_nodes):  # noqa: F811
+    mocker.patch('iotlab_controller.experiment.base.BaseExperiment.__init__')
+    exp = pty.PtyExperiment('test-experiment', base_nodes, shell='/bin/sh')
+    # BaseExperiment is mocked, so we need to provide the values needed for
+    # tests
+    exp.exp_id = 12345
+    exp.username = 'user'
+    yield exp
+    exp.stop_shell()
+
+
+@pytest.fixture
+def serial_aggregator(monkeypatch, tmp_path):
+    script = tmp_path / 'serial_aggregator'
+    script.write_text(FAKE_SERIAL_AGGREGATOR)
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    yield script
+
+
+def test_pty_experiment_cmd(pty_exp, tmp_path):
+    pty_exp.start_shell(cwd=tmp_path)
+    assert pty_exp.start_shell() is pty_exp.process
+    with pty_exp.output.expect(r'^(\d+);done$') as done:
+        pty_exp.cmd('echo "$((40 + 2));$(basename $PWD)" && echo "42;done"')
+        match = done.wait(5)
+    assert match is not None
+    pty_exp.stop_shell()
+    assert pty_exp.process is None
+    pty_exp.stop_shell()
+
+
+def test_pty_experiment_wo_shell(pty_exp):
+    with pytest.raises(AssertionError):
+        pty_exp.cmd('echo "test"')
+    with pytest.raises(AssertionError):
+        pty_exp.start_output_pipe()
+
+
+def test_pty_experiment_shell_not_started(mocker, pty_exp):
+    mocker.patch.object(pty_exp, "START_TIMEOUT", 0.1)
+    pty_exp.shell = "true"
+    with pytest.raises(base.ExperimentError):
+        pty_exp.start_shell()
+    assert pty_exp.process is None
+
+
+def test_pty_experiment_serial_aggregator(pty_exp,
+                                          serial_aggregator):
+    # pylint: disable=unused-argument
+    pty_exp.start_shell()
+    lines = []
+    with pty_exp.output.listening(lines.append):
+        with pty_exp.serial_aggregator(timeout=5):
+            with pty_exp.output.expect('m3-1;world$') as world:
+                pty_exp.send_cmds(['hello', 'world'])
+                assert world.wait(5) is not None
+        # C-c stopped the serial_aggregator, the shell is still there
+        # output may follow the prompt, the quotes keep the echoed command
+        # from matching
+        with pty_exp.output.expect('after$') as after:
+            pty_exp.hit_enter()
+            pty_exp.cmd("echo af''ter")
+            assert after.wait(5) is not None
+    assert '1634567.2;m3-1;hello' in lines
+
+
+def test_pty_experiment_serial_aggregator_timeout(mocker, pty_exp):
+    mocker.patch('time.sleep')
+    pty_exp.start_shell()
+    with pytest.raises(base.ExperimentError):
+        with pty_exp.serial_aggregator(timeout=.1):
+            pass
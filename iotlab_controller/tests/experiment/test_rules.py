@@ -0,0 +1,81 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+from iotlab_controller.experiment import rules
+
+
+def test_rule_engine_send():
+    sent = []
+    engine = rules.RuleEngine([
+        rules.Rule("^booted$", send="ifconfig"),
+        rules.Rule("addr (.+)", node="m3-1", send="ping {match[1]}",
+                   to=["m3-2", "m3-3"], once=True),
+    ], send=lambda node, cmd: sent.append((node, cmd)))
+    engine("1634567.1;Aggregator started")
+    engine("1634567.2;m3-1;booted")
+    engine("1634567.3;m3-2;addr fe80::2")
+    engine("1634567.4;m3-1;addr fe80::1")
+    engine("1634567.5;m3-1;addr fe80::3")
+    engine.close()
+    assert sent == [
+        ("m3-1", "ifconfig"),
+        ("m3-2", "ping fe80::1"), ("m3-3", "ping fe80::1"),
+    ]
+    assert not engine.wait(0)
+    assert engine.failure is None
+
+
+def test_rule_engine_send_error(caplog):
+    def send(node, cmd):
+        raise KeyError(node)
+
+    engine = rules.RuleEngine([rules.Rule("booted", send="ifconfig")],
+                              send=send)
+    engine("1634567.2;m3-1;booted")
+    engine_without_send = rules.RuleEngine(engine.rules)
+    engine_without_send("1634567.2;m3-1;booted")
+    assert len([r for r in caplog.records
+                if "unable to send 'ifconfig' to m3-1" in r.message]) == 2
+
+
+def test_rule_engine_shell(tmp_path):
+    out = tmp_path / "out"
+    engine = rules.RuleEngine([
+        rules.Rule("booted", shell=f"echo {{node}} >> {out}"),
+        rules.Rule("error", shell="exit 1"),
+    ])
+    engine("1634567.2;m3-1;booted")
+    engine("1634567.3;m3-2;booted")
+    engine("1634567.4;m3-2;error")
+    engine.close()
+    assert sorted(out.read_text().split()) == ["m3-1", "m3-2"]
+
+
+def test_rule_engine_shell_quoted(tmp_path):
+    out = tmp_path / "out"
+    pwned = tmp_path / "pwned"
+    engine = rules.RuleEngine([
+        rules.Rule(r"got (.*)", shell=f"echo {{match[1]}} {{message}} "
+                                      f">> {out}"),
+    ])
+    engine(f"1634567.2;m3-1;got $(touch {pwned}); touch {pwned}")
+    engine.close()
+    assert not pwned.exists()
+    assert out.read_text() == \
+        f"$(touch {pwned}); touch {pwned} got $(touch {pwned}); " \
+        f"touch {pwned}\n"
+
+
+def test_rule_engine_fail():
+    engine = rules.RuleEngine([
+        rules.Rule("panic", fail=True),
+        rules.Rule("assert", fail="assertion on {node}"),
+    ])
+    engine("1634567.2;m3-1;kernel panic")
+    engine("1634567.3;m3-2;assert")
+    assert engine.wait(0)
+    assert engine.failure == "m3-1: kernel panic"
+    engine = rules.RuleEngine(engine.rules)
+    engine("1634567.3;m3-2;assert")
+    assert engine.failure == "assertion on m3-2"
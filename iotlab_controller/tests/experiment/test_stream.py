@@ -0,0 +1,67 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import os
+import threading
+
+from iotlab_controller.experiment import stream
+
+
+def test_line_stream_remove_listener():
+    lines = []
+    line_stream = stream.LineStream()
+    line_stream.add_listener(lines.append)
+    line_stream.feed("foo")
+    line_stream.remove_listener(lines.append)
+    line_stream.remove_listener(lines.append)
+    line_stream.feed("bar")
+    assert lines == ["foo"]
+
+
+def test_expectation_timeout():
+    line_stream = stream.LineStream()
+    with line_stream.expect("started") as started:
+        line_stream.feed("foobar")
+        assert started.wait(.01) is None
+
+
+def test_output_buffer_bounded():
+    output = stream.OutputBuffer(lines=3, max_line_length=4)
+    output("foobar")
+    for i in range(5):
+        output(f"1634567.{i};m3-1;message {i}")
+    output("1634567.5;m3-2;bar")
+    assert output.nodes == ["m3-1", "m3-2"]
+    assert output.tail("m3-1") == ["mess"] * 3
+    assert output.tail("m3-1", 1) == ["mess"]
+    assert output.tail("m3-1", 0) == []
+    assert output.tail("m3-3") == []
+
+
+def test_output_buffer_wait_for():
+    output = stream.OutputBuffer()
+    output("1634567.1;m3-1;done")
+    assert output.wait_for("done", timeout=0, node="m3-2") is None
+    assert output.wait_for("done", timeout=.01, new_only=True) is None
+    timer = threading.Timer(.05, output, ["1634567.2;m3-2;done"])
+    timer.start()
+    assert output.wait_for("done", timeout=5, node="m3-2") == \
+        (1634567.2, "m3-2", "done")
+    timer.join()
+
+
+def test_fifo_reader(tmp_path):
+    fifo = os.path.join(tmp_path, "fifo")
+    os.mkfifo(fifo)
+    lines = []
+    line_stream = stream.LineStream()
+    line_stream.add_listener(lines.append)
+    reader = stream.FifoReader(fifo, line_stream, poll_interval=.01)
+    reader.start()
+    with line_stream.expect("bar$") as bar:
+        with open(fifo, "wb") as outp:
+            outp.write(b"\x1b[1mfoo\x1b[0m\r\nbar\r\nincomplete")
+        assert bar.wait(5)
+    reader.stop()
+    assert lines == ["foo", "bar", "incomplete"]
@@ -0,0 +1,13 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import pytest
+
+from iotlab_controller.experiment import terminal
+
+
+def test_terminal_experiment_abstract():
+    with pytest.raises(TypeError):
+        # pylint: disable=abstract-class-instantiated
+        terminal.TerminalExperiment('test-experiment', None)
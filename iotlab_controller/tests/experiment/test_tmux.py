@@ -21,11 +21,15 @@ from iotlab_controller.tests.test_nodes import \
 # using imported fixtures, for flake8 that is confusing
 def tmux_exp(mocker, base_nodes):  # noqa: F811
     mocker.patch('iotlab_controller.experiment.base.BaseExperiment.__init__')
+    # do not reuse panes of other tests
+    mocker.patch('iotlab_controller.experiment.tmux.TMUX_POOL',
+                 iotlab_controller.experiment.tmux.TmuxPool())
     exp = iotlab_controller.experiment.tmux.TmuxExperiment(
         'test-experiment', base_nodes
     )
     # BaseExperiment is mocked, so we need to provide the values needed for
     # tests
+    exp.name = 'test-experiment'
     exp.exp_id = 12345
     exp.username = 'user'
     yield exp
@@ -137,6 +141,44 @@ def test_tmux_experiment_init_session_existing_session(tmux_exp,
     assert session == new_session
 
 
+# using imported fixtures, for flake8 that is confusing
+def test_tmux_experiment_init_session_pool(mocker, tmux_exp,
+                                           base_nodes):  # noqa: F811
+    session = tmux_exp.initialize_tmux_session('test-session')
+    other = iotlab_controller.experiment.tmux.TmuxExperiment(
+        'other-experiment', base_nodes
+    )
+    other.name = 'other-experiment'
+    find_where = mocker.spy(other.tmux_server, 'find_where')
+    # pane is in use by tmux_exp, so other gets its own window
+    other_session = other.initialize_tmux_session('test-session')
+    find_where.assert_not_called()
+    assert other_session.get('pane_id') != session.get('pane_id')
+    assert other_session.window.name == 'other-experiment'
+    other.release_tmux_session()
+    tmux_exp.release_tmux_session()
+    third = iotlab_controller.experiment.tmux.TmuxExperiment(
+        'third-experiment', base_nodes
+    )
+    # released pane is reused from the pool without looking it up
+    assert third.initialize_tmux_session('test-session').get('pane_id') == \
+        session.get('pane_id')
+    find_where.assert_not_called()
+
+
+def test_tmux_pool_stale_pane(tmux_exp):
+    pool = iotlab_controller.experiment.tmux.TMUX_POOL
+    session = tmux_exp.initialize_tmux_session('test-session')
+    assert pool.get(('test-session', None, None)) == session
+    assert pool.get(('test-session', 'foobar', None)) is None
+    tmux_exp.tmux_server.kill_session('test-session')
+    tmux_exp.tmux_session = None
+    assert pool.get(('test-session', None, None)) is None
+    pool.put(('test-session', None, None), session)
+    assert pool.get(('test-session', None, None)) is None
+    pool.clear()
+
+
 @pytest.mark.parametrize(
     'site, with_a8, color, logname, nodes',
     [
@@ -177,7 +219,42 @@ def test_tmux_experiment_start_serial_aggregator(
         expect += " --color"
     if logname:
         expect += "| tee -a logfile.log"
-    send_keys.assert_called_with(expect, enter=True, wait_after=2)
+    send_keys.assert_called_with(expect, enter=True)
+
+
+def test_tmux_experiment_start_serial_aggregator_arglists(mocker, tmux_exp):
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys'
+    )
+    nodes = mocker.MagicMock(arglists=['grenoble,a8,1-3', 'grenoble,m3,7'])
+    tmux_exp.start_serial_aggregator(nodes=nodes)
+    send_keys.assert_called_with(
+        "serial_aggregator -i 12345 -l grenoble,a8,1-3 -l grenoble,m3,7",
+        enter=True
+    )
+
+
+def test_tmux_experiment_start_serial_aggregator_ssh_mux(mocker, tmux_exp):
+    send_keys = mocker.patch(
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys'
+    )
+    tmux_exp.ssh_mux = mocker.Mock()
+    tmux_exp.ssh_mux.prefix.return_value = \
+        "ssh -o ControlPath=/tmp/foo user@foobar.iot-lab.info"
+    tmux_exp.start_serial_aggregator("foobar")
+    tmux_exp.ssh_mux.prefix.assert_called_once_with("user", "foobar")
+    send_keys.assert_called_with(
+        "ssh -o ControlPath=/tmp/foo user@foobar.iot-lab.info "
+        "serial_aggregator -i 12345", enter=True
+    )
+    # falls back to a plain SSH connection
+    tmux_exp.ssh_mux.prefix.side_effect = subprocess.CalledProcessError(
+        255, "ssh"
+    )
+    tmux_exp.start_serial_aggregator("foobar")
+    send_keys.assert_called_with(
+        "ssh user@foobar.iot-lab.info serial_aggregator -i 12345", enter=True
+    )
 
 
 def test_tmux_experiment_stop_serial_aggregator(mocker, tmux_exp):
@@ -189,22 +266,30 @@ def test_tmux_experiment_stop_serial_aggregator(mocker, tmux_exp):
 
 
 def test_tmux_experiment_serial_aggregator_success(mocker, tmux_exp):
+    def aggregator_output(keys, *args, **kwargs):
+        # pylint: disable=unused-argument
+        if keys.startswith("serial_aggregator"):
+            tmux_exp.output.feed("foobar")
+            tmux_exp.output.feed("1634567.123;Aggregator started")
+
     send_keys = mocker.patch(
-        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys'
+        'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys',
+        side_effect=aggregator_output
     )
-    tmux_exp.tmux_server.kill_session = mocker.Mock()
+    mocker.patch.object(tmux_exp.tmux_server, 'kill_session')
     tmux_exp.tmux_session = mocker.MagicMock()
-    tmux_exp.tmux_session.capture_pane = mocker.Mock(
-        return_value=['foobar', 'Aggregator started']
-    )
     expect = "serial_aggregator -i 12345"
+    start = time.monotonic()
     with tmux_exp.serial_aggregator() as exp:
         assert tmux_exp == exp
         exp.cmd("test")
-    send_keys.assert_any_call(expect, enter=True, wait_after=2)
+    # returns as soon as the aggregator started
+    assert time.monotonic() - start < 1
+    send_keys.assert_any_call(expect, enter=True)
     send_keys.assert_any_call("test", enter=True, wait_after=0)
     # last thing done is closing the serial_aggregator
     send_keys.assert_called_with("C-c")
+    tmux_exp.tmux_session.cmd.assert_called_with("pipe-pane")
 
 
 def test_tmux_experiment_serial_aggregator_timeout(mocker, tmux_exp):
@@ -212,20 +297,67 @@ def test_tmux_experiment_serial_aggregator_timeout(mocker, tmux_exp):
         'iotlab_controller.experiment.tmux.TmuxExperiment.send_keys'
     )
     mocker.patch('time.sleep')
-    tmux_exp.tmux_server.kill_session = mocker.Mock()
+    mocker.patch.object(tmux_exp.tmux_server, 'kill_session')
     tmux_exp.tmux_session = mocker.MagicMock()
-    tmux_exp.tmux_session.capture_pane = mocker.Mock(
-        return_value=['foobar']
-    )
     expect = "serial_aggregator -i 12345"
     with pytest.raises(iotlab_controller.experiment.base.ExperimentError):
-        with tmux_exp.serial_aggregator():
+        with tmux_exp.serial_aggregator(timeout=.1):
             pass
-    send_keys.assert_any_call(expect, enter=True, wait_after=2)
+    send_keys.assert_any_call(expect, enter=True)
     # last thing done is closing the serial_aggregator
     send_keys.assert_called_with("C-c")
 
 
+def test_tmux_experiment_output_pipe(tmux_exp):
+    tmux_exp.initialize_tmux_session('test-session')
+    tmux_exp.start_output_pipe()
+    with tmux_exp.output.expect(r"^(\d+);Aggregator started$") as started:
+        tmux_exp.cmd('echo "$((40 + 2));Aggregator started"')
+        match = started.wait(5)
+    tmux_exp.stop_output_pipe()
+    assert match is not None
+    assert match.group(1) == "42"
+
+
+def test_tmux_experiment_send_cmds(tmux_exp):
+    tmux_exp.initialize_tmux_session('test-session')
+    tmux_exp.start_output_pipe()
+    lines = []
+    with tmux_exp.output.listening(lines.append), \
+            tmux_exp.output.expect(r"3;done$") as done:
+        tmux_exp.send_cmds(f'echo "{i};$(({i} + 1))"' for i in range(3))
+        tmux_exp.send_cmds(['echo "3;done"'])
+        tmux_exp.send_cmds([])
+        match = done.wait(5)
+    tmux_exp.stop_output_pipe()
+    assert match is not None
+    assert all(any(line.endswith(f'{i};{i + 1}') for line in lines)
+               for i in range(3))
+
+
+def test_tmux_experiment_send_cmds_ack(caplog, tmux_exp):
+    tmux_exp.initialize_tmux_session('test-session')
+    tmux_exp.start_output_pipe()
+    lines = []
+    with tmux_exp.output.listening(lines.append):
+        tmux_exp.send_cmds(['echo "ack $((1 + 1))"', 'echo "ack $((2 + 1))"'],
+                           ack=r"^ack \d$", timeout=5)
+        tmux_exp.send_cmds(['true'], ack=r"^ack \d$", timeout=.1)
+    tmux_exp.stop_output_pipe()
+    assert lines.index('ack 2') < lines.index('ack 3')
+    assert "'true' was not acknowledged within 0.1s" in \
+        [r.message for r in caplog.records]
+
+
+def test_tmux_experiment_paste_error(mocker, tmux_exp):
+    tmux_exp.tmux_session = mocker.Mock()
+    tmux_exp.tmux_session.server.cmd.return_value.stderr = ['no server']
+    with pytest.raises(iotlab_controller.experiment.base.ExperimentError):
+        tmux_exp.paste('foobar\n')
+    tmux_exp.tmux_session.cmd.assert_not_called()
+    tmux_exp.tmux_session = None
+
+
 def test_tmux_experiment_send_keys_wo_session(tmux_exp):
     with pytest.raises(AssertionError):
         tmux_exp.send_keys('echo "test"', wait_after=1337)
@@ -0,0 +1,61 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import gzip
+
+import pytest
+
+from iotlab_controller.logs import compress
+
+
+def test_compressed_log_writer(tmp_path):
+    logname = str(tmp_path / "run.log")
+    with compress.CompressedLogWriter(logname, codec="gzip") as writer:
+        writer("1634567.1;m3-1;Hello")
+        writer("1634567.2;m3-2;World")
+    assert writer.filename() == f"{logname}.gz"
+    with gzip.open(f"{logname}.gz", "rt") as log:
+        assert log.read() == "1634567.1;m3-1;Hello\n1634567.2;m3-2;World\n"
+    assert compress.log_parts(logname) == [f"{logname}.gz"]
+    assert list(compress.read_log(logname)) == \
+        ["1634567.1;m3-1;Hello", "1634567.2;m3-2;World"]
+    # closing twice does nothing
+    writer.close()
+
+
+def test_compressed_log_writer_rotate(tmp_path):
+    logname = str(tmp_path / "run.log")
+    lines = [f"1634567.{i};m3-1;Hello {i}" for i in range(10)]
+    with compress.CompressedLogWriter(logname, codec="gzip",
+                                      rotate_size=60) as writer:
+        for line in lines[:5]:
+            writer(line)
+    # 23 bytes per line => 2 lines per part
+    assert compress.log_parts(logname) == [
+        f"{logname}.gz", f"{logname}.1.gz", f"{logname}.2.gz"
+    ]
+    # appends to the last part, which now holds 3 lines
+    with compress.CompressedLogWriter(logname, codec="gzip",
+                                      rotate_size=60) as writer:
+        for line in lines[5:]:
+            writer(line)
+    assert compress.log_parts(logname)[-1] == f"{logname}.4.gz"
+    assert list(compress.read_log(logname)) == lines
+
+
+def test_compressed_log_writer_invalid_codec(tmp_path, monkeypatch):
+    with pytest.raises(ValueError):
+        compress.CompressedLogWriter(str(tmp_path / "run.log"),
+                                     codec="foobar")
+    monkeypatch.setattr(compress, "zstandard", None)
+    assert compress.default_codec() == "gzip"
+    with pytest.raises(ValueError):
+        compress.CompressedLogWriter(str(tmp_path / "run.log"), codec="zstd")
+
+
+def test_read_log_uncompressed(tmp_path):
+    logname = tmp_path / "run.log"
+    logname.write_text("foo\nbar\n")
+    assert list(compress.read_log(str(logname))) == ["foo", "bar"]
+    assert not compress.log_parts(str(tmp_path / "other.log"))
@@ -0,0 +1,46 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+from iotlab_controller.logs import demux
+
+
+def test_demux_log_writer(tmp_path):
+    prefix = str(tmp_path / "run")
+    with demux.DemuxLogWriter(prefix) as writer:
+        writer("1634567.0;Aggregator started")
+        writer("1634567.1;m3-1;Hello")
+        writer("1634567.2;m3-2;World")
+        writer("1634567.3;m3-1;foo;bar")
+        # nothing is written before the buffer is flushed
+        assert not (tmp_path / "run.m3-1.log").exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ["run.m3-1.log", "run.m3-2.log"]
+    assert (tmp_path / "run.m3-1.log").read_text() == \
+        "1634567.1;m3-1;Hello\n1634567.3;m3-1;foo;bar\n"
+    assert (tmp_path / "run.m3-2.log").read_text() == "1634567.2;m3-2;World\n"
+
+
+def test_demux_log_writer_flush_size(tmp_path):
+    prefix = str(tmp_path / "run")
+    writer = demux.DemuxLogWriter(prefix, flush_size=40)
+    writer("1634567.1;m3-1;Hello")
+    assert not (tmp_path / "run.m3-1.log").exists()
+    writer("1634567.2;m3-1;World")
+    assert (tmp_path / "run.m3-1.log").read_text() == \
+        "1634567.1;m3-1;Hello\n1634567.2;m3-1;World\n"
+    writer.close()
+
+
+def test_demux_log_writer_flush_interval(mocker, tmp_path):
+    monotonic = mocker.patch("time.monotonic", return_value=10)
+    prefix = str(tmp_path / "run")
+    writer = demux.DemuxLogWriter(prefix, flush_interval=2)
+    writer("1634567.1;m3-1;Hello")
+    assert not (tmp_path / "run.m3-1.log").exists()
+    monotonic.return_value = 12
+    writer("1634567.2;m3-2;World")
+    assert (tmp_path / "run.m3-1.log").read_text() == "1634567.1;m3-1;Hello\n"
+    assert (tmp_path / "run.m3-2.log").read_text() == "1634567.2;m3-2;World\n"
+    writer.flush()
+    writer.close()
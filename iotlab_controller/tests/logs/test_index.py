@@ -0,0 +1,89 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import json
+
+import pytest
+
+from iotlab_controller.logs import index
+
+
+LOG = """1634567.000000;Aggregator started
+1634567.500000;m3-1;boot
+1634568.000000;m3-2;boot
+1634571.000000;m3-1;tick 1
+1634570.900000;m3-2;tick 1
+1634585.000000;m3-1;tick 2
+1634592.000000;m3-2;tick 3
+"""
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    path = tmp_path / "run.log"
+    path.write_text(LOG)
+    yield path
+
+
+def test_log_index_update(logfile):
+    idx = index.LogIndex(str(logfile), interval=5)
+    assert not idx.buckets
+    idx.update()
+    # the out-of-order line stays in the bucket of its predecessor
+    assert idx.buckets == [326913, 326914, 326917, 326918]
+    lines = LOG.splitlines(keepends=True)
+    assert idx.offsets == [len("".join(lines[:i])) for i in (1, 3, 5, 6)]
+    assert idx.nodes == {"m3-1": {326913, 326914, 326917},
+                         "m3-2": {326913, 326914, 326918}}
+    assert idx.size == len(LOG)
+    with open(idx.filename, encoding="utf-8") as idx_file:
+        assert json.load(idx_file)["size"] == len(LOG)
+    # index is loaded from file
+    assert index.LogIndex(str(logfile), interval=5).buckets == idx.buckets
+    # index with other interval is rebuilt
+    assert not index.LogIndex(str(logfile), interval=10).buckets
+
+
+def test_log_index_update_incremental(logfile):
+    idx = index.LogIndex(str(logfile), interval=5)
+    idx.update()
+    with open(logfile, "a", encoding="utf-8") as log:
+        log.write("1634600.000000;m3-3;late\n1634601.000000;m3-3;inc")
+    idx = index.LogIndex(str(logfile), interval=5)
+    idx.update()
+    assert idx.buckets[-1] == 326920
+    assert idx.nodes["m3-3"] == {326920}
+    # the incomplete line is not indexed yet
+    assert idx.size == len(LOG) + len("1634600.000000;m3-3;late\n")
+
+
+@pytest.mark.parametrize(
+    "kwargs, exp_regions, exp_messages", [
+        ({}, [(len(LOG.splitlines()[0]) + 1, len(LOG))],
+         ["boot", "boot", "tick 1", "tick 1", "tick 2", "tick 3"]),
+        ({"nodes": ["m3-1"], "start": 1634570, "end": 1634590}, None,
+         ["tick 1", "tick 2"]),
+        ({"nodes": ["m3-2"], "start": 1634580}, None, ["tick 3"]),
+        ({"start": 1634570, "pattern": "1$"}, None, ["tick 1", "tick 1"]),
+        ({"nodes": ["m3-3"]}, [], []),
+    ]
+)
+def test_log_index_query(logfile, kwargs, exp_regions, exp_messages):
+    idx = index.LogIndex(str(logfile), interval=5)
+    res = idx.query(**kwargs)
+    if exp_regions is not None:
+        kwargs.pop("pattern", None)
+        assert idx.regions(**kwargs) == exp_regions
+    assert list(res.messages()) == exp_messages
+
+
+def test_log_index_query_regions(logfile):
+    idx = index.LogIndex(str(logfile), interval=5)
+    idx.update()
+    lines = LOG.splitlines(keepends=True)
+    # only the buckets m3-2 printed in between 1634570 and 1634595
+    assert idx.regions(nodes=["m3-2"], start=1634570) == [
+        (len("".join(lines[:3])), len("".join(lines[:5]))),
+        (len("".join(lines[:6])), len(LOG)),
+    ]
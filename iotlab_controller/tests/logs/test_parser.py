@@ -0,0 +1,79 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+
+import pytest
+
+from iotlab_controller.logs import parser
+
+
+LOG = """1634567.000000;Aggregator started
+$ echo "a;b;c"
+1634567.100000;m3-10;Hello\r
+1634567.200000;m3-2;World;!
+1634567.300000;m3-10;foobar
+1634568.000000;a8-1;Hello again
+1634569.000000;m3-2;snafu"""
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    path = tmp_path / "run.log"
+    path.write_bytes(LOG.encode())
+    yield str(path)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+@pytest.mark.parametrize("chunk_size", [parser.CHUNK_SIZE, 16])
+def test_parse_log(logfile, use_mmap, chunk_size):
+    log = parser.parse_log(logfile, use_mmap=use_mmap, chunk_size=chunk_size)
+    assert len(log) == 5
+    assert log.nodes == ["a8-1", "m3-10", "m3-2"]
+    assert log.timestamps.tolist() == [1634567.1, 1634567.2, 1634567.3,
+                                       1634568.0, 1634569.0]
+    assert [log.nodes[i] for i in log.node_ids] == \
+        ["m3-10", "m3-2", "m3-10", "a8-1", "m3-2"]
+    assert list(log.messages()) == \
+        ["Hello", "World;!", "foobar", "Hello again", "snafu"]
+    assert log[3] == (1634568.0, "a8-1", "Hello again")
+
+
+@pytest.mark.parametrize(
+    "kwargs, exp_messages", [
+        ({"nodes": ["m3-10"]}, ["Hello", "foobar"]),
+        ({"nodes": ["m3-10", "a8-1"]}, ["Hello", "foobar", "Hello again"]),
+        ({"start": 1634567.2, "end": 1634568.0}, ["World;!", "foobar"]),
+        ({"pattern": r"^Hello"}, ["Hello", "Hello again"]),
+        ({"nodes": ["m3-2"], "start": 1634568, "pattern": "u"}, ["snafu"]),
+        ({"nodes": ["m3-3"]}, []),
+    ]
+)
+def test_parse_log_filter(logfile, kwargs, exp_messages):
+    assert list(parser.parse_log(logfile, **kwargs).messages()) == \
+        exp_messages
+
+
+def test_parse_log_empty(tmp_path):
+    path = tmp_path / "run.log"
+    path.write_bytes(b"")
+    for use_mmap in [False, True]:
+        log = parser.parse_log(str(path), use_mmap=use_mmap)
+        assert len(log) == 0
+        assert log.nodes == []
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_parse_log_overlong_fields(tmp_path, use_mmap):
+    path = tmp_path / "run.log"
+    lines = [
+        "1634567.100000;m3-1;Hello",
+        # would be gathered as 20 kB wide fields for every line
+        "x" * 20000 + ";m3-1;foo",
+        "1634567.200000;" + "m" * 20000 + ";bar",
+        "1634567.300000;m3-2;World",
+    ] * 1000
+    path.write_bytes("\n".join(lines).encode())
+    log = parser.parse_log(str(path), use_mmap=use_mmap, chunk_size=4096)
+    assert len(log) == 2000
+    assert log.nodes == ["m3-1", "m3-2"]
+    assert set(log.messages()) == {"Hello", "World"}
@@ -415,6 +415,63 @@ def test_base_nodes_from_json(mocker, base_nodes, base_nodes_base):
         assert hash(nodes[uri]) == hash(base_nodes[uri])
 
 
+@pytest.mark.parametrize('num, exp_groups', [
+    (1, [['foobar-1.test', 'foobar-2.test']]),
+    (2, [['foobar-1.test'], ['foobar-2.test']]),
+    (3, [['foobar-1.test'], ['foobar-2.test']]),
+])
+def test_base_nodes_partition(base_nodes, num, exp_groups):
+    assert [sorted(group.nodes) for group in base_nodes.partition(num)] == \
+        exp_groups
+
+
+def test_base_nodes_partition_error(base_nodes):
+    with pytest.raises(ValueError):
+        base_nodes.partition(0)
+
+
+def _node_dict(uri):
+    return {
+        'archi': uri.split('-')[0],
+        'mobile': False,
+        'mobility_type': ' ',
+        'network_address': uri,
+        'site': uri.split('.')[1],
+        'uid': ' ',
+        'x': ' ',
+        'y': ' ',
+        'z': ' ',
+    }
+
+
+def test_base_nodes_arglists(mocker):
+    uris = [f'm3-{i}.grenoble.iot-lab.info' for i in range(100, 0, -1)
+            if i not in (41, 50)] + \
+        ['a8-3.grenoble.iot-lab.info', 'm3-7.lille.iot-lab.info']
+    mocker.patch(
+        'iotlab_controller.nodes.BaseNodes._fetch_all_nodes',
+        return_value=[_node_dict(uri) for uri in uris]
+    )
+    nodes = iotlab_controller.nodes.BaseNodes(uris, api=mocker.Mock())
+    assert nodes.arglists == ['grenoble,a8,3', 'grenoble,m3,1-40+42-49+51-100',
+                              'lille,m3,7']
+    with pytest.raises(AttributeError):
+        nodes.arglist   # pylint: disable=pointless-statement
+    del nodes['a8-3.grenoble.iot-lab.info']
+    del nodes['m3-7.lille.iot-lab.info']
+    assert nodes.arglist == 'grenoble,m3,1-40+42-49+51-100'
+
+
+def test_base_nodes_arglists_cached(mocker, base_nodes):
+    assert base_nodes.arglists == ['test-site,foobar,1-2']
+    id_ranges = mocker.spy(iotlab_controller.nodes, 'id_ranges')
+    assert base_nodes.arglist == 'test-site,foobar,1-2'
+    id_ranges.assert_not_called()
+    del base_nodes['foobar-2.test']
+    assert base_nodes.arglist == 'test-site,foobar,1'
+    id_ranges.assert_called_once_with([1])
+
+
 def test_networked_nodes_str(networked_nodes):
     assert str(networked_nodes) == '9604883f'
 
@@ -462,6 +519,23 @@ def test_networked_nodes_neighbors(networked_nodes):
     assert list(networked_nodes.neighbors('m3-1')) == ['m3-2']
 
 
+def test_networked_nodes_partition(networked_nodes):
+    networked_nodes.add_node('m3-3')
+    groups = networked_nodes.partition(2)
+    # connected nodes stay in the same group
+    assert [sorted(group.network.nodes()) for group in groups] == \
+        [['m3-1', 'm3-2'], ['m3-3']]
+    assert [sorted(group.nodes) for group in groups] == \
+        [['m3-1.grenoble.iot-lab.info', 'm3-2.grenoble.iot-lab.info'],
+         ['m3-3.grenoble.iot-lab.info']]
+    assert all(group.site == 'grenoble' for group in groups)
+    assert [sorted(group.network.nodes())
+            for group in networked_nodes.partition(1)] == \
+        [['m3-1', 'm3-2', 'm3-3']]
+    with pytest.raises(ValueError):
+        networked_nodes.partition(0)
+
+
 def test_sink_networked_nodes_str(sink_networked_nodes):
     assert str(sink_networked_nodes) == 'm3-1x9604883f'
 
@@ -0,0 +1,87 @@
+# Copyright (C) 2021 Freie Universität Berlin
+#
+# Distributed under terms of the MIT license.
+# pylint: disable=redefined-outer-name
+
+import os
+import stat
+import subprocess
+
+import pytest
+
+from iotlab_controller import ssh
+
+
+FAKE_SSH = """#!/bin/sh
+echo "$*" >> "$(dirname "$0")/ssh.log"
+path=""
+op=""
+master=0
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) case "$2" in ControlPath=*) path="${2#ControlPath=}";; esac
+            shift 2;;
+        -O) op="$2"; shift 2;;
+        -M) master=1; shift;;
+        -f|-N) shift;;
+        *) break;;
+    esac
+done
+shift
+if [ "$master" = 1 ]; then
+    touch "$path"
+    exit 0
+fi
+case "$op" in
+    check) test -e "$path"; exit $?;;
+    exit) rm -f "$path"; exit 0;;
+esac
+test -e "$path" || exit 255
+sh -c "$*"
+"""
+
+
+@pytest.fixture
+def fake_ssh(tmp_path):
+    script = tmp_path / 'ssh'
+    script.write_text(FAKE_SSH)
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    yield script
+
+
+def _masters_started(fake_ssh):
+    log = (fake_ssh.parent / 'ssh.log').read_text().splitlines()
+    return len([line for line in log if line.startswith('-f -N -M')])
+
+
+def test_ssh_multiplexer(fake_ssh):
+    with ssh.SSHMultiplexer(ssh=str(fake_ssh)) as mux:
+        path = mux.start('user', 'grenoble')
+        assert os.path.exists(path)
+        assert mux.start('user', 'grenoble') == path
+        assert _masters_started(fake_ssh) == 1
+        res = mux.run('user', 'grenoble', 'echo "$((40 + 2))"',
+                      stdout=subprocess.PIPE, check=True)
+        assert res.stdout == b'42\n'
+        assert mux.prefix('user', 'grenoble') == \
+            f'{fake_ssh} -o ControlPath={path} user@grenoble.iot-lab.info'
+        # master is gone
+        os.remove(path)
+        assert mux.start('user', 'grenoble') == path
+        assert _masters_started(fake_ssh) == 2
+        mux.start('user', 'lille')
+        assert _masters_started(fake_ssh) == 3
+        control_dir = mux.control_dir
+    assert not os.path.exists(control_dir)
+    assert mux.control_dir is None
+    log = (fake_ssh.parent / 'ssh.log').read_text()
+    assert '-O exit user@grenoble.iot-lab.info' in log
+    assert '-O exit user@lille.iot-lab.info' in log
+
+
+def test_ssh_multiplexer_master_fails():
+    mux = ssh.SSHMultiplexer(ssh='false')
+    with pytest.raises(subprocess.CalledProcessError):
+        mux.start('user', 'grenoble')
+    mux.close()
+    assert mux.control_dir is None
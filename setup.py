@@ -22,7 +22,9 @@ def get_requirements():
 
 extras_require = {
     "networked": ["networkx>=2.2"],
+    "parser": ["numpy"],
     "tmux": ["libtmux<0.11"],
+    "zstd": ["zstandard"],
     "all": []
 }
 